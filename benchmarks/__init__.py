@@ -0,0 +1,5 @@
+"""Performance benchmarks of the report service.
+
+They are not part of the test suite; run them from the repository root (see
+the README "Benchmarks" section).
+"""
@@ -0,0 +1,287 @@
+"""Microbenchmarks of the templates discovery and parameters inspection.
+
+For each repository size and for notebooks with and without heavy stored
+outputs, a synthetic git repository is generated and the following steps are
+timed in isolation:
+
+- ``update_git_repository``: clone then no-op update of the repository
+- ``pm.inspect_notebook``: inspection of a sample of notebooks
+- ``_get_templates``: listing with an empty index (every notebook inspected),
+  with a filled index (folder scan only) and at an unchanged commit (no scan)
+
+The results are written in JSON so runs can be compared across versions::
+
+    python -m benchmarks.discovery --sizes 10,100,1000 --output current.json
+"""
+import argparse
+import asyncio
+import json
+import os
+import platform
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+import typing as tp
+from pathlib import Path
+from types import SimpleNamespace
+
+import papermill as pm
+
+from papermill_report import __version__
+from papermill_report.handlers import ReportHandler
+from papermill_report.index import TemplateIndex
+from papermill_report.papermill_report import PapermillReport
+from papermill_report.profiles import percentile
+from papermill_report.repository import TemplateRepository
+from papermill_report.utils import update_git_repository
+
+from .templates import make_template_tree
+
+VARIANTS = {"light": 0, "heavy": 256 * 1024}
+"""Size in bytes of the outputs stored in each notebook per variant."""
+
+
+def _summarize(durations: tp.List[float]) -> tp.Dict[str, tp.Any]:
+    return {
+        "runs": len(durations),
+        "min": min(durations),
+        "median": statistics.median(durations),
+        "max": max(durations),
+    }
+
+
+async def _time(
+    function: tp.Callable[[], tp.Awaitable], repeat: int, setup: tp.Optional[tp.Callable] = None
+) -> tp.Dict[str, tp.Any]:
+    """Time an asynchronous function.
+
+    Args:
+        function: Coroutine function to time
+        repeat: Number of runs
+        setup: Function called before each run, not timed
+
+    Returns:
+        The durations summary in seconds
+    """
+    durations = []
+    for _ in range(repeat):
+        if setup is not None:
+            setup()
+        start = time.perf_counter()
+        await function()
+        durations.append(time.perf_counter() - start)
+    return _summarize(durations)
+
+
+def _head(repository: Path) -> str:
+    return subprocess.run(
+        ["git", "rev-parse", "HEAD"],
+        cwd=str(repository),
+        check=True,
+        stdout=subprocess.PIPE,
+        universal_newlines=True,
+    ).stdout.strip()
+
+
+def _repository_size(root: Path) -> int:
+    return sum(path.stat().st_size for path in root.glob("**/*.ipynb"))
+
+
+async def benchmark_git_update(source: Path, workdir: Path, repeat: int) -> tp.Dict[str, tp.Any]:
+    """Time the clone and the no-op update of a templates repository.
+
+    Args:
+        source: Templates git repository
+        workdir: Folder in which the clones are created
+        repeat: Number of runs
+
+    Returns:
+        The ``clone`` and ``update`` durations summary
+    """
+    clones = iter(range(repeat))
+    clone_dir = workdir / "clone"
+
+    def next_clone():
+        nonlocal clone_dir
+        clone_dir = workdir / f"clone_{next(clones)}"
+
+    clone = await _time(
+        lambda: update_git_repository(str(clone_dir), git_url=str(source)), repeat, next_clone
+    )
+    update = await _time(
+        lambda: update_git_repository(str(clone_dir), git_url=str(source)), repeat
+    )
+    return {"clone": clone, "update": update}
+
+
+def benchmark_inspection(
+    root: Path, paths: tp.List[str], sample: int
+) -> tp.Dict[str, tp.Any]:
+    """Time the papermill inspection of a sample of notebooks.
+
+    Args:
+        root: Templates folder
+        paths: Notebooks path relative to the root
+        sample: Maximal number of notebooks inspected
+
+    Returns:
+        The inspection durations summary per notebook in seconds
+    """
+    step = max(1, len(paths) // sample)
+    durations = []
+    for path in paths[::step][:sample]:
+        start = time.perf_counter()
+        pm.inspect_notebook(str(root / path))
+        durations.append(time.perf_counter() - start)
+    summary = _summarize(durations)
+    summary["p95"] = percentile(durations, 95)
+    return summary
+
+
+async def benchmark_listing(
+    root: Path, commit: str, cache_dir: Path, executor: str, repeat: int
+) -> tp.Dict[str, tp.Any]:
+    """Time the templates listing of `ReportHandler._get_templates`.
+
+    Args:
+        root: Templates git repository
+        commit: Repository commit SHA
+        cache_dir: Folder of the templates index files
+        executor: Inspection executor kind (``thread`` or ``process``)
+        repeat: Number of runs
+
+    Returns:
+        The ``cold`` (empty index), ``rescan`` (filled index, new scan of
+        the folder) and ``unchanged`` (same commit) durations summary
+    """
+    service = PapermillReport(inspection_executor=executor)
+    pool = service._make_inspection_executor()
+    handler = SimpleNamespace(
+        template_repository=TemplateRepository(str(root)), report_path=".", template_index=None
+    )
+    index_file = cache_dir / "template_index.json"
+
+    def empty_index():
+        if index_file.exists():
+            index_file.unlink()
+        handler.template_index = TemplateIndex(str(index_file), executor=pool)
+
+    def reload_index():
+        handler.template_index = TemplateIndex(str(index_file), executor=pool)
+
+    try:
+        cold = await _time(
+            lambda: ReportHandler._get_templates(handler, commit), repeat, empty_index
+        )
+        rescan = await _time(
+            lambda: ReportHandler._get_templates(handler, None), repeat, reload_index
+        )
+        await ReportHandler._get_templates(handler, commit)
+        unchanged = await _time(lambda: ReportHandler._get_templates(handler, commit), repeat)
+    finally:
+        pool.shutdown()
+    return {"cold": cold, "rescan": rescan, "unchanged": unchanged}
+
+
+async def run_case(
+    size: int,
+    stored_output_size: int,
+    repeat: int,
+    sample: int,
+    executor: str,
+) -> tp.Dict[str, tp.Any]:
+    """Benchmark a synthetic repository.
+
+    Args:
+        size: Number of notebooks
+        stored_output_size: Size in bytes of the outputs stored in each notebook
+        repeat: Number of runs of each step
+        sample: Maximal number of notebooks inspected by papermill
+        executor: Inspection executor kind
+
+    Returns:
+        The steps results
+    """
+    with tempfile.TemporaryDirectory(prefix=f"benchmark_discovery_{size}_") as tmp_dir:
+        source = Path(tmp_dir) / "source"
+        paths = make_template_tree(
+            source, size, cells=(3, 30), stored_output_size=stored_output_size, git=True
+        )
+        git = await benchmark_git_update(source, Path(tmp_dir), repeat)
+        inspection = benchmark_inspection(source, paths, sample)
+        cache_dir = Path(tmp_dir) / "cache"
+        cache_dir.mkdir()
+        listing = await benchmark_listing(source, _head(source), cache_dir, executor, repeat)
+        return {
+            "notebooks": size,
+            "bytes": _repository_size(source),
+            "update_git_repository": git,
+            "inspect_notebook": inspection,
+            "get_templates": listing,
+        }
+
+
+def main(argv: tp.Optional[tp.List[str]] = None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument(
+        "--sizes",
+        default="10,100,1000,10000",
+        help="Comma separated numbers of notebooks of the generated repositories",
+    )
+    parser.add_argument(
+        "--variant",
+        dest="variants",
+        action="append",
+        choices=list(VARIANTS),
+        help="Stored outputs variant (repeatable); all by default",
+    )
+    parser.add_argument(
+        "--stored-output-size",
+        type=int,
+        default=VARIANTS["heavy"],
+        help="Size in bytes of the outputs stored in each notebook of the heavy variant",
+    )
+    parser.add_argument("--repeat", type=int, default=3, help="Runs of each step")
+    parser.add_argument(
+        "--sample", type=int, default=50, help="Notebooks inspected directly by papermill"
+    )
+    parser.add_argument(
+        "--executor",
+        choices=["thread", "process"],
+        default="thread",
+        help="Inspection executor of the templates index",
+    )
+    parser.add_argument("--output", help="JSON results file; printed if omitted")
+    args = parser.parse_args(argv)
+
+    variants = dict(VARIANTS, heavy=args.stored_output_size)
+    results = {
+        "version": __version__,
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "cpus": os.cpu_count(),
+        "timestamp": time.time(),
+        "executor": args.executor,
+        "cases": [],
+    }
+    loop = asyncio.get_event_loop()
+    for variant in args.variants or list(VARIANTS):
+        for size in (int(s) for s in args.sizes.split(",")):
+            print(f"Benchmarking {size} {variant} notebooks...", file=sys.stderr)
+            case = loop.run_until_complete(
+                run_case(size, variants[variant], args.repeat, args.sample, args.executor)
+            )
+            case["variant"] = variant
+            results["cases"].append(case)
+
+    content = json.dumps(results, indent=2)
+    if args.output:
+        Path(args.output).write_text(content)
+    else:
+        print(content)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,400 @@
+"""End-to-end load benchmark of the report service.
+
+Each scenario generates a tree of notebook templates, starts the service on it
+in a subprocess and drives concurrent listing or report requests. The latency
+percentiles, the throughput and the peak resident memory of the service (and
+its child processes) are written in JSON so runs can be compared across
+versions::
+
+    python -m benchmarks.load --output current.json --compare baseline.json
+"""
+import argparse
+import asyncio
+import json
+import os
+import platform
+import socket
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import typing as tp
+from pathlib import Path
+
+from tornado.httpclient import AsyncHTTPClient, HTTPClientError
+
+from papermill_report import __version__
+from papermill_report.profiles import percentile
+from papermill_report.utils import _descendants
+
+from .templates import make_template_tree
+
+try:
+    import psutil
+except ImportError:  # Optional dependency
+    psutil = None
+
+LISTING = "listing"
+REPORT = "report"
+
+SCENARIOS = {
+    "cold": {
+        "description": "Distinct reports, each one executed",
+        "templates": 10,
+        "traffic": REPORT,
+        "distinct": None,
+        "cache": False,
+    },
+    "warm_cache": {
+        "description": "Reports served from the cache filled by a warm-up pass",
+        "templates": 10,
+        "traffic": REPORT,
+        "distinct": 10,
+        "cache": True,
+    },
+    "many_templates": {
+        "description": "Listings of a large templates tree",
+        "templates": 2000,
+        "traffic": LISTING,
+        "cache": False,
+    },
+    "big_outputs": {
+        "description": "Distinct reports with large outputs",
+        "templates": 10,
+        "traffic": REPORT,
+        "distinct": None,
+        "cache": False,
+        "output_size": 5 * 1024 * 1024,
+    },
+}
+"""Benchmark scenarios; ``distinct`` is the number of distinct reports requested
+(None for one per request) and ``output_size`` the size in bytes of the output
+printed by each report."""
+
+
+def _free_port() -> int:
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+def _process_tree_rss(pid: int) -> int:
+    """Get the resident memory in bytes of a process and its descendants."""
+    if psutil is not None:
+        try:
+            process = psutil.Process(pid)
+            processes = [process] + process.children(recursive=True)
+        except psutil.NoSuchProcess:
+            return 0
+        total = 0
+        for process in processes:
+            try:
+                total += process.memory_info().rss
+            except psutil.NoSuchProcess:
+                pass
+        return total
+
+    # Linux fallback
+    total = 0
+    for process in [pid] + _descendants(pid):
+        try:
+            status = Path(f"/proc/{process}/status").read_text()
+        except OSError:
+            continue  # Process exited meanwhile
+        for line in status.splitlines():
+            if line.startswith("VmRSS:"):
+                total += int(line.split()[1]) * 1024
+    return total
+
+
+class MemorySampler:
+    """Sample periodically the peak resident memory of a process tree.
+
+    Args:
+        pid: Root process identifier
+        interval: Sampling period in seconds
+    """
+
+    def __init__(self, pid: int, interval: float = 0.1):
+        self.pid = pid
+        self.interval = interval
+        self.peak = 0
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, daemon=True)
+
+    def _run(self):
+        while not self._stop.is_set():
+            self.peak = max(self.peak, _process_tree_rss(self.pid))
+            self._stop.wait(self.interval)
+
+    def __enter__(self) -> "MemorySampler":
+        self._thread.start()
+        return self
+
+    def __exit__(self, *args):
+        self._stop.set()
+        self._thread.join()
+
+
+class Service:
+    """Report service running in a subprocess.
+
+    Args:
+        template_dir: Templates folder
+        cache_dir: Service cache folder
+        cache: Whether to enable the report cache
+        options: Additional ``PapermillReport`` options (``name=value``)
+    """
+
+    def __init__(
+        self, template_dir: Path, cache_dir: Path, cache: bool, options: tp.List[str]
+    ):
+        self.port = _free_port()
+        self.url = f"http://127.0.0.1:{self.port}/"
+        command = [
+            sys.executable,
+            "-m",
+            "papermill_report",
+            "--PapermillReport.ip=127.0.0.1",
+            f"--PapermillReport.port={self.port}",
+            f"--PapermillReport.template_root_dir={template_dir!s}",
+            f"--PapermillReport.cache_dir={cache_dir!s}",
+            f"--PapermillReport.report_cache_size={1 << 30 if cache else 0}",
+        ] + [f"--PapermillReport.{option}" for option in options]
+        env = os.environ.copy()
+        env.pop("JUPYTERHUB_API_TOKEN", None)  # Anonymous requests
+        env.pop("JUPYTERHUB_SERVICE_PREFIX", None)
+        self._log = (cache_dir / "service.log").open("wb")
+        self.process = subprocess.Popen(
+            command, env=env, stdout=self._log, stderr=subprocess.STDOUT
+        )
+
+    async def wait_ready(self, client: AsyncHTTPClient, timeout: float = 60.0):
+        """Wait for the service to accept requests.
+
+        Raises:
+            RuntimeError: If the service exits or does not start in time
+        """
+        deadline = time.monotonic() + timeout
+        while time.monotonic() < deadline:
+            if self.process.poll() is not None:
+                raise RuntimeError(f"The service exited with code {self.process.returncode}.")
+            try:
+                await client.fetch(self.url + "metrics", request_timeout=5)
+                return
+            except (ConnectionError, OSError, HTTPClientError):
+                await asyncio.sleep(0.1)
+        raise RuntimeError("The service did not start in time.")
+
+    def stop(self):
+        """Stop the service."""
+        self.process.terminate()
+        try:
+            self.process.wait(30)
+        except subprocess.TimeoutExpired:
+            self.process.kill()
+            self.process.wait()
+        self._log.close()
+
+
+async def _drive(
+    client: AsyncHTTPClient, urls: tp.List[str], concurrency: int, timeout: float
+) -> tp.Tuple[tp.List[float], int, float]:
+    """Request URLs concurrently.
+
+    Returns:
+        The latencies in seconds of the successful requests, the number of
+        failed requests and the elapsed time in seconds
+    """
+    pending = iter(urls)
+    latencies = []  # type: tp.List[float]
+    errors = 0
+
+    async def worker():
+        nonlocal errors
+        for url in pending:
+            start = time.monotonic()
+            try:
+                await client.fetch(url, request_timeout=timeout)
+            except asyncio.CancelledError:
+                raise
+            except Exception:
+                errors += 1
+            else:
+                latencies.append(time.monotonic() - start)
+
+    start = time.monotonic()
+    await asyncio.gather(*(worker() for _ in range(concurrency)))
+    return latencies, errors, time.monotonic() - start
+
+
+def _urls(service: Service, scenario: tp.Dict, paths: tp.List[str], requests: int) -> tp.List[str]:
+    if scenario["traffic"] == LISTING:
+        return [service.url + ("api/templates/" if i % 2 else "") for i in range(requests)]
+    distinct = scenario.get("distinct") or requests
+    return [
+        f"{service.url}{paths[i % len(paths)]}?seed={i % distinct}&output_size="
+        f"{scenario.get('output_size', 0)}"
+        for i in range(requests)
+    ]
+
+
+async def run_scenario(
+    name: str,
+    requests: int,
+    concurrency: int,
+    timeout: float,
+    options: tp.List[str],
+    templates: tp.Optional[int] = None,
+) -> tp.Dict[str, tp.Any]:
+    """Run a benchmark scenario.
+
+    Args:
+        name: Scenario name (see `SCENARIOS`)
+        requests: Number of measured requests
+        concurrency: Number of concurrent requests
+        timeout: Request timeout in seconds
+        options: Additional ``PapermillReport`` options
+        templates: Number of templates overriding the scenario one
+
+    Returns:
+        The scenario results
+    """
+    scenario = SCENARIOS[name]
+    count = templates or scenario["templates"]
+    client = AsyncHTTPClient(force_instance=True, max_clients=concurrency)
+    with tempfile.TemporaryDirectory(prefix=f"benchmark_{name}_") as tmp_dir:
+        template_dir = Path(tmp_dir) / "templates"
+        cache_dir = Path(tmp_dir) / "cache"
+        cache_dir.mkdir()
+        paths = make_template_tree(template_dir, count)
+        service = Service(template_dir, cache_dir, scenario["cache"], options)
+        try:
+            with MemorySampler(service.process.pid) as memory:
+                await service.wait_ready(client)
+                urls = _urls(service, scenario, paths, requests)
+
+                # The first request pays the templates inspection or the cache filling
+                warmup = None  # type: tp.Optional[float]
+                if scenario["traffic"] == LISTING or scenario["cache"]:
+                    warmup_urls = urls[: 1 if scenario["traffic"] == LISTING else scenario["distinct"]]
+                    _, warmup_errors, warmup = await _drive(
+                        client, warmup_urls, concurrency, timeout
+                    )
+                    if warmup_errors:
+                        raise RuntimeError(f"{warmup_errors} warm-up requests failed.")
+
+                latencies, errors, elapsed = await _drive(client, urls, concurrency, timeout)
+        finally:
+            service.stop()
+            client.close()
+
+    return {
+        "description": scenario["description"],
+        "templates": count,
+        "requests": requests,
+        "concurrency": concurrency,
+        "errors": errors,
+        "warmup": warmup,
+        "elapsed": elapsed,
+        "requests_per_second": len(latencies) / elapsed if elapsed > 0 else None,
+        "latency": {
+            "p50": percentile(latencies, 50),
+            "p95": percentile(latencies, 95),
+            "p99": percentile(latencies, 99),
+            "max": max(latencies) if latencies else None,
+        },
+        "peak_rss": memory.peak,
+    }
+
+
+def compare(baseline: tp.Dict[str, tp.Any], current: tp.Dict[str, tp.Any]) -> str:
+    """Format the relative changes between two benchmark results.
+
+    Args:
+        baseline: Reference results
+        current: New results
+
+    Returns:
+        A text table of the changes per scenario
+    """
+
+    def change(old: tp.Optional[float], new: tp.Optional[float]) -> str:
+        if not old or new is None:
+            return "n/a"
+        return f"{(new - old) / old:+.1%}"
+
+    lines = [
+        f"{'scenario':<16}{'p50':>10}{'p95':>10}{'p99':>10}{'req/s':>10}{'peak RSS':>10}",
+    ]
+    for name, result in current["scenarios"].items():
+        reference = baseline.get("scenarios", {}).get(name)
+        if reference is None:
+            continue
+        lines.append(
+            f"{name:<16}"
+            + "".join(
+                f"{change(reference['latency'][q], result['latency'][q]):>10}"
+                for q in ("p50", "p95", "p99")
+            )
+            + f"{change(reference['requests_per_second'], result['requests_per_second']):>10}"
+            + f"{change(reference['peak_rss'], result['peak_rss']):>10}"
+        )
+    return "\n".join(lines)
+
+
+def main(argv: tp.Optional[tp.List[str]] = None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument(
+        "--scenario",
+        dest="scenarios",
+        action="append",
+        choices=list(SCENARIOS),
+        help="Scenario to run (repeatable); all by default",
+    )
+    parser.add_argument("--requests", type=int, default=50, help="Measured requests per scenario")
+    parser.add_argument("--concurrency", type=int, default=4, help="Concurrent requests")
+    parser.add_argument("--timeout", type=float, default=600.0, help="Request timeout in seconds")
+    parser.add_argument("--templates", type=int, help="Number of templates of every scenario")
+    parser.add_argument(
+        "--option",
+        dest="options",
+        action="append",
+        default=[],
+        metavar="NAME=VALUE",
+        help="PapermillReport option of the service (repeatable), e.g. execution_mode=worker",
+    )
+    parser.add_argument("--output", help="JSON results file; printed if omitted")
+    parser.add_argument("--compare", help="JSON results file of a previous run to compare with")
+    args = parser.parse_args(argv)
+
+    results = {
+        "version": __version__,
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "cpus": os.cpu_count(),
+        "timestamp": time.time(),
+        "options": args.options,
+        "scenarios": {},
+    }
+    loop = asyncio.get_event_loop()
+    for name in args.scenarios or list(SCENARIOS):
+        print(f"Running scenario '{name}'...", file=sys.stderr)
+        results["scenarios"][name] = loop.run_until_complete(
+            run_scenario(
+                name, args.requests, args.concurrency, args.timeout, args.options, args.templates
+            )
+        )
+
+    content = json.dumps(results, indent=2)
+    if args.output:
+        Path(args.output).write_text(content)
+    else:
+        print(content)
+    if args.compare:
+        print(compare(json.loads(Path(args.compare).read_text()), results), file=sys.stderr)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,108 @@
+"""Synthetic notebook templates for the benchmarks."""
+import json
+import subprocess
+import typing as tp
+from pathlib import Path
+
+from nbformat.v4 import new_code_cell, new_markdown_cell, new_notebook, new_output
+
+METADATA = {
+    "kernelspec": {"name": "python3", "language": "python", "display_name": "Python 3"},
+    "language_info": {"name": "python"},
+}
+
+
+def make_notebook(
+    index: int, cells: int = 5, stored_output_size: int = 0, output_size: int = 0
+) -> tp.Dict[str, tp.Any]:
+    """Build a parametrized notebook.
+
+    Args:
+        index: Notebook number, used to make its content unique
+        cells: Number of code cells after the parameters cell
+        stored_output_size: Size in bytes of the outputs stored in the notebook
+            (as committed with its outputs)
+        output_size: Default size in bytes of the output generated by its execution
+
+    Returns:
+        The notebook JSON content
+    """
+    stored = []
+    if stored_output_size > 0:
+        stored = [new_output("stream", name="stdout", text="x" * (stored_output_size // cells))]
+    notebook = new_notebook(
+        cells=[
+            new_markdown_cell(f"# Benchmark template {index}"),
+            new_code_cell(
+                f"seed = {index}  # Request identifier\noutput_size = {output_size}  # Bytes",
+                metadata={"tags": ["parameters"]},
+            ),
+        ]
+        + [
+            new_code_cell(f"value_{cell} = seed * {cell}\nvalue_{cell}", outputs=stored)
+            for cell in range(cells - 1)
+        ]
+        + [new_code_cell("print('x' * output_size)", outputs=stored)],
+        metadata=METADATA,
+    )
+    return notebook
+
+
+def make_template_tree(
+    root: Path,
+    count: int,
+    cells: tp.Union[int, tp.Tuple[int, int]] = 5,
+    stored_output_size: int = 0,
+    output_size: int = 0,
+    per_folder: int = 100,
+    git: bool = False,
+) -> tp.List[str]:
+    """Write a tree of notebook templates.
+
+    Args:
+        root: Templates folder; created if needed
+        count: Number of notebooks
+        cells: Number of code cells per notebook or its (minimum, maximum) range
+            to vary the notebooks size
+        stored_output_size: Size in bytes of the outputs stored in each notebook
+        output_size: Default size in bytes of the output generated by each notebook
+        per_folder: Number of notebooks per subfolder
+        git: Whether to commit the tree in a new git repository (on a ``master`` branch)
+
+    Returns:
+        The notebooks path relative to the root
+    """
+    low, high = (cells, cells) if isinstance(cells, int) else cells
+    paths = []
+    for index in range(count):
+        path = Path(f"folder_{index // per_folder:03d}") / f"template_{index:05d}.ipynb"
+        notebook = root / path
+        notebook.parent.mkdir(parents=True, exist_ok=True)
+        notebook.write_text(
+            json.dumps(
+                make_notebook(
+                    index, low + index % (high - low + 1), stored_output_size, output_size
+                )
+            )
+        )
+        paths.append(str(path))
+
+    if git:
+        for command in (
+            ["git", "init", "-q"],
+            ["git", "symbolic-ref", "HEAD", "refs/heads/master"],
+            ["git", "add", "."],
+            [
+                "git",
+                "-c",
+                "user.name=benchmark",
+                "-c",
+                "user.email=benchmark@localhost",
+                "commit",
+                "-q",
+                "-m",
+                "Benchmark templates",
+            ],
+        ):
+            subprocess.run(command, cwd=str(root), check=True)
+    return paths
@@ -0,0 +1,261 @@
+"""Cache of the generated HTML reports."""
+import asyncio
+import hashlib
+import json
+import logging
+import os
+import shutil
+import time
+import typing as tp
+from collections import OrderedDict
+from fnmatch import fnmatch
+from pathlib import Path
+
+from tornado.log import app_log
+
+from .compression import compress_file, supported_encodings
+
+
+class ReportCache:
+    """Size-bounded on-disk cache of the HTML reports.
+
+    A report is identified by the template content, the parameters, the kernel
+    and optionally the user. Each entry expires after the time-to-live of its
+    template and the least recently used entries are evicted when the cache
+    exceeds its maximal size. The compressed variants of a report are created
+    on demand and count in the size of its entry.
+
+    Args:
+        cache_dir: Cache folder
+        max_size: Maximal size of the cache in bytes
+        ttl: Default time-to-live of an entry in seconds
+        template_ttls: Time-to-live per template path glob pattern
+        log: Logger
+    """
+
+    def __init__(
+        self,
+        cache_dir: str,
+        max_size: int,
+        ttl: float,
+        template_ttls: tp.Optional[tp.Dict[str, float]] = None,
+        log: tp.Optional[logging.Logger] = None,
+    ):
+        self.cache_dir = Path(cache_dir)
+        self.max_size = max_size
+        self.ttl = ttl
+        self.template_ttls = template_ttls or {}
+        self.log = log or app_log
+        # {key: report size} from the least to the most recently used
+        self._entries = OrderedDict()  # type: tp.Dict[str, int]
+        self._size = 0
+        # {(key, encoding): compression} being created
+        self._compressing = {}  # type: tp.Dict[tp.Tuple[str, str], asyncio.Future]
+        self._load()
+
+    @staticmethod
+    def make_key(
+        template_sha: str,
+        parameters: tp.Dict[str, tp.Any],
+        username: tp.Optional[str] = None,
+    ) -> str:
+        """Compute the cache key of a report.
+
+        The kernel is the one of the notebook, so it is part of the template content.
+
+        Args:
+            template_sha: Template content hash
+            parameters: Template parameters
+            username: User name if the report depends on the user
+
+        Returns:
+            The cache key
+        """
+        identity = json.dumps(
+            [template_sha, parameters, username], sort_keys=True, default=repr
+        )
+        return hashlib.sha256(identity.encode("utf-8")).hexdigest()
+
+    def _report(self, key: str) -> Path:
+        return self.cache_dir / (key + ".html")
+
+    def _metadata(self, key: str) -> Path:
+        return self.cache_dir / (key + ".json")
+
+    def _variant(self, key: str, encoding: str) -> Path:
+        return self.cache_dir / (key + ".html." + encoding)
+
+    def _load(self):
+        """Load the cache entries from the cache folder."""
+        if not self.cache_dir.exists():
+            return
+
+        reports = sorted(self.cache_dir.glob("*.html"), key=lambda p: p.stat().st_mtime)
+        for report in reports:
+            if self._metadata(report.stem).exists():
+                variants = [self._variant(report.stem, e) for e in supported_encodings()]
+                size = report.stat().st_size + sum(v.stat().st_size for v in variants if v.exists())
+                self._add(report.stem, size)
+            else:  # Incomplete entry
+                self._remove(report.stem)
+
+    def _add(self, key: str, size: int):
+        self._entries[key] = size
+        self._size += size
+
+    def _remove(self, key: str):
+        """Remove an entry."""
+        self._size -= self._entries.pop(key, 0)
+        variants = [self._variant(key, encoding) for encoding in supported_encodings()]
+        for path in (self._metadata(key), self._report(key), *variants):
+            try:
+                path.unlink()
+            except FileNotFoundError:
+                pass
+
+    def get_ttl(self, template_path: str) -> float:
+        """Get the time-to-live of a template reports.
+
+        Args:
+            template_path: Template path relative to the templates folder
+
+        Returns:
+            The time-to-live in seconds of the first matching pattern or the default one
+        """
+        for pattern, ttl in self.template_ttls.items():
+            if fnmatch(template_path, pattern):
+                return ttl
+        return self.ttl
+
+    def get(self, key: str) -> tp.Optional[Path]:
+        """Get a cached report.
+
+        Args:
+            key: Cache key
+
+        Returns:
+            The cached report path or None if missing or expired
+        """
+        if key not in self._entries:
+            return None
+
+        metadata = self.get_metadata(key) or {"expires": 0}
+        if metadata["expires"] < time.time():
+            self._remove(key)
+            return None
+
+        self._entries.move_to_end(key)
+        report = self._report(key)
+        os.utime(str(report))  # Persist the usage order
+        return report
+
+    def get_metadata(self, key: str) -> tp.Optional[tp.Dict[str, tp.Any]]:
+        """Get the metadata of a cache entry.
+
+        Args:
+            key: Cache key
+
+        Returns:
+            The entry ``template`` path, ``created`` and ``expires`` timestamps
+            or None if the entry is missing
+        """
+        if key not in self._entries:
+            return None
+
+        try:
+            return json.loads(self._metadata(key).read_text())
+        except (OSError, ValueError):
+            return None
+
+    def _store(self, key: str, report: Path, metadata: tp.Dict) -> int:
+        """Copy the report and its metadata in the cache folder.
+
+        Returns:
+            The report size
+        """
+        self.cache_dir.mkdir(parents=True, exist_ok=True)
+        shutil.copyfile(str(report), str(self._report(key)))
+        self._metadata(key).write_text(json.dumps(metadata))
+        return self._report(key).stat().st_size
+
+    async def put(self, key: str, template_path: str, report: Path) -> Path:
+        """Store a report in the cache.
+
+        Args:
+            key: Cache key
+            template_path: Template path relative to the templates folder
+            report: Report to cache
+
+        Returns:
+            The cached report path
+        """
+        ttl = self.get_ttl(template_path)
+        if ttl <= 0 or report.stat().st_size > self.max_size:
+            return report
+
+        now = time.time()
+        metadata = {"template": template_path, "created": now, "expires": now + ttl}
+        self._remove(key)
+        try:
+            size = await asyncio.get_event_loop().run_in_executor(
+                None, self._store, key, report, metadata
+            )
+        except OSError:
+            self.log.warning(f"Unable to cache the report of '{template_path}'.", exc_info=True)
+            self._remove(key)
+            return report
+
+        self._add(key, size)
+        while self._size > self.max_size:
+            self._remove(next(iter(self._entries)))
+        return self._report(key)
+
+    async def compressed(self, key: str, encoding: str) -> tp.Optional[Path]:
+        """Get the compressed variant of a cached report.
+
+        The variant is created the first time it is requested.
+
+        Args:
+            key: Cache key
+            encoding: Content encoding (see `compression.supported_encodings`)
+
+        Returns:
+            The compressed report path or None if the report is not cached
+        """
+        if key not in self._entries:
+            return None
+
+        variant = self._variant(key, encoding)
+        if variant.exists():
+            return variant
+
+        compressing = self._compressing.get((key, encoding))
+        if compressing is None:
+            compressing = asyncio.get_event_loop().run_in_executor(
+                None, compress_file, self._report(key), variant, encoding
+            )
+            self._compressing[(key, encoding)] = compressing
+            try:
+                await compressing
+            except OSError:
+                self.log.warning(f"Unable to compress the cached report '{key}'.", exc_info=True)
+                return None
+            finally:
+                del self._compressing[(key, encoding)]
+
+            if key not in self._entries:  # Removed meanwhile
+                self._remove(key)
+                return None
+            size = variant.stat().st_size
+            self._entries[key] += size
+            self._size += size
+            while self._size > self.max_size and len(self._entries) > 1:
+                self._remove(next(iter(self._entries)))
+            if key not in self._entries:
+                return None
+        else:
+            try:
+                await asyncio.shield(compressing)
+            except OSError:
+                return None
+        return variant if variant.exists() else None
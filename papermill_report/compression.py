@@ -0,0 +1,114 @@
+"""HTTP content encodings of the reports."""
+import os
+import typing as tp
+import zlib
+from pathlib import Path
+
+try:
+    import brotli
+except ImportError:  # Optional dependency
+    brotli = None
+
+GZIP = "gzip"
+BROTLI = "br"
+
+
+def supported_encodings() -> tp.List[str]:
+    """List the supported content encodings.
+
+    Returns:
+        The encodings from the most to the least preferred
+    """
+    return [BROTLI, GZIP] if brotli is not None else [GZIP]
+
+
+def negotiate_encoding(accept_encoding: str) -> tp.Optional[str]:
+    """Select the content encoding of a response.
+
+    Args:
+        accept_encoding: ``Accept-Encoding`` request header
+
+    Returns:
+        The preferred supported encoding accepted by the client or None to not compress
+    """
+    accepted = {}  # type: tp.Dict[str, float]
+    for item in accept_encoding.split(","):
+        name, _, params = item.strip().partition(";")
+        quality = 1.0
+        params = params.strip()
+        if params.startswith("q="):
+            try:
+                quality = float(params[2:])
+            except ValueError:
+                continue
+        accepted[name.strip().lower()] = quality
+
+    candidates = [
+        encoding
+        for encoding in supported_encodings()
+        if accepted.get(encoding, accepted.get("*", 0.0)) > 0
+    ]
+    if not candidates:
+        return None
+    return max(candidates, key=lambda e: accepted.get(e, accepted.get("*", 0.0)))
+
+
+class Compressor:
+    """Incremental compressor.
+
+    Args:
+        encoding: Content encoding (see `supported_encodings`)
+        best: Whether to favor the compression ratio over the speed
+    """
+
+    def __init__(self, encoding: str, best: bool = False):
+        if encoding == BROTLI and brotli is not None:
+            self._compressor = brotli.Compressor(quality=9 if best else 4)
+            self._compress = self._compressor.process
+            self._flush = self._compressor.finish
+        elif encoding == GZIP:
+            # wbits 16 + 15 writes a gzip container
+            self._compressor = zlib.compressobj(9 if best else 6, zlib.DEFLATED, 31)
+            self._compress = self._compressor.compress
+            self._flush = self._compressor.flush
+        else:
+            raise ValueError(f"Unsupported content encoding '{encoding}'.")
+
+    def compress(self, data: bytes) -> bytes:
+        """Compress a chunk of data.
+
+        Args:
+            data: Data to compress
+
+        Returns:
+            The compressed data available so far
+        """
+        return self._compress(data)
+
+    def flush(self) -> bytes:
+        """Terminate the compression.
+
+        Returns:
+            The remaining compressed data
+        """
+        return self._flush()
+
+
+def compress_file(source: Path, target: Path, encoding: str, chunk_size: int = 1 << 20):
+    """Compress a file (blocking).
+
+    The target is written atomically.
+
+    Args:
+        source: File to compress
+        target: Compressed file path
+        encoding: Content encoding
+        chunk_size: Size of the chunks read in bytes
+    """
+    compressor = Compressor(encoding, best=True)
+    tmp_file = target.with_name(target.name + ".tmp")
+    with source.open("rb") as reader, tmp_file.open("wb") as writer:
+        for chunk in iter(lambda: reader.read(chunk_size), b""):
+            writer.write(compressor.compress(chunk))
+        writer.write(compressor.flush())
+    os.replace(str(tmp_file), str(target))
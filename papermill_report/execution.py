@@ -0,0 +1,664 @@
+"""Report execution backends."""
+import asyncio
+import json
+import logging
+import os
+import stat
+import sys
+import time
+import typing as tp
+from collections import OrderedDict
+from pathlib import Path
+from tempfile import TemporaryDirectory
+
+import nbformat
+import papermill as pm
+from papermill.utils import nb_kernel_name, nb_language
+from tornado.log import app_log
+
+from .forkserver import ForkServer
+from .kernels import KernelPool
+from .metrics import CONVERSION, EXECUTION
+from .utils import _execute_command, convert_to_html, git_blob_sha, is_impersonated
+from .worker import Worker, load_error
+
+
+class ReportJob(tp.NamedTuple):
+    """Report generation request.
+
+    Attributes:
+        template: Template absolute path
+        template_path: Template path relative to the templates folder
+        parameters: Template parameters
+        username: User name requesting the report
+        output_dir: Folder, accessible by the user, in which the report is generated
+        on_phase: Callback receiving the name (`EXECUTION` or `CONVERSION`), the
+            start timestamp and the duration in seconds of each generation phase
+    """
+
+    template: Path
+    template_path: str
+    parameters: tp.Dict[str, tp.Any]
+    username: str
+    output_dir: Path
+    on_phase: tp.Optional[tp.Callable[[str, float, float], None]] = None
+
+    def record_phase(self, name: str, start: float, duration: float):
+        """Report the duration of a generation phase.
+
+        Args:
+            name: Phase name
+            start: Start timestamp
+            duration: Duration in seconds
+        """
+        if self.on_phase is not None:
+            self.on_phase(name, start, duration)
+
+    def phase(self, name: str) -> "_Phase":
+        """Measure a generation phase.
+
+        Args:
+            name: Phase name
+
+        Returns:
+            Context reporting the duration of its body to `on_phase`
+        """
+        return _Phase(self, name)
+
+
+class _Phase:
+    """Context measuring a generation phase of a job."""
+
+    def __init__(self, job: ReportJob, name: str):
+        self._job = job
+        self._name = name
+        self._start = None  # type: tp.Optional[float]
+        self._clock = None  # type: tp.Optional[float]
+
+    def __enter__(self):
+        self._start = time.time()
+        self._clock = time.monotonic()
+
+    def __exit__(self, *args):
+        self._job.record_phase(self._name, self._start, time.monotonic() - self._clock)
+
+
+class ExecutionError(Exception):
+    """Report generation failure.
+
+    Args:
+        message: Understandable error message
+        error: Error raised by the generation
+        notebook: Executed notebook path if it exists
+    """
+
+    def __init__(self, message: str, error: BaseException, notebook: tp.Optional[Path] = None):
+        super().__init__(message)
+        self.message = message
+        self.error = error
+        self.notebook = notebook
+
+
+class SubprocessExecutor:
+    """Generate the reports with the papermill and nbconvert command lines.
+
+    The commands are executed through ``su <user> -l -c`` when impersonating
+    the authenticated user. Cancelling an execution kills the command and all
+    its descendants (including the kernel).
+
+    Args:
+        log: Logger
+    """
+
+    def __init__(self, log: tp.Optional[logging.Logger] = None):
+        self.log = log or app_log
+
+    async def _run(self, command: tp.List[str], job: ReportJob):
+        """Execute a command for the job user.
+
+        Args:
+            command: Command line to execute
+            job: Report job
+
+        Raises:
+            CalledProcessError if the return code is non-zero
+        """
+        if is_impersonated(job.username):
+            # Generate the report impersonating the authenticated user
+            command = ["su", job.username, "-l", "-c", " ".join(command)]
+        await _execute_command(command, cwd=job.output_dir)
+
+    async def execute(self, job: ReportJob) -> Path:
+        """Execute the template and convert it to HTML.
+
+        Args:
+            job: Report job
+
+        Returns:
+            The HTML report path
+
+        Raises:
+            ExecutionError: If the notebook execution or conversion fails
+        """
+        parameters_file = job.output_dir / "parameters.json"
+        parameters_file.write_text(json.dumps(job.parameters))
+        output_nb = job.output_dir / job.template.name
+
+        command = [
+            sys.executable,
+            "-m",
+            "papermill.cli",
+            "--no-progress-bar",
+            "--request-save-on-cell-execute",
+            "--parameters_file",
+            str(parameters_file),
+            str(job.template),
+            str(output_nb),
+        ]
+        try:
+            with job.phase(EXECUTION):
+                await self._run(command, job)
+        except asyncio.CancelledError:
+            raise
+        except Exception as error:
+            raise ExecutionError(
+                f"Fail to execute report <em>{job.template_path!s}</em> with parameters '{job.parameters}'.",
+                error,
+                output_nb if output_nb.exists() else None,
+            ) from error
+
+        command = [
+            sys.executable,
+            "-m",
+            "nbconvert",
+            "--to=html",
+            f'--output-dir="{job.output_dir!s}"',
+            str(output_nb),
+        ]
+        try:
+            with job.phase(CONVERSION):
+                await self._run(command, job)
+        except asyncio.CancelledError:
+            raise
+        except Exception as error:
+            raise ExecutionError(
+                f"Fail to render report '{job.template_path!s}' as HTML.",
+                error,
+                output_nb if output_nb.exists() else None,
+            ) from error
+
+        return output_nb.parent / (output_nb.stem + ".html")
+
+
+class KernelPoolExecutor:
+    """Generate the reports in the service process with pre-started kernels.
+
+    The notebook is executed with papermill Python API on a kernel of the pool
+    and converted with nbconvert Python API. Only the kernel is started as the
+    authenticated user when impersonating.
+
+    Args:
+        pool: Kernel pool
+        log: Logger
+    """
+
+    def __init__(self, pool: KernelPool, log: tp.Optional[logging.Logger] = None):
+        self.pool = pool
+        self.log = log or app_log
+
+    @staticmethod
+    def _get_kernel_name(template: Path) -> str:
+        return nb_kernel_name(nbformat.read(str(template), as_version=4))
+
+    @staticmethod
+    def _convert(notebook: nbformat.NotebookNode, report: Path):
+        report.write_text(convert_to_html(notebook), encoding="utf-8")
+
+    async def execute(self, job: ReportJob) -> Path:
+        """Execute the template and convert it to HTML.
+
+        Args:
+            job: Report job
+
+        Returns:
+            The HTML report path
+
+        Raises:
+            ExecutionError: If the notebook execution or conversion fails
+        """
+        loop = asyncio.get_event_loop()
+        output_nb = job.output_dir / job.template.name
+
+        try:
+            kernel_name = await loop.run_in_executor(None, self._get_kernel_name, job.template)
+            kernel = await self.pool.acquire(kernel_name, job.username)
+            try:
+                with job.phase(EXECUTION):
+                    notebook = await loop.run_in_executor(
+                        None,
+                        lambda: pm.execute_notebook(
+                            str(job.template),
+                            str(output_nb),
+                            parameters=job.parameters,
+                            kernel_name=kernel_name,
+                            progress_bar=False,
+                            request_save_on_cell_execute=True,
+                            km=kernel.manager,
+                        ),
+                    )
+            except asyncio.CancelledError:
+                # The execution thread cannot be interrupted; it fails with the kernel
+                self.pool.kill(kernel)
+                raise
+            except BaseException:
+                self.pool.release(kernel)
+                raise
+            self.pool.release(kernel)
+        except asyncio.CancelledError:
+            raise
+        except Exception as error:
+            raise ExecutionError(
+                f"Fail to execute report <em>{job.template_path!s}</em> with parameters '{job.parameters}'.",
+                error,
+                output_nb if output_nb.exists() else None,
+            ) from error
+
+        report = output_nb.parent / (output_nb.stem + ".html")
+        try:
+            with job.phase(CONVERSION):
+                await loop.run_in_executor(None, self._convert, notebook, report)
+        except Exception as error:
+            raise ExecutionError(
+                f"Fail to render report '{job.template_path!s}' as HTML.", error, output_nb
+            ) from error
+
+        return report
+
+    def shutdown(self):
+        """Shut down the pooled kernels."""
+        self.pool.shutdown()
+
+
+class ForkServerExecutor:
+    """Generate the reports from fork servers snapshotting the templates setup cells.
+
+    A fork server is started per template version (and user when impersonating)
+    the first time it is requested. It executes the cells preceding the
+    ``parameters`` cell once and forks a child per report to execute the other
+    cells. The server is replaced when the template content changes. Templates
+    not written in Python are generated with the subprocess executor.
+
+    .. warning::
+        The forked children share the resources opened by the setup cells
+        (e.g. database connections); the setup cells must only open resources
+        supporting it.
+
+    Args:
+        max_servers: Maximal number of running servers; the least recently used one is stopped
+        log: Logger
+    """
+
+    def __init__(self, max_servers: int = 16, log: tp.Optional[logging.Logger] = None):
+        self.max_servers = max_servers
+        self.log = log or app_log
+        self.fallback = SubprocessExecutor(log=self.log)
+        # {(template path, user): (template blob SHA, server or None if not supported)}
+        self._servers = (
+            OrderedDict()
+        )  # type: tp.Dict[tp.Tuple[str, tp.Optional[str]], tp.Tuple[str, asyncio.Future]]
+
+    @staticmethod
+    def _read_template(template: Path) -> tp.Tuple[str, str]:
+        """Get the template blob SHA and language."""
+        content = template.read_bytes()
+        notebook = nbformat.reads(content.decode("utf-8"), as_version=4)
+        return git_blob_sha(content), nb_language(notebook)
+
+    async def _start(self, job: ReportJob, blob: str, language: str) -> tp.Optional[ForkServer]:
+        if language != "python":
+            return None
+        server = ForkServer(
+            job.template, blob, job.username if is_impersonated(job.username) else None, self.log
+        )
+        await server.start()
+        return server
+
+    async def _get_server(self, job: ReportJob) -> tp.Optional[ForkServer]:
+        """Get the running server of a template.
+
+        Args:
+            job: Report job
+
+        Returns:
+            The server or None if the template is not supported
+        """
+        loop = asyncio.get_event_loop()
+        blob, language = await loop.run_in_executor(None, self._read_template, job.template)
+        key = (job.template_path, job.username if is_impersonated(job.username) else None)
+        known = self._servers.get(key)
+        if known is not None:
+            known_blob, starting = known
+            if known_blob == blob and not self._is_dead(starting):
+                self._servers.move_to_end(key)
+                return await asyncio.shield(starting)
+            self._stop(key)
+
+        starting = asyncio.ensure_future(self._start(job, blob, language))
+        self._servers[key] = (blob, starting)
+
+        def forget(future: asyncio.Future):
+            # Retry the setup with the next request
+            failed = future.cancelled() or future.exception() is not None
+            if failed and self._servers.get(key, (None, None))[1] is future:
+                del self._servers[key]
+
+        starting.add_done_callback(forget)
+        while len(self._servers) > self.max_servers:
+            self._stop(next(iter(self._servers)))
+        return await asyncio.shield(starting)
+
+    @staticmethod
+    def _is_dead(starting: asyncio.Future) -> bool:
+        """Whether a server failed to start or exited."""
+        if not starting.done():
+            return False
+        if starting.cancelled() or starting.exception() is not None:
+            return True
+        return starting.result() is not None and not starting.result().is_alive()
+
+    def _stop(self, key: tp.Tuple[str, tp.Optional[str]]):
+        """Stop a server and forget it."""
+        _, starting = self._servers.pop(key)
+
+        def stop(future: asyncio.Future):
+            if not future.cancelled() and future.exception() is None and future.result():
+                future.result().stop()
+
+        if starting.done():
+            stop(starting)
+        else:
+            starting.add_done_callback(stop)
+
+    @staticmethod
+    def _convert(output_nb: Path, report: Path):
+        notebook = nbformat.read(str(output_nb), as_version=4)
+        report.write_text(convert_to_html(notebook), encoding="utf-8")
+
+    async def execute(self, job: ReportJob) -> Path:
+        """Execute the template and convert it to HTML.
+
+        Args:
+            job: Report job
+
+        Returns:
+            The HTML report path
+
+        Raises:
+            ExecutionError: If the notebook execution or conversion fails
+        """
+        output_nb = job.output_dir / job.template.name
+        try:
+            server = await self._get_server(job)
+            if server is None:
+                return await self.fallback.execute(job)
+            with job.phase(EXECUTION):
+                status = await server.execute(job.parameters, output_nb)
+            if status["status"] != "ok":
+                raise load_error(status["error"])
+        except (ExecutionError, asyncio.CancelledError):
+            raise
+        except Exception as error:
+            raise ExecutionError(
+                f"Fail to execute report <em>{job.template_path!s}</em> with parameters '{job.parameters}'.",
+                error,
+                output_nb if output_nb.exists() else None,
+            ) from error
+
+        report = output_nb.parent / (output_nb.stem + ".html")
+        try:
+            with job.phase(CONVERSION):
+                await asyncio.get_event_loop().run_in_executor(
+                    None, self._convert, output_nb, report
+                )
+        except Exception as error:
+            raise ExecutionError(
+                f"Fail to render report '{job.template_path!s}' as HTML.", error, output_nb
+            ) from error
+
+        return report
+
+    def shutdown(self):
+        """Stop all servers."""
+        for key in list(self._servers):
+            self._stop(key)
+
+
+class WorkerExecutor:
+    """Generate the reports with long-lived worker processes.
+
+    A worker is started per user when impersonating (a single one otherwise)
+    the first time it is needed. It executes the notebooks with papermill
+    Python API and converts them with a cached HTML exporter, so neither an
+    interpreter nor a login shell is started per report. The worker writes the
+    report in the job output folder and only replies with its path.
+
+    Args:
+        log: Logger
+    """
+
+    def __init__(self, log: tp.Optional[logging.Logger] = None):
+        self.log = log or app_log
+        # {user name or None: worker}
+        self._workers = {}  # type: tp.Dict[tp.Optional[str], asyncio.Future]
+
+    async def _start(self, username: tp.Optional[str]) -> Worker:
+        worker = Worker(username, self.log)
+        await worker.start()
+        return worker
+
+    async def _get_worker(self, username: str) -> Worker:
+        """Get the running worker of a user.
+
+        Args:
+            username: User name requesting the report
+
+        Returns:
+            The worker
+        """
+        key = username if is_impersonated(username) else None
+        starting = self._workers.get(key)
+        if starting is not None and starting.done():
+            if starting.exception() is not None or not starting.result().is_alive():
+                starting = None
+        if starting is None:
+            starting = asyncio.ensure_future(self._start(key))
+            self._workers[key] = starting
+        return await asyncio.shield(starting)
+
+    async def execute(self, job: ReportJob) -> Path:
+        """Execute the template and convert it to HTML.
+
+        Args:
+            job: Report job
+
+        Returns:
+            The HTML report path
+
+        Raises:
+            ExecutionError: If the notebook execution or conversion fails
+        """
+        output_nb = job.output_dir / job.template.name
+        try:
+            worker = await self._get_worker(job.username)
+            reply = await worker.execute(job.template, job.parameters, output_nb)
+        except asyncio.CancelledError:
+            raise
+        except Exception as error:
+            raise ExecutionError(
+                f"Fail to execute report <em>{job.template_path!s}</em> with parameters '{job.parameters}'.",
+                error,
+                output_nb if output_nb.exists() else None,
+            ) from error
+
+        for name, (start, duration) in reply.get("phases", {}).items():
+            job.record_phase(name, start, duration)
+        if reply["status"] != "ok":
+            error = load_error(reply["error"])
+            if reply["stage"] == "convert":
+                message = f"Fail to render report '{job.template_path!s}' as HTML."
+            else:
+                message = f"Fail to execute report <em>{job.template_path!s}</em> with parameters '{job.parameters}'."
+            raise ExecutionError(message, error, output_nb if output_nb.exists() else None)
+
+        return Path(reply["report"])
+
+    def shutdown(self):
+        """Stop all workers."""
+        for starting in self._workers.values():
+            if starting.done() and starting.exception() is None:
+                starting.result().stop()
+            else:
+                starting.add_done_callback(
+                    lambda future: future.exception() is None and future.result().stop()
+                )
+        self._workers.clear()
+
+
+class _SharedExecution:
+    """Execution shared by identical requests."""
+
+    def __init__(self, output: TemporaryDirectory, future: asyncio.Future):
+        self.output = output
+        self.future = future
+        self.users = 0
+        self.started = False
+        # Callbacks of the attached requests waiting for the execution start
+        self.on_start = []  # type: tp.List[tp.Callable[[], None]]
+
+
+class _SharedExecutionContext:
+    """Asynchronous context attaching a request to a shared execution."""
+
+    def __init__(
+        self,
+        deduplicator: "ExecutionDeduplicator",
+        key: str,
+        generate: tp.Callable,
+        on_start: tp.Optional[tp.Callable[[], None]] = None,
+    ):
+        self._deduplicator = deduplicator
+        self._key = key
+        self._generate = generate
+        self._on_start = on_start
+        self._execution = None  # type: tp.Optional[_SharedExecution]
+
+    async def __aenter__(self) -> Path:
+        self._execution = self._deduplicator._attach(self._key, self._generate, self._on_start)
+        try:
+            return await asyncio.shield(self._execution.future)
+        except BaseException:  # Cancelled or failed execution: the context is not entered
+            self._deduplicator._detach(self._execution, self._on_start)
+            raise
+
+    async def __aexit__(self, *args):
+        self._deduplicator._detach(self._execution, self._on_start)
+
+
+class ExecutionDeduplicator:
+    """Share the identical report executions running concurrently.
+
+    A request attaches to the execution already running for its key or
+    starts a new one. The execution folder is removed once all attached
+    requests exited the context, or as soon as the execution failed. The
+    files of a failed execution must therefore be copied by the generation
+    function itself. The execution is cancelled when all the
+    requests waiting for it are cancelled.
+
+    Example:
+
+        async with deduplicator.share(key, generate) as report:
+            send(report)
+    """
+
+    def __init__(self):
+        self._executions = {}  # type: tp.Dict[str, _SharedExecution]
+
+    def share(
+        self,
+        key: str,
+        generate: tp.Callable[[Path], tp.Awaitable[Path]],
+        on_start: tp.Optional[tp.Callable[[], None]] = None,
+    ) -> _SharedExecutionContext:
+        """Attach to the execution identified by the key.
+
+        Args:
+            key: Execution identifier
+            generate: Coroutine function generating the report in the provided folder
+            on_start: Function called once the execution starts (see `start`),
+                immediately if it is already started
+
+        Returns:
+            Asynchronous context providing the report path
+        """
+        return _SharedExecutionContext(self, key, generate, on_start)
+
+    def start(self, key: str):
+        """Notify the requests attached to an execution that it started.
+
+        The generation function calls it once the report is actually being
+        generated, e.g. when its execution slot is granted.
+
+        Args:
+            key: Execution identifier
+        """
+        execution = self._executions.get(key)
+        if execution is None or execution.started:
+            return
+        execution.started = True
+        callbacks, execution.on_start = execution.on_start, []
+        for callback in callbacks:
+            callback()
+
+    def _attach(
+        self, key: str, generate: tp.Callable, on_start: tp.Optional[tp.Callable[[], None]]
+    ) -> _SharedExecution:
+        execution = self._executions.get(key)
+        if execution is None:
+            output = TemporaryDirectory()
+            os.chmod(
+                output.name, stat.S_IRWXU | stat.S_IRWXO
+            )  # Need to make the temporary file accessible by the request user
+            execution = _SharedExecution(
+                output, asyncio.ensure_future(generate(Path(output.name)))
+            )
+            self._executions[key] = execution
+
+            def forget(future: asyncio.Future):
+                # New requests start a new execution once this one is finished
+                if self._executions.get(key) is execution:
+                    del self._executions[key]
+                if execution.users == 0:
+                    if not future.cancelled():
+                        future.exception()  # Nobody is waiting for the error
+                    execution.output.cleanup()
+
+            execution.future.add_done_callback(forget)
+        execution.users += 1
+        if on_start is not None:
+            if execution.started:
+                on_start()
+            else:
+                execution.on_start.append(on_start)
+        return execution
+
+    def _detach(
+        self, execution: _SharedExecution, on_start: tp.Optional[tp.Callable[[], None]]
+    ):
+        if on_start in execution.on_start:
+            execution.on_start.remove(on_start)
+        execution.users -= 1
+        if execution.users == 0:
+            if execution.future.done():
+                execution.output.cleanup()
+            else:  # All waiting requests were cancelled
+                execution.future.cancel()
@@ -0,0 +1,389 @@
+"""Fork server executing a template from a snapshot of its setup cells.
+
+The server process runs the code cells preceding the ``parameters`` cell of a
+template once. Then it forks a child for each request; the child injects the
+request parameters and executes the remaining cells. So the setup cells (e.g.
+imports, connections, reference data loads) are paid once per template version.
+
+The server is started with::
+
+    python -m papermill_report.forkserver <template> <socket>
+
+It writes a JSON status line on its standard output once ready and exits when
+its standard input is closed. A request is a JSON line ``{"parameters": {...},
+"output": "<notebook path>"}`` sent on the unix socket. The child answers a
+first line with its PID and a second line with the execution status.
+"""
+import argparse
+import asyncio
+import copy
+import io
+import json
+import logging
+import os
+import select
+import socket
+import sys
+import traceback
+import typing as tp
+from datetime import datetime, timezone
+from pathlib import Path
+
+import nbformat
+from IPython.core.displayhook import DisplayHook
+from IPython.core.displaypub import DisplayPublisher
+from IPython.core.interactiveshell import InteractiveShell
+from papermill.iorw import get_pretty_path, load_notebook_node
+from papermill.parameterize import parameterize_notebook
+from papermill.utils import find_first_tagged_cell_index
+from traitlets.config import Config
+
+from .utils import LocalServer, kill_process_tree, write_message
+from .worker import load_error
+
+_outputs = []  # type: tp.List[nbformat.NotebookNode]
+"""Outputs of the cell being executed."""
+
+
+class _Stream(io.TextIOBase):
+    """Standard stream recording its content as cell outputs."""
+
+    def __init__(self, name: str):
+        self.name = name
+
+    def writable(self) -> bool:
+        return True
+
+    def write(self, text: str) -> int:
+        if _outputs and _outputs[-1].output_type == "stream" and _outputs[-1].name == self.name:
+            _outputs[-1].text += text
+        else:
+            _outputs.append(nbformat.v4.new_output("stream", name=self.name, text=text))
+        return len(text)
+
+
+class _DisplayHook(DisplayHook):
+    """Record the cell result as an ``execute_result`` output."""
+
+    def start_displayhook(self):
+        pass
+
+    def write_output_prompt(self):
+        pass
+
+    def write_format_data(self, format_dict, md_dict=None):
+        _outputs.append(
+            nbformat.v4.new_output(
+                "execute_result",
+                data=format_dict,
+                metadata=md_dict or {},
+                execution_count=self.shell.execution_count,
+            )
+        )
+
+    def finish_displayhook(self):
+        pass
+
+
+class _DisplayPublisher(DisplayPublisher):
+    """Record the displayed data as ``display_data`` outputs."""
+
+    def publish(self, data, metadata=None, source=None, *, transient=None, update=False, **kwargs):
+        _outputs.append(
+            nbformat.v4.new_output("display_data", data=data, metadata=metadata or {})
+        )
+
+    def clear_output(self, wait=False):
+        _outputs.clear()
+
+
+class _Shell(InteractiveShell):
+    """Interactive shell keeping the errors out of the outputs streams."""
+
+    def showtraceback(self, *args, **kwargs):
+        pass
+
+    def showsyntaxerror(self, *args, **kwargs):
+        pass
+
+
+def _make_shell() -> InteractiveShell:
+    """Create the shell executing the cells."""
+    config = Config()
+    config.HistoryManager.enabled = False
+    config.InteractiveShell.colors = "NoColor"
+    # Same default as the kernels to render the figures inline
+    os.environ.setdefault("MPLBACKEND", "module://matplotlib_inline.backend_inline")
+    return _Shell.instance(
+        config=config,
+        displayhook_class=_DisplayHook,
+        display_pub_class=_DisplayPublisher,
+    )
+
+
+def run_cell(shell: InteractiveShell, cell: nbformat.NotebookNode) -> tp.Optional[BaseException]:
+    """Execute a code cell and record its outputs and papermill metadata.
+
+    Args:
+        shell: Shell executing the code
+        cell: Code cell
+
+    Returns:
+        The error raised by the cell if any
+    """
+    cell.execution_count = shell.execution_count
+    _outputs.clear()
+    start = datetime.now(timezone.utc)
+    stdout, stderr = sys.stdout, sys.stderr
+    sys.stdout, sys.stderr = _Stream("stdout"), _Stream("stderr")
+    try:
+        result = shell.run_cell(cell.source, store_history=False, silent=False)
+    finally:
+        sys.stdout, sys.stderr = stdout, stderr
+        shell.execution_count += 1
+    end = datetime.now(timezone.utc)
+
+    error = result.error_before_exec or result.error_in_exec
+    cell.outputs = list(_outputs)
+    _outputs.clear()
+    if error is not None:
+        cell.outputs.append(
+            nbformat.v4.new_output(
+                "error",
+                ename=type(error).__name__,
+                evalue=str(error),
+                traceback=traceback.format_exception(type(error), error, error.__traceback__),
+            )
+        )
+    cell.metadata["papermill"] = {
+        "exception": error is not None,
+        "start_time": start.isoformat(),
+        "end_time": end.isoformat(),
+        "duration": (end - start).total_seconds(),
+        "status": "failed" if error is not None else "completed",
+    }
+    return error
+
+
+def _run_cells(
+    shell: InteractiveShell,
+    cells: tp.List[nbformat.NotebookNode],
+    on_cell: tp.Optional[tp.Callable[[], None]] = None,
+) -> tp.Optional[tp.Dict]:
+    """Execute code cells until one fails.
+
+    Args:
+        shell: Shell executing the code
+        cells: Cells to execute
+        on_cell: Callback called when a cell starts and when it ends (e.g. to save the notebook)
+
+    Returns:
+        The error description or None if all cells succeeded
+    """
+    for index, cell in enumerate(cells):
+        if cell.cell_type != "code":
+            continue
+        if on_cell is not None:
+            cell.metadata.setdefault("papermill", {})["status"] = "running"
+            on_cell()
+        error = run_cell(shell, cell)
+        if on_cell is not None:
+            on_cell()
+        if error is not None:
+            return {
+                "cell_index": index,
+                "exec_count": cell.execution_count,
+                "source": cell.source,
+                "ename": type(error).__name__,
+                "evalue": str(error),
+                "traceback": cell.outputs[-1].traceback,
+            }
+    return None
+
+
+class _Server:
+    """Fork server of a template.
+
+    Args:
+        template: Template path
+        socket_path: Unix socket path to listen on
+    """
+
+    def __init__(self, template: str, socket_path: str):
+        self.template = template
+        self.socket_path = socket_path
+        self.notebook = load_notebook_node(template)
+        self.notebook.metadata.papermill["input_path"] = get_pretty_path(template)
+        self.setup_count = max(0, find_first_tagged_cell_index(self.notebook, "parameters"))
+        self.shell = _make_shell()
+
+    def setup(self) -> tp.Optional[tp.Dict]:
+        """Execute the cells preceding the parameters cell.
+
+        Returns:
+            The error description or None if all cells succeeded
+        """
+        return _run_cells(self.shell, self.notebook.cells[: self.setup_count])
+
+    def serve(self):
+        """Fork a child per request until the standard input is closed."""
+        listener = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        listener.bind(self.socket_path)
+        listener.listen(16)
+        write_message(sys.stdout, {"status": "ready"})
+
+        while True:
+            readable, _, _ = select.select([listener, sys.stdin], [], [], 1.0)
+            self._reap()
+            if sys.stdin in readable and not sys.stdin.readline():
+                break
+            if listener in readable:
+                connection, _ = listener.accept()
+                if os.fork() == 0:
+                    listener.close()
+                    code = 0
+                    try:
+                        self._handle(connection)
+                    except BaseException:
+                        traceback.print_exc()
+                        code = 1
+                    os._exit(code)
+                connection.close()
+
+        listener.close()
+
+    @staticmethod
+    def _reap():
+        """Collect the finished children."""
+        try:
+            while os.waitpid(-1, os.WNOHANG)[0] > 0:
+                pass
+        except ChildProcessError:
+            pass
+
+    def _handle(self, connection: socket.socket):
+        """Execute a request in the forked child.
+
+        Args:
+            connection: Request connection
+        """
+        stream = connection.makefile("rw", encoding="utf-8")
+        request = json.loads(stream.readline())
+        write_message(stream, {"pid": os.getpid()})
+
+        output = request["output"]
+        os.chdir(os.path.dirname(output))
+        notebook = copy.deepcopy(self.notebook)
+        notebook.metadata.papermill["output_path"] = get_pretty_path(output)
+        notebook = parameterize_notebook(notebook, request["parameters"])
+        cells = notebook.cells[self.setup_count:]
+        for cell in cells:
+            if cell.cell_type == "code":
+                cell.outputs = []
+                cell.execution_count = None
+                cell.metadata["papermill"] = {"status": "pending"}
+
+        start = datetime.now(timezone.utc)
+        # Save the notebook on each cell to follow the progress as papermill does
+        error = _run_cells(self.shell, cells, lambda: nbformat.write(notebook, output))
+        if error is not None:
+            error["cell_index"] += self.setup_count
+        end = datetime.now(timezone.utc)
+        notebook.metadata.papermill.update(
+            start_time=start.isoformat(),
+            end_time=end.isoformat(),
+            duration=(end - start).total_seconds(),
+            exception=error is not None,
+        )
+        nbformat.write(notebook, output)
+
+        if error is None:
+            write_message(stream, {"status": "ok"})
+        else:
+            write_message(stream, {"status": "error", "error": error})
+        stream.close()
+        connection.close()
+
+
+def main(argv: tp.Optional[tp.List[str]] = None):
+    """Start a fork server."""
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("template", help="Template path")
+    parser.add_argument("socket", help="Unix socket path to listen on")
+    args = parser.parse_args(argv)
+
+    server = _Server(args.template, args.socket)
+    error = server.setup()
+    if error is not None:
+        write_message(sys.stdout, {"status": "error", "error": error})
+        sys.exit(1)
+    server.serve()
+
+
+class ForkServer(LocalServer):
+    """Handle of a template fork server process.
+
+    Args:
+        template: Template absolute path
+        blob: Template blob SHA
+        username: User running the server if impersonated, None otherwise
+        log: Logger
+    """
+
+    def __init__(
+        self,
+        template: Path,
+        blob: str,
+        username: tp.Optional[str] = None,
+        log: tp.Optional[logging.Logger] = None,
+    ):
+        super().__init__("papermill_report.forkserver", [str(template)], username, log)
+        self.template = template
+        self.blob = blob
+
+    async def start(self):
+        """Start the server and wait for the setup cells execution.
+
+        Raises:
+            PapermillExecutionError: If a setup cell fails
+            RuntimeError: If the server fails to start
+        """
+        status = await super().start()
+        if status["status"] != "ready":
+            raise load_error(status["error"])
+        self.log.debug(f"Fork server started for '{self.template!s}'.")
+
+    async def execute(self, parameters: tp.Dict[str, tp.Any], output: Path) -> tp.Dict:
+        """Execute the template in a forked child.
+
+        If the execution is cancelled, the forked child and its descendants are killed.
+
+        Args:
+            parameters: Template parameters
+            output: Executed notebook path
+
+        Returns:
+            The execution status ``{"status": "ok"}`` or
+            ``{"status": "error", "error": {...}}`` whose error is rebuilt with
+            `papermill_report.worker.load_error`
+        """
+        status = {
+            "status": "error",
+            "error": {"ename": "RuntimeError", "evalue": "The execution process died."},
+        }
+        pid = None
+        try:
+            async for reply in self.request({"parameters": parameters, "output": str(output)}):
+                if "pid" in reply:
+                    pid = reply["pid"]
+                if "status" in reply:
+                    status = reply
+        except asyncio.CancelledError:
+            if pid is not None:
+                kill_process_tree(pid)
+            raise
+        return status
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,350 @@
+"""Report generation shared by the report requests and the asynchronous jobs."""
+import asyncio
+import functools
+import logging
+import os
+import time
+import typing as tp
+from datetime import datetime
+from fnmatch import fnmatch
+from pathlib import Path
+
+from tornado.log import app_log
+
+from .cache import ReportCache
+from .execution import ExecutionDeduplicator, ExecutionError, ReportJob, SubprocessExecutor
+from .jobs import Job, JobError, JobStore
+from .metrics import CANCELLED, FAILURE, SUCCESS, TIMEOUT, ReportMetrics
+from .profiles import CellProfiles
+from .progress import ProgressTracker
+from .repository import TemplateRepository
+from .scheduler import INTERACTIVE, ExecutionScheduler
+from .stats import ExecutionStats
+from .utils import ANONYMOUS_USER, git_blob_sha, is_impersonated, pwd
+
+
+class ReportGenerator:
+    """Generate the reports of the service.
+
+    The generator lives as long as the service: the asynchronous jobs keep
+    running once the request submitting them is finished, so everything about
+    the requester is passed explicitly.
+
+    Args:
+        settings: Application settings holding the service components
+    """
+
+    def __init__(self, settings: tp.Dict[str, tp.Any]):
+        self.settings = settings
+
+    @property
+    def log(self) -> logging.Logger:
+        """Logger: Application logger"""
+        return self.settings.get("log", app_log)
+
+    @property
+    def job_store(self) -> JobStore:
+        """JobStore: Asynchronous report jobs."""
+        return self.settings["job_store"]
+
+    @property
+    def report_cache(self) -> tp.Optional[ReportCache]:
+        """ReportCache or None: HTML reports cache; None if disabled."""
+        return self.settings.get("report_cache")
+
+    @property
+    def report_deduplicator(self) -> ExecutionDeduplicator:
+        """ExecutionDeduplicator: Shared report executions."""
+        return self.settings["report_deduplicator"]
+
+    @property
+    def execution_stats(self) -> ExecutionStats:
+        """ExecutionStats: Templates runtime statistics."""
+        return self.settings["execution_stats"]
+
+    @property
+    def report_metrics(self) -> ReportMetrics:
+        """ReportMetrics: Prometheus metrics."""
+        return self.settings["report_metrics"]
+
+    @property
+    def cell_profiles(self) -> CellProfiles:
+        """CellProfiles: Templates per-cell execution durations."""
+        return self.settings["cell_profiles"]
+
+    @property
+    def execution_progress(self) -> ProgressTracker:
+        """ProgressTracker: Progress of the running executions."""
+        return self.settings["execution_progress"]
+
+    @property
+    def report_scheduler(self) -> ExecutionScheduler:
+        """ExecutionScheduler: Concurrent report executions limiter."""
+        return self.settings["report_scheduler"]
+
+    @property
+    def report_executor(self) -> SubprocessExecutor:
+        """SubprocessExecutor: Reports generator."""
+        return self.settings["report_executor"]
+
+    @property
+    def template_repository(self) -> TemplateRepository:
+        """TemplateRepository: Templates repository."""
+        return self.settings["template_repository"]
+
+    @property
+    def template_commit(self) -> tp.Optional[str]:
+        """str or None: Commit SHA of the templates repository."""
+        return self.template_repository.commit
+
+    @property
+    def report_path(self) -> str:
+        """str: Local report path."""
+        return self.settings.get("report_path")
+
+    def broken_path(self, username: str) -> str:
+        """Get the broken reports folder of a user.
+
+        Args:
+            username: User name
+
+        Returns:
+            The broken reports folder
+        """
+        return self.settings.get("broken_path").replace("USERNAME", username)
+
+    def share_report(self, username: str) -> bool:
+        """Whether a user report can be shared with other users.
+
+        Args:
+            username: User name
+
+        Returns:
+            False if the report is generated impersonating the user and
+            sharing impersonated reports is not allowed.
+        """
+        return not is_impersonated(username) or self.settings.get(
+            "share_impersonated_reports", False
+        )
+
+    def make_report_key(
+        self, tpl_path: Path, parameters: tp.Dict[str, tp.Any], username: str
+    ) -> str:
+        """Compute the identifier of a report.
+
+        Args:
+            tpl_path: Template absolute path
+            parameters: Template parameters
+            username: User name requesting the report
+
+        Returns:
+            The report cache key
+        """
+        return ReportCache.make_key(
+            git_blob_sha(tpl_path.read_bytes()),
+            parameters,
+            username=None if self.share_report(username) else username,
+        )
+
+    def execution_key(self, report_key: str) -> str:
+        """Identify the execution of a report at the current templates commit.
+
+        Args:
+            report_key: Report identifier
+
+        Returns:
+            The execution identifier
+        """
+        return f"{report_key}-{self.template_commit}"
+
+    def execution_timeout(self, template_path: str) -> float:
+        """Get the execution timeout of a template.
+
+        Args:
+            template_path: Template path relative to the templates folder
+
+        Returns:
+            The timeout in seconds of the first matching pattern or the default one; 0 for none
+        """
+        for pattern, timeout in self.settings.get("execution_timeouts", {}).items():
+            if fnmatch(template_path, pattern):
+                return timeout
+        return self.settings.get("execution_timeout", 0.0)
+
+    def share(
+        self,
+        tpl_path: Path,
+        template_path: str,
+        parameters: tp.Dict[str, tp.Any],
+        username: str,
+        report_key: str,
+        broken_path: str,
+        store: bool = True,
+        priority: str = INTERACTIVE,
+        on_start: tp.Optional[tp.Callable[[], None]] = None,
+        on_phase: tp.Optional[tp.Callable[[str, float, float], None]] = None,
+    ):
+        """Attach to the execution of a report.
+
+        Identical requests at the same commit share the same execution; it is
+        cancelled if all requests attached to it are cancelled or if it exceeds
+        the template execution timeout. The duration of the successful executions
+        and the interruptions are recorded in the statistics and the cells
+        duration in the profiles. The notebook of a failed execution is copied
+        in the broken reports folder of the user starting it; the `notebook` of
+        the raised `ExecutionError` is that copy.
+
+        Args:
+            tpl_path: Template absolute path
+            template_path: Template path relative to the templates folder
+            parameters: Template parameters
+            username: User name requesting the report
+            report_key: Report identifier
+            broken_path: Broken reports folder of the user
+            store: Whether to store the generated report in the cache
+            priority: Execution priority class
+            on_start: Function called once the execution slot is granted
+            on_phase: Function also receiving the generation phases (see `ReportJob.on_phase`)
+
+        Returns:
+            Asynchronous context providing the report path
+
+        Raises:
+            ExecutionError: If the report generation fails or times out
+            QueueFull: If too many reports are waiting for their execution
+        """
+
+        execution_key = self.execution_key(report_key)
+
+        def record_phase(name: str, start: float, duration: float):
+            self.report_metrics.observe(name, duration)
+            if on_phase is not None:
+                on_phase(name, start, duration)
+
+        async def generate(output_dir: Path) -> Path:
+            expected_duration = self.execution_stats.expected_duration(template_path)
+            timeout = self.execution_timeout(template_path)
+            job = ReportJob(
+                tpl_path, template_path, parameters, username, output_dir, on_phase=record_phase
+            )
+            async with self.report_scheduler.slot(username, priority, expected_duration):
+                self.report_deduplicator.start(execution_key)
+                start = time.monotonic()
+                try:
+                    async with self.execution_progress.track(
+                        execution_key, output_dir / tpl_path.name
+                    ):
+                        report = await asyncio.wait_for(
+                            self.report_executor.execute(job), timeout if timeout > 0 else None
+                        )
+                except ExecutionError as error:
+                    self.report_metrics.record_report(template_path, FAILURE)
+                    # The execution folder is removed as soon as the execution failed
+                    if error.notebook is not None:
+                        error.notebook = self.save_broken_report(
+                            error.notebook, broken_path, username, template_path
+                        )
+                    raise
+                except asyncio.TimeoutError as error:
+                    self.report_metrics.record_report(template_path, TIMEOUT)
+                    self.execution_stats.record_cancellation(template_path, timeout=True)
+                    output_nb = output_dir / tpl_path.name
+                    raise ExecutionError(
+                        f"Report <em>{template_path!s}</em> execution exceeded its {timeout:g} seconds timeout.",
+                        error,
+                        self.save_broken_report(output_nb, broken_path, username, template_path)
+                        if output_nb.exists()
+                        else None,
+                    ) from error
+                except asyncio.CancelledError:
+                    self.log.info(f"Report '{template_path}' execution cancelled.")
+                    self.report_metrics.record_report(template_path, CANCELLED)
+                    self.execution_stats.record_cancellation(template_path)
+                    raise
+                self.report_metrics.record_report(template_path, SUCCESS)
+                self.execution_stats.record(template_path, time.monotonic() - start)
+            await self.cell_profiles.record(
+                template_path, tpl_path, output_dir / tpl_path.name, self.template_commit
+            )
+            if self.report_cache is not None and store:
+                report = await self.report_cache.put(report_key, template_path, report)
+            return report
+
+        return self.report_deduplicator.share(execution_key, generate, on_start)
+
+    def save_broken_report(
+        self, notebook_path: Path, broken_path: str, username: str, template_path: str
+    ) -> Path:
+        """Save the notebook in the broken reports folder.
+
+        Args:
+            notebook_path: The broken report
+            broken_path: Broken reports folder of the user
+            username: User name trying to execute the report
+            template_path: Template path relative to the templates folder
+        Returns:
+            The copied broken report path
+        """
+        self.report_metrics.record_broken(template_path)
+        local_user = pwd.getpwnam(username) if pwd is not None and username != ANONYMOUS_USER else None
+        prefix = datetime.strftime(datetime.now(), "%Y-%m-%d") + "_broken_"
+        broken_notebook = Path(broken_path) / (prefix + notebook_path.name)
+        if not broken_notebook.parent.exists():
+            broken_notebook.parent.mkdir(parents=True)
+            if local_user:
+                os.chown(broken_notebook.parent, local_user.pw_uid, local_user.pw_gid)
+
+        broken_notebook.write_text(Path(notebook_path).read_text())
+        if local_user:
+            os.chown(broken_notebook, local_user.pw_uid, local_user.pw_gid)
+
+        return broken_notebook
+
+    async def run_job(self, job: Job):
+        """Generate the report of a job.
+
+        The job is generated on behalf of its user: the failed notebook is
+        copied in the broken reports folder of ``job.username``.
+
+        Args:
+            job: Report job
+
+        Raises:
+            JobError: If the report generation fails
+        """
+        with self.template_repository.checkout() as root_dir:
+            tpl_path = (root_dir / self.report_path).resolve() / job.template_path
+            if not tpl_path.exists():
+                raise JobError({"message": f"Template file '{job.template_path}' does not exists."})
+
+            report_key = self.make_report_key(tpl_path, job.parameters, job.username)
+            report = None
+            if self.report_cache is not None:
+                report = self.report_cache.get(report_key)
+                self.report_metrics.record_cache("report", report is not None)
+            if report is not None:
+                self.job_store.start(job)
+                await self.job_store.save_report(job, report)
+                return
+
+            job.execution_key = self.execution_key(report_key)
+            try:
+                async with self.share(
+                    tpl_path,
+                    job.template_path,
+                    job.parameters,
+                    job.username,
+                    report_key,
+                    self.broken_path(job.username),
+                    priority=job.priority,
+                    on_start=functools.partial(self.job_store.start, job),
+                ) as report:
+                    await self.job_store.save_report(job, report)
+            except ExecutionError as error:
+                raise JobError(
+                    {
+                        "message": error.message,
+                        "error": str(error.error),
+                        "broken_report": None if error.notebook is None else str(error.notebook),
+                    }
+                ) from error
@@ -0,0 +1,116 @@
+"""Read the notebook templates from the git object database."""
+import asyncio
+import logging
+import posixpath
+import typing as tp
+from asyncio.subprocess import PIPE, create_subprocess_exec
+
+from tornado.log import app_log
+
+from .utils import _execute_command
+
+
+class GitObjectStore:
+    """Notebooks of a git repository at a given commit.
+
+    The notebooks are listed with ``git ls-tree`` and read from a persistent
+    ``git cat-file --batch`` process, without reading the working tree.
+
+    Args:
+        repository_dir: Git repository folder
+        log: Logger
+    """
+
+    def __init__(self, repository_dir: str, log: tp.Optional[logging.Logger] = None):
+        self.repository_dir = repository_dir
+        self.log = log or app_log
+        self._process = None  # type: tp.Optional[asyncio.subprocess.Process]
+        self._lock = asyncio.Lock()
+
+    async def list_notebooks(self, commit: str, template_dir: str = ".") -> tp.Dict[str, str]:
+        """List the notebooks of a folder at a commit.
+
+        Args:
+            commit: Commit SHA
+            template_dir: Folder relative to the repository root
+
+        Returns:
+            {path relative to the folder: blob SHA} sorted by path
+
+        Raises:
+            CalledProcessError: If the folder cannot be listed
+        """
+        _, output, _ = await _execute_command(
+            ("git", "ls-tree", "-r", "-z", "--full-tree", commit, "--", template_dir),
+            cwd=self.repository_dir,
+        )
+        prefix = posixpath.normpath(template_dir)
+        notebooks = {}
+        for entry in output.split("\0"):
+            if not entry:
+                continue
+            info, _, path = entry.partition("\t")
+            mode, kind, blob = info.split()
+            # Skip the symbolic links and the submodules
+            if kind != "blob" or mode == "120000" or not path.endswith(".ipynb"):
+                continue
+            notebooks[path if prefix == "." else posixpath.relpath(path, prefix)] = blob
+        return dict(sorted(notebooks.items()))
+
+    async def _start(self) -> asyncio.subprocess.Process:
+        if self._process is None or self._process.returncode is not None:
+            self._process = await create_subprocess_exec(
+                "git",
+                "cat-file",
+                "--batch",
+                cwd=self.repository_dir,
+                stdin=PIPE,
+                stdout=PIPE,
+                start_new_session=True,
+            )
+        return self._process
+
+    async def read(self, blob: str) -> bytes:
+        """Read a blob.
+
+        Args:
+            blob: Blob SHA
+
+        Returns:
+            The blob content
+
+        Raises:
+            KeyError: If the blob does not exist
+            OSError: If the git process failed
+        """
+        async with self._lock:
+            process = await self._start()
+            try:
+                process.stdin.write(blob.encode("ascii") + b"\n")
+                await process.stdin.drain()
+                header = (await process.stdout.readline()).decode("utf-8").split()
+                if len(header) == 2 and header[1] == "missing":
+                    raise KeyError(blob)
+                if len(header) != 3:
+                    raise OSError(f"Unexpected git cat-file answer {header!r}.")
+                content = await process.stdout.readexactly(int(header[2]) + 1)
+            except (asyncio.IncompleteReadError, ConnectionError, OSError):
+                # Restart the process on the next read
+                self._kill()
+                raise OSError(f"Unable to read the git blob '{blob}'.")
+            except asyncio.CancelledError:
+                # The answer of the cancelled read would be read by the next one
+                self._kill()
+                raise
+        return content[:-1]
+
+    def _kill(self):
+        if self._process is not None and self._process.returncode is None:
+            self._process.kill()
+        self._process = None
+
+    def close(self):
+        """Stop the git process."""
+        if self._process is not None and self._process.returncode is None:
+            self._process.stdin.close()
+        self._process = None
@@ -1,32 +1,44 @@
 import ast
+import asyncio
+import hashlib
+import hmac
 import json
 import logging
 import os
 import re
-import stat
 import sys
+import time
 import traceback as tb
 import typing as tp
 from datetime import datetime
 from http.client import responses
 from pathlib import Path
 from subprocess import CalledProcessError
-from tempfile import TemporaryDirectory
 from urllib.parse import urlencode
 
-import papermill as pm
 from jinja2 import Template
-from tornado import web
+from prometheus_client import CONTENT_TYPE_LATEST
+from tornado import ioloop, web
+from tornado.iostream import StreamClosedError
 from tornado.log import app_log
 
-from .utils import _execute_command, update_git_repository
-
-ANONYMOUS_USER = "anonymous_pm_report"
-
-try:
-    import pwd
-except ImportError:  # None Unix
-    pwd = None
+from . import __version__
+from .cache import ReportCache
+from .compression import Compressor, negotiate_encoding
+from .execution import ExecutionError
+from .generator import ReportGenerator
+from .index import TemplateIndex
+from .jobs import COMPLETED, Job, JobStore
+from .metrics import CONVERSION, EXECUTION, ReportMetrics
+from .profiles import CellProfiles
+from .progress import ProgressTracker, render_outputs
+from .repository import TemplateRepository
+from .scheduler import BATCH, PRIORITIES, ExecutionScheduler, QueueFull
+from .tracing import RequestTrace, TraceExporter
+from .utils import ANONYMOUS_USER
+
+REPORT_CHUNK_SIZE = 256 * 1024
+"""Size in bytes of the report chunks sent to the clients."""
 
 if os.environ.get("JUPYTERHUB_API_TOKEN"):
     from jupyterhub.services.auth import HubOAuthenticated
@@ -62,14 +74,63 @@ def _serialize_exception(error: BaseException, message: str = "") -> dict:
         }
 
 
+PHASE_SPANS = {EXECUTION: "papermill", CONVERSION: "nbconvert"}
+"""Span names of the report generation phases."""
+
+
 class ReportHandler(HubOAuthenticated, web.RequestHandler):
-    """Common base handler class for the reports."""
+    """Common base handler class for the reports.
+
+    Each request carries a trace of its phases sent in the ``Server-Timing``
+    header, logged as a JSON line when the request finishes and optionally
+    exported in a trace file.
+    """
+
+    _trace = None  # type: tp.Optional[RequestTrace]
+
+    @property
+    def trace(self) -> RequestTrace:
+        """RequestTrace: Phases of the request."""
+        if self._trace is None:
+            self._trace = RequestTrace(
+                f"{self.request.method} {self.request.path}", self.request._start_time
+            )
+        return self._trace
+
+    def flush(self, include_footers: bool = False) -> "asyncio.Future[None]":
+        """Send the ``Server-Timing`` header with the headers."""
+        if not self._headers_written:
+            self.set_header("Server-Timing", self.trace.server_timing(self.request.request_time()))
+        return super().flush(include_footers)
+
+    def on_finish(self):
+        """Log and export the request trace."""
+        self.trace.finish(self.request.request_time())
+        record = {
+            "method": self.request.method,
+            "path": self.request.path,
+            "status": self.get_status(),
+            "duration": round(self.trace.root.duration * 1000, 3),
+            "spans": [span.to_dict() for span in self.trace.root.children],
+        }
+        self.log.info(f"Request trace {json.dumps(record)}")
+        if self.trace_exporter is not None:
+            self.trace_exporter.export(self.trace)
+
+    def _record_phase(self, name: str, start: float, duration: float):
+        """Record a report generation phase in the request trace.
+
+        Args:
+            name: Phase name (see `ReportJob.on_phase`)
+            start: Start timestamp
+            duration: Duration in seconds
+        """
+        self.trace.add(PHASE_SPANS.get(name, name), start, duration)
 
     @property
     def broken_path(self) -> str:
         """str: User broken report path."""
-        username = self.get_current_user()["name"]
-        return self.settings.get("broken_path").replace("USERNAME", username)
+        return self.report_generator.broken_path(self.get_current_user()["name"])
 
     @property
     def log(self) -> logging.Logger:
@@ -82,6 +143,61 @@ class ReportHandler(HubOAuthenticated, web.RequestHandler):
         username = self.get_current_user()["name"]
         return self.settings.get("notebook_dir").replace("USERNAME", username)
 
+    @property
+    def template_index(self) -> TemplateIndex:
+        """TemplateIndex: Templates metadata index."""
+        return self.settings["template_index"]
+
+    @property
+    def job_store(self) -> JobStore:
+        """JobStore: Asynchronous report jobs."""
+        return self.settings["job_store"]
+
+    @property
+    def report_cache(self) -> tp.Optional[ReportCache]:
+        """ReportCache or None: HTML reports cache; None if disabled."""
+        return self.settings.get("report_cache")
+
+    @property
+    def report_metrics(self) -> ReportMetrics:
+        """ReportMetrics: Prometheus metrics."""
+        return self.settings["report_metrics"]
+
+    @property
+    def trace_exporter(self) -> tp.Optional[TraceExporter]:
+        """TraceExporter or None: Request traces export; None if disabled."""
+        return self.settings.get("trace_exporter")
+
+    @property
+    def cell_profiles(self) -> CellProfiles:
+        """CellProfiles: Templates per-cell execution durations."""
+        return self.settings["cell_profiles"]
+
+    @property
+    def execution_progress(self) -> ProgressTracker:
+        """ProgressTracker: Progress of the running executions."""
+        return self.settings["execution_progress"]
+
+    @property
+    def report_scheduler(self) -> ExecutionScheduler:
+        """ExecutionScheduler: Concurrent report executions limiter."""
+        return self.settings["report_scheduler"]
+
+    @property
+    def report_generator(self) -> ReportGenerator:
+        """ReportGenerator: Reports generation."""
+        return self.settings["report_generator"]
+
+    @property
+    def template_repository(self) -> TemplateRepository:
+        """TemplateRepository: Templates repository."""
+        return self.settings["template_repository"]
+
+    @property
+    def template_commit(self) -> tp.Optional[str]:
+        """str or None: Commit SHA of the templates repository."""
+        return self.template_repository.commit
+
     @property
     def report_git_url(self) -> tp.Optional[str]:
         """str or None: Git repository URL."""
@@ -205,7 +321,166 @@ class ReportHandler(HubOAuthenticated, web.RequestHandler):
         self.set_status(status_code)
         self.write(html)
 
-    async def _get_templates(self) -> tp.List[tp.Dict]:
+    def _negotiate_encoding(self) -> tp.Optional[str]:
+        """Select the content encoding of the report.
+
+        Returns:
+            The encoding or None to not compress
+        """
+        return negotiate_encoding(self.request.headers.get("Accept-Encoding", ""))
+
+    def _check_not_modified(self, etag: str, cache_control: str = "private, no-cache") -> bool:
+        """Set the validation headers and answer ``304`` if the client copy is up-to-date.
+
+        Args:
+            etag: Strong entity tag of the response (without quotes)
+            cache_control: ``Cache-Control`` header of the response
+
+        Returns:
+            Whether the response was finished with a ``304 Not Modified`` status
+        """
+        self.set_header("Etag", f'"{etag}"')
+        self.set_header("Cache-Control", cache_control)
+        if not self.check_etag_header():
+            return False
+        self.set_status(304)
+        self.finish()
+        return True
+
+    def _report_etag(self, tag: str) -> str:
+        """Compute the entity tag of a report representation.
+
+        Args:
+            tag: Report version identifier
+
+        Returns:
+            The entity tag, distinct for each content encoding
+        """
+        self.set_header("Vary", "Accept-Encoding")
+        encoding = self._negotiate_encoding()
+        return tag if encoding is None else f"{tag}-{encoding}"
+
+    def _cached_report_etag(self, report_key: str) -> tp.Optional[str]:
+        """Compute the entity tag of a cached report.
+
+        The tag identifies the cache entry, so it changes when the report is
+        generated again.
+
+        Args:
+            report_key: Report cache key
+
+        Returns:
+            The entity tag or None if the report is not cached
+        """
+        metadata = None if self.report_cache is None else self.report_cache.get_metadata(report_key)
+        if metadata is None:
+            return None
+        created = metadata.get("created", metadata["expires"])
+        return self._report_etag(f"{report_key}-{int(created * 1000):x}")
+
+    async def _send_report(self, report: Path, cache_key: tp.Optional[str] = None):
+        """Send an HTML report by chunks, compressed if the client accepts it.
+
+        Args:
+            report: Report path
+            cache_key: Cache key of the report if it comes from the cache;
+                its compressed variants are then created once and reused
+        """
+        encoding = self._negotiate_encoding()
+        self.set_header("Content-Type", "text/html; charset=UTF-8")
+        self.set_header("Vary", "Accept-Encoding")
+        compressor = None
+        if encoding is not None:
+            self.set_header("Content-Encoding", encoding)
+            variant = None
+            if cache_key is not None and self.report_cache is not None:
+                variant = await self.report_cache.compressed(cache_key, encoding)
+            if variant is not None:
+                report = variant
+            else:
+                compressor = Compressor(encoding)
+        if compressor is None:
+            self.set_header("Content-Length", report.stat().st_size)
+
+        loop = asyncio.get_event_loop()
+        try:
+            with self.trace.span("response"):
+                with report.open("rb") as stream:
+                    chunk = await loop.run_in_executor(None, stream.read, REPORT_CHUNK_SIZE)
+                    while chunk:
+                        self.write(chunk if compressor is None else compressor.compress(chunk))
+                        await self.flush()  # Wait for the client to keep the memory bounded
+                        chunk = await loop.run_in_executor(None, stream.read, REPORT_CHUNK_SIZE)
+                if compressor is not None:
+                    self.write(compressor.flush())
+                    await self.flush()
+            self.finish()
+        except StreamClosedError:
+            self.log.debug(f"Client disconnected while sending '{self.request.path}'.")
+
+    def _get_job(self, job_id: str) -> tp.Optional[Job]:
+        """Get a job of the current user.
+
+        Args:
+            job_id: Job identifier
+
+        Returns:
+            The job or None, after sending a 404 error, if it does not exist
+            or belongs to another user
+        """
+        job = self.job_store.get(job_id)
+        if job is None or job.username != self.get_current_user()["name"]:
+            self.write_error(404, f"Unknown job '{job_id}'.")
+            return None
+        return job
+
+    def _templates_etag(
+        self, commit: tp.Optional[str], digest: tp.Optional[str] = None
+    ) -> tp.Optional[str]:
+        """Compute the entity tag of the templates list.
+
+        Args:
+            commit: Commit SHA of the templates repository
+            digest: Templates folder digest (see `TemplateIndex.digest`) used without commit
+
+        Returns:
+            The entity tag or None if neither the commit nor the digest is known
+        """
+        version = commit if commit is not None else digest
+        if version is None:
+            return None
+        identity = json.dumps([self.report_path, __version__, type(self).__name__])
+        return f"{version}-{hashlib.sha1(identity.encode('utf-8')).hexdigest()[:12]}"
+
+    async def _get_fresh_templates(self, commit: tp.Optional[str]) -> tp.Optional[tp.List[tp.Dict]]:
+        """Get the templates list unless the client copy is up-to-date.
+
+        With a commit, the entity tag is checked before listing the templates.
+        Without git repository, it is derived from the index entries once the
+        folder is listed, so only the rendering and the transfer are saved.
+
+        Args:
+            commit: Commit SHA of the templates repository
+
+        Returns:
+            List[Template] List of templates or None if the response was
+            finished with a ``304 Not Modified`` status
+        """
+        etag = self._templates_etag(commit)
+        if etag is not None and self._check_not_modified(etag):
+            return None
+        self.set_header("Cache-Control", "private, no-cache")
+        with self.trace.span("listing"):
+            templates = await self._get_templates(commit)
+        if etag is None:
+            with self.template_repository.checkout() as root_dir:
+                digest = self.template_index.digest(root_dir / self.report_path)
+            etag = self._templates_etag(commit, digest)
+            if etag is not None and self._check_not_modified(etag):
+                return None
+        return templates
+
+    async def _get_templates(self, commit: tp.Optional[str]) -> tp.List[tp.Dict]:
         """Get the templates list.
 
         A template object is defined as:
@@ -215,36 +490,21 @@ class ReportHandler(HubOAuthenticated, web.RequestHandler):
                 path: str
                 parameters: List[Parameter]
 
+        The templates are read from the git objects at the commit if the
+        index has a git object store, otherwise from the templates folder.
+
+        Args:
+            commit: Commit SHA of the templates repository (see `TemplateRepository.refresh`)
+
         Returns:
             List[Template] List of templates
-
-        Raises:
-            CalledProcessError: If the git repository cannot be updated.
         """
-        await update_git_repository(
-            self.report_root_path, self.report_path, self.report_git_url
-        )
-        template_dir = Path(self.report_root_path) / self.report_path
+        if commit is not None and self.template_index.object_store is not None:
+            return await self.template_index.list_git_templates(commit, self.report_path)
 
-        templates = []
-        for report in template_dir.glob("**/*.ipynb"):
-            parameters = {}
-            try:
-                parameters = pm.inspect_notebook(str(report))
-            except BaseException:
-                self.log.warning(
-                    f"Unable to get the parameters for notebook '{report!s}'.",
-                    exc_info=True,
-                )
-            templates.append(
-                {
-                    "path": str(report.relative_to(template_dir)),
-                    # Convert to dict to avoid OrderedDict as parameter object
-                    "parameters": [dict(v) for v in parameters.values()],
-                }
-            )
-
-        return templates
+        with self.template_repository.checkout() as root_dir:
+            template_dir = root_dir / self.report_path
+            return await self.template_index.list_templates(template_dir, generation=commit)
 
 
 class TemplatesHandler(ReportHandler):
@@ -256,13 +516,18 @@ class TemplatesHandler(ReportHandler):
     async def get(self):
         """Render a page allowing the user to pick a report to generate."""
         try:
-            templates = await self._get_templates()
+            with self.trace.span("git_update"):
+                commit = await self.template_repository.refresh()
         except CalledProcessError as error:
             message = f"Fail to update the Jupyter reports repository '{self.report_git_url}'."
             self.log.error(message, exc_info=error)
             self.write_error(500, message, exc_info=sys.exc_info())
         else:
-            html = self.render_template("report.html", reports=templates)
+            templates = await self._get_fresh_templates(commit)
+            if templates is None:
+                return
+            with self.trace.span("render"):
+                html = self.render_template("report.html", reports=templates)
             self.write(html)
 
     @web.authenticated
@@ -282,23 +547,8 @@ class TemplatesHandler(ReportHandler):
         self.redirect("?".join((path, urlencode(arguments))))
 
 
-class TemplatesAPIHandler(ReportHandler):
-    """REST API handler for the templates list."""
-
-    @web.authenticated
-    async def get(self):
-        """List the Jupyter reports available."""
-        self.set_header("Content-Type", "application/json")
-
-        try:
-            templates = await self._get_templates()
-        except CalledProcessError as error:
-            message = f"Fail to update the Jupyter reports repository '{self.report_git_url}'."
-            self.log.error(message, exc_info=error)
-            self.write_error(500, message, exc_info=sys.exc_info())
-        else:
-            self.set_status(200)
-            self.finish(json.dumps({"templates": templates}))
+class APIErrorMixin:
+    """Format the errors of a REST API handler in JSON."""
 
     def write_error(
         self,
@@ -319,31 +569,129 @@ class TemplatesAPIHandler(ReportHandler):
         self.write(json.dumps(_serialize_exception(error, message)))
 
 
-class TemplateHandler(ReportHandler):
-    """Handle report generator."""
+class TemplatesAPIHandler(APIErrorMixin, ReportHandler):
+    """REST API handler for the templates list."""
 
-    def _save_broken_report(self, notebook_path: Path, username: str) -> Path:
-        """Save the notebook in the broken reports folder.
+    @web.authenticated
+    async def get(self):
+        """List the Jupyter reports available."""
+        self.set_header("Content-Type", "application/json")
+
+        try:
+            with self.trace.span("git_update"):
+                commit = await self.template_repository.refresh()
+        except CalledProcessError as error:
+            message = f"Fail to update the Jupyter reports repository '{self.report_git_url}'."
+            self.log.error(message, exc_info=error)
+            self.write_error(500, message, exc_info=sys.exc_info())
+        else:
+            templates = await self._get_fresh_templates(commit)
+            if templates is None:
+                return
+            self.set_status(200)
+            self.finish(json.dumps({"templates": templates}))
+
+
+class TemplatesRefreshAPIHandler(APIErrorMixin, ReportHandler):
+    """REST API handler to refresh the templates repository (e.g. from a git webhook)."""
+
+    def _check_webhook_token(self) -> bool:
+        """Whether the request provides the webhook token.
+
+        The token is read from the ``token`` query argument or from the
+        ``X-Gitlab-Token`` header.
 
-        Args:
-            notebook_path: The broken report
-            username: User name trying to execute the report
         Returns:
-            The copied broken report path
+            True if a webhook token is configured and matches the request one
         """
-        local_user = pwd.getpwnam(username) if pwd is not None and username != ANONYMOUS_USER else None
-        prefix = datetime.strftime(datetime.now(), "%Y-%m-%d") + "_broken_"
-        broken_notebook = Path(self.broken_path) / (prefix + notebook_path.name)
-        if not broken_notebook.parent.exists():
-            broken_notebook.parent.mkdir(parents=True)
-            if local_user:
-                os.chown(broken_notebook.parent, local_user.pw_uid, local_user.pw_gid)
+        token = self.settings.get("git_webhook_token")
+        if not token:
+            return False
+        request_token = self.get_query_argument(
+            "token", self.request.headers.get("X-Gitlab-Token", "")
+        )
+        return hmac.compare_digest(request_token.encode("utf-8"), token.encode("utf-8"))
+
+    async def post(self):
+        """Schedule an update of the templates repository."""
+        self.set_header("Content-Type", "application/json")
+        if not self._check_webhook_token() and not self.current_user:
+            self.write_error(403, "Invalid webhook token.")
+            return
+
+        ioloop.IOLoop.current().spawn_callback(self.template_repository.poll, True)
+        self.set_status(202)
+        self.finish(json.dumps({"commit": self.template_commit}))
+
+
+class MetricsHandler(APIErrorMixin, ReportHandler):
+    """Prometheus metrics endpoint."""
+
+    def compute_etag(self) -> tp.Optional[str]:
+        return None
+
+    async def get(self):
+        """Export the metrics in the Prometheus text format."""
+        if self.settings.get("authenticate_prometheus", True) and not self.current_user:
+            self.write_error(403, "Authentication required.")
+            return
+
+        self.set_header("Content-Type", CONTENT_TYPE_LATEST)
+        self.set_header("Cache-Control", "no-store")
+        self.finish(self.report_metrics.export())
+
+
+class ProfilesHandler(ReportHandler):
+    """Page of the templates cell execution profiles."""
+
+    @web.authenticated
+    async def get(self):
+        """Render the profiles of the executed templates."""
+        profiles = [
+            self.cell_profiles.get(profile["template"])
+            for profile in self.cell_profiles.list_profiles()
+        ]
+        self.set_header("Cache-Control", "private, no-cache")
+        self.write(
+            self.render_template(
+                "profile.html",
+                profiles=profiles,
+                format_time=lambda ts: datetime.fromtimestamp(ts).strftime("%Y-%m-%d %H:%M"),
+            )
+        )
 
-        broken_notebook.write_text(Path(notebook_path).read_text())
-        if local_user:
-            os.chown(broken_notebook, local_user.pw_uid, local_user.pw_gid)
 
-        return broken_notebook
+class ProfilesAPIHandler(APIErrorMixin, ReportHandler):
+    """REST API handler of the templates cell execution profiles."""
+
+    @web.authenticated
+    async def get(self, template_path: tp.Optional[str] = None):
+        """List the templates profiles or get the cells profile of a template."""
+        self.set_header("Content-Type", "application/json")
+        self.set_header("Cache-Control", "private, no-cache")
+        if template_path is None:
+            self.finish(json.dumps({"profiles": self.cell_profiles.list_profiles()}))
+            return
+
+        profile = self.cell_profiles.get(template_path)
+        if profile is None:
+            self.write_error(404, f"No profile for template '{template_path}'.")
+            return
+        self.finish(json.dumps(profile))
+
+
+class TemplateHandler(ReportHandler):
+    """Handle report generator."""
+
+    _closed = False
+    _generation = None  # type: tp.Optional[asyncio.Future]
+
+    def on_connection_close(self):
+        """Cancel the report generation when the client disconnects."""
+        self._closed = True
+        if self._generation is not None and not self._generation.done():
+            self.log.info(f"Client disconnected; cancelling '{self.request.path}'.")
+            self._generation.cancel()
 
     def _report_error(
         self, message: str, error: BaseException, broken_report: tp.Optional[Path]
@@ -374,7 +722,7 @@ class TemplateHandler(ReportHandler):
             message += "<br><br><code>" + error.stderr.replace("\n", "<br>") + "</code>"
 
         self.log.error(message, exc_info=error)
-        self.write_error(500, message, exc_info=sys.exc_info())
+        self.write_error(500, message, exc_info=(type(error), error, error.__traceback__))
 
     @web.authenticated
     async def get(self, template_path: str):
@@ -393,17 +741,38 @@ class TemplateHandler(ReportHandler):
         """
         username = self.get_current_user()["name"]
         try:
-            await update_git_repository(
-                self.report_root_path, self.report_path, self.report_git_url
-            )
+            with self.trace.span("git_update"):
+                await self.template_repository.refresh()
         except CalledProcessError as error:
             self.log.error(
                 f"Fail to update the Jupyter reports repository '{self.report_git_url}'.",
                 exc_info=error,
             )
 
-        template_dir = (Path(self.report_root_path) / self.report_path).resolve()
+        if self._closed:
+            return
+
+        # Hold the templates snapshot for the whole execution
+        with self.template_repository.checkout() as root_dir:
+            self._generation = asyncio.ensure_future(
+                self._generate_report(
+                    (root_dir / self.report_path).resolve(), template_path, username
+                )
+            )
+            try:
+                await self._generation
+            except asyncio.CancelledError:
+                if not self._closed:
+                    raise
+
+    async def _generate_report(self, template_dir: Path, template_path: str, username: str):
+        """Execute the template and send the HTML report.
 
+        Args:
+            template_dir: Templates folder
+            template_path: The template path relative to the templates folder
+            username: User name requesting the report
+        """
         tpl_path = template_dir / template_path
         if not tpl_path.exists():
             self.write_error(
@@ -411,86 +780,254 @@ class TemplateHandler(ReportHandler):
             )
             return
 
-        with TemporaryDirectory() as output:
-            os.chmod(
-                output, stat.S_IRWXU | stat.S_IRWXO
-            )  # Need to make the temporary file accessible by the request user
-            tmp_folder = Path(output)
-            parameters_file = tmp_folder / "parameters.json"
-            # As the input parameters are read as bytes from the query, they are
-            #  evaluated dynamically to retrieve their Python type.
-            parameters = {}
-            for key, values in self.request.query_arguments.items():
-                value = values[0].decode("utf-8")
-                try:
-                    parameters[key] = ast.literal_eval(
-                        value
-                    )  # Forbidden none literal expression
-                except BaseException:
-                    self.log.debug(
-                        f"Failed to evaluated '{value}' for parameter '{key}'."
-                    )
-                    parameters[key] = value
-
-            parameters_file.write_text(json.dumps(parameters))
-            output_nb = tmp_folder / tpl_path.name
-
-            command = [
-                sys.executable,
-                "-m",
-                "papermill.cli",
-                "--no-progress-bar",
-                "--request-save-on-cell-execute",
-                "--parameters_file",
-                str(parameters_file),
-                str(tpl_path),
-                str(output_nb),
-            ]
-            try:
-                if pwd is not None and username != ANONYMOUS_USER:
-                    # Generate the report impersonating the authenticated user
-                    await _execute_command(
-                        ["su", username, "-l", "-c", " ".join(command)], cwd=tmp_folder
-                    )
-                else:
-                    await _execute_command(command, cwd=tmp_folder)
-            except BaseException as error:
-                broken_report = None
-                if output_nb.exists():
-                    broken_report = self._save_broken_report(output_nb, username)
-                return self._report_error(
-                    f"Fail to execute report <em>{template_path!s}</em> with parameters '{self.request.query_arguments}'.",
-                    error,
-                    broken_report,
-                )
+        with self.trace.span("parameters"):
+            parameters = self._get_parameters()
+            report_key = self.report_generator.make_report_key(tpl_path, parameters, username)
+        cache_control = self.request.headers.get("Cache-Control", "")
+        if self.report_cache is not None and "no-cache" not in cache_control:
+            with self.trace.span("cache_lookup"):
+                report = self.report_cache.get(report_key)
+            self.report_metrics.record_cache("report", report is not None)
+            if report is not None:
+                self.log.debug(f"Report '{template_path}' read from the cache.")
+                self.set_header("X-Report-Cache", "HIT")
+                etag = self._cached_report_etag(report_key)
+                if etag is not None and self._check_not_modified(etag):
+                    return
+                self.set_status(200)
+                await self._send_report(report, report_key)
+                return
 
+        try:
+            async with self.trace.span_entering(
+                "execution",
+                self.report_generator.share(
+                    tpl_path,
+                    template_path,
+                    parameters,
+                    username,
+                    report_key,
+                    self.broken_path,
+                    store="no-store" not in cache_control,
+                    on_phase=self._record_phase,
+                ),
+            ) as report:
+                cache_key = None
+                etag = None
+                if self.report_cache is not None:
+                    self.set_header("X-Report-Cache", "MISS")
+                    if report.parent == self.report_cache.cache_dir:
+                        cache_key = report_key
+                        etag = self._cached_report_etag(report_key)
+                if etag is not None:
+                    self.set_header("Etag", f'"{etag}"')
+                self.set_header("Cache-Control", "private, no-cache")
+                self.set_status(200)
+                await self._send_report(report, cache_key)
+        except ExecutionError as error:
+            self._report_error(error.message, error.error, error.notebook)
+        except QueueFull as error:
+            self.log.warning(f"Report '{template_path}' rejected: {error!s}")
+            self.set_header("Retry-After", str(error.retry_after))
+            self.write_error(503, message=str(error))
+
+    def _get_parameters(self) -> tp.Dict[str, tp.Any]:
+        """Get the template parameters from the query arguments.
+
+        As the input parameters are read as bytes from the query, they are
+        evaluated dynamically to retrieve their Python type.
+
+        Returns:
+            The parameters
+        """
+        parameters = {}
+        for key, values in self.request.query_arguments.items():
+            value = values[0].decode("utf-8")
             try:
-                command = [
-                    sys.executable,
-                    "-m",
-                    "nbconvert",
-                    "--to=html",
-                    f'--output-dir="{tmp_folder!s}"',
-                    str(output_nb),
-                ]
-
-                if pwd is not None and username != ANONYMOUS_USER:
-                    await _execute_command(
-                        ["su", username, "-l", "-c", " ".join(command)], cwd=tmp_folder
-                    )
-                else:
-                    await _execute_command(command, cwd=tmp_folder)
-            except BaseException as error:
-                broken_report = None
-                if output_nb.exists():
-                    broken_report = self._save_broken_report(output_nb, username)
-                return self._report_error(
-                    f"Fail to render report '{template_path!s}' as HTML.",
-                    error,
-                    broken_report,
+                parameters[key] = ast.literal_eval(
+                    value
+                )  # Forbidden none literal expression
+            except BaseException:
+                self.log.debug(
+                    f"Failed to evaluated '{value}' for parameter '{key}'."
                 )
+                parameters[key] = value
+        return parameters
 
-            report = output_nb.parent / (output_nb.stem + ".html")
 
-            self.set_status(200)
-            self.finish(report.read_text())
+class JobsAPIHandler(APIErrorMixin, ReportHandler):
+    """REST API handler to submit and list the asynchronous report jobs."""
+
+    @web.authenticated
+    async def get(self):
+        """List the user jobs."""
+        username = self.get_current_user()["name"]
+        self.set_header("Content-Type", "application/json")
+        self.finish(
+            json.dumps({"jobs": [job.to_dict() for job in self.job_store.list_jobs(username)]})
+        )
+
+    @web.authenticated
+    async def post(self):
+        """Submit a report job.
+
+        The body is a JSON object with the template path (``template``), its
+        parameters (``parameters``) and the execution priority class
+        (``priority``; default ``batch``).
+        """
+        self.set_header("Content-Type", "application/json")
+        try:
+            body = json.loads(self.request.body or b"{}")
+            template_path = body["template"]
+            parameters = body.get("parameters", {})
+            priority = body.get("priority", BATCH)
+            if not isinstance(template_path, str) or not isinstance(parameters, dict):
+                raise TypeError("'template' must be a string and 'parameters' an object.")
+            if priority not in PRIORITIES:
+                raise ValueError(f"'priority' must be one of {PRIORITIES}.")
+        except (ValueError, KeyError, TypeError) as error:
+            self.write_error(400, "Invalid job request.", error)
+            return
+
+        try:
+            await self.template_repository.refresh()
+        except CalledProcessError as error:
+            self.log.error(
+                f"Fail to update the Jupyter reports repository '{self.report_git_url}'.",
+                exc_info=error,
+            )
+
+        with self.template_repository.checkout() as root_dir:
+            tpl_path = (root_dir / self.report_path).resolve() / template_path
+            if not template_path.endswith(".ipynb") or not tpl_path.exists():
+                self.write_error(404, f"Template file '{template_path}' does not exists.")
+                return
+
+        if self.report_scheduler.full:
+            retry_after = self.report_scheduler.retry_after()
+            self.set_header("Retry-After", str(retry_after))
+            self.write_error(503, str(QueueFull(retry_after)))
+            return
+
+        username = self.get_current_user()["name"]
+        job = self.job_store.submit(
+            template_path, parameters, username, self.report_generator.run_job, priority
+        )
+        self.set_status(202)
+        self.set_header("Location", self.request.path.rstrip("/") + "/" + job.id)
+        self.finish(json.dumps(job.to_dict()))
+
+
+class JobAPIHandler(APIErrorMixin, ReportHandler):
+    """REST API handler of an asynchronous report job."""
+
+    @web.authenticated
+    async def get(self, job_id: str):
+        """Get the job status."""
+        job = self._get_job(job_id)
+        if job is not None:
+            self.set_header("Content-Type", "application/json")
+            self.finish(json.dumps(job.to_dict()))
+
+    @web.authenticated
+    async def delete(self, job_id: str):
+        """Cancel a running job or remove a finished one."""
+        job = self._get_job(job_id)
+        if job is None:
+            return
+
+        if job.done:
+            self.job_store.delete(job)
+            self.set_status(204)
+            self.finish()
+        else:
+            self.job_store.cancel(job)
+            self.set_status(202)
+            self.set_header("Content-Type", "application/json")
+            self.finish(json.dumps(job.to_dict()))
+
+
+class JobReportHandler(APIErrorMixin, ReportHandler):
+    """Handler of an asynchronous report job result."""
+
+    @web.authenticated
+    async def get(self, job_id: str):
+        """Send the HTML report of a completed job."""
+        job = self._get_job(job_id)
+        if job is None:
+            return
+
+        if job.status != COMPLETED:
+            self.write_error(409, f"Job '{job_id}' is {job.status}.")
+            return
+
+        # A job report never changes until the job expires
+        max_age = max(0, int(job.finished + self.job_store.ttl - time.time()))
+        if self._check_not_modified(
+            self._report_etag(f"job-{job.id}"), f"private, max-age={max_age}"
+        ):
+            return
+        await self._send_report(self.job_store.report(job))
+
+
+class JobProgressHandler(APIErrorMixin, ReportHandler):
+    """Server-sent events stream of an asynchronous report job progress."""
+
+    _closed = None  # type: tp.Optional[asyncio.Event]
+
+    def on_connection_close(self):
+        """Stop streaming when the client disconnects."""
+        if self._closed is not None:
+            self._closed.set()
+
+    def _send_event(self, event: str, data: tp.Dict):
+        self.write(f"event: {event}\ndata: {json.dumps(data)}\n\n")
+
+    @web.authenticated
+    async def get(self, job_id: str):
+        """Stream the job progress.
+
+        A ``cell`` event is sent each time the status of a code cell changes
+        (with its rendered outputs if the ``html`` query argument is true) and
+        a ``status`` event each time the job status changes. The stream ends
+        when the job is finished.
+        """
+        job = self._get_job(job_id)
+        if job is None:
+            return
+
+        with_html = self.get_argument("html", "false").lower() in ("1", "true", "yes")
+        self._closed = asyncio.Event()
+        self.set_header("Content-Type", "text/event-stream")
+        self.set_header("Cache-Control", "no-cache")
+        sent_cells = {}  # type: tp.Dict[int, tp.Tuple]
+        status = None
+        progress = None
+        while not self._closed.is_set():
+            if progress is None and job.execution_key is not None:
+                progress = self.execution_progress.get(job.execution_key)
+            for cell in [] if progress is None else progress.cells:
+                state = (cell["status"], cell["duration"], cell["execution_count"])
+                if sent_cells.get(cell["index"]) == state:
+                    continue
+                sent_cells[cell["index"]] = state
+                event = {k: v for k, v in cell.items() if k != "outputs"}
+                if with_html and cell["status"] in ("completed", "failed"):
+                    event["html"] = render_outputs(cell["outputs"])
+                self._send_event("cell", event)
+            if job.status != status:
+                status = job.status
+                self._send_event("status", job.to_dict())
+            try:
+                await self.flush()
+            except StreamClosedError:
+                return
+            if job.done:
+                break
+
+            if progress is None or progress.finished:
+                await asyncio.sleep(self.execution_progress.interval)
+            else:
+                await progress.wait(self.execution_progress.interval)
+        if not self._closed.is_set():
+            self.finish()
@@ -0,0 +1,498 @@
+"""Persistent index of the notebook templates metadata."""
+import asyncio
+import hashlib
+import json
+import logging
+import os
+import time
+import typing as tp
+from concurrent.futures import Executor
+from concurrent.futures.process import BrokenProcessPool
+from pathlib import Path
+
+from nbformat import ValidationError
+from tornado.log import app_log
+
+from .gitobjects import GitObjectStore
+from .inspection import inspect_notebook, inspect_notebook_content
+from .metrics import INSPECTION, ReportMetrics
+from .utils import git_blob_sha
+
+INDEX_VERSION = 1
+
+_PARSE_ERRORS = (ValueError, ValidationError)
+"""Errors of the notebooks that cannot be read as notebooks; they are indexed without parameters."""
+
+
+def _inspect_notebook(path: str) -> tp.List[tp.Dict]:
+    """Get the parameters of a notebook.
+
+    Args:
+        path: Notebook path
+
+    Returns:
+        List of parameters
+    """
+    parameters = inspect_notebook(path)
+    # Convert to dict to avoid OrderedDict as parameter object
+    return [dict(v) for v in parameters.values()]
+
+
+def _inspect_notebook_content(content: bytes) -> tp.List[tp.Dict]:
+    """Get the parameters of a notebook from its content.
+
+    Args:
+        content: Notebook content
+
+    Returns:
+        List of parameters
+    """
+    return [dict(v) for v in inspect_notebook_content(content).values()]
+
+
+def _file_entry(notebook: Path, entry: tp.Optional[tp.List]) -> tp.List:
+    """Get the index entry of a notebook.
+
+    Args:
+        notebook: Notebook path
+        entry: Previous entry of the notebook
+
+    Returns:
+        [modification time (ns), size, blob SHA]; the blob SHA is only computed
+        if the modification time or size changed
+    """
+    stat = notebook.stat()
+    if entry is None or entry[:2] != [stat.st_mtime_ns, stat.st_size]:
+        entry = [stat.st_mtime_ns, stat.st_size, git_blob_sha(notebook.read_bytes())]
+    return entry
+
+
+def _scan_folder(
+    template_dir: Path, known_files: tp.Dict[str, tp.List]
+) -> tp.Dict[str, tp.List]:
+    """Scan a folder for notebooks.
+
+    Args:
+        template_dir: Templates folder
+        known_files: Previous scan result of the folder
+
+    Returns:
+        {relative path: [modification time (ns), size, blob SHA]} sorted by path
+    """
+    files = {}
+    for report in sorted(template_dir.glob("**/*.ipynb")):
+        path = str(report.relative_to(template_dir))
+        files[path] = _file_entry(report, known_files.get(path))
+    return files
+
+
+def _update_entries(
+    template_dir: Path, known_files: tp.Dict[str, tp.List], paths: tp.Iterable[str]
+) -> tp.Dict[str, tp.List]:
+    """Update the scan result of some paths of a folder.
+
+    Args:
+        template_dir: Templates folder
+        known_files: Previous scan result of the folder
+        paths: Changed (or removed) notebooks and subfolders relative to the folder
+
+    Returns:
+        {relative path: [modification time (ns), size, blob SHA]} sorted by path
+    """
+    files = dict(known_files)
+    for path in paths:
+        target = template_dir / path
+        if path in files:
+            stale = {path: files.pop(path)}
+        else:  # Subfolder or unknown notebook
+            stale = {
+                p[len(path) + 1 :]: files.pop(p)
+                for p in [p for p in files if p.startswith(path + os.sep)]
+            }
+        if target.is_dir():
+            files.update(
+                (os.path.join(path, p), entry) for p, entry in _scan_folder(target, stale).items()
+            )
+        elif target.suffix == ".ipynb" and target.is_file():
+            try:
+                files[path] = _file_entry(target, stale.get(path))
+            except FileNotFoundError:  # Removed meanwhile
+                pass
+    return dict(sorted(files.items(), key=lambda item: Path(item[0]).parts))
+
+
+class TemplateIndex:
+    """Index of the templates parameters.
+
+    The parameters are stored by git blob SHA of the notebook content and each
+    scanned folder keeps the modification time and size of its notebooks. So
+    only new or modified notebooks are inspected when listing the templates.
+
+    The index is saved on disk to be reused across service restarts.
+
+    The notebooks inspection is executed in the provided executor to
+    not block the event loop and to inspect the notebooks in parallel.
+    Only the notebooks that cannot be parsed are indexed without parameters;
+    the other failures (e.g. I/O errors or a crashed inspection process) are
+    not recorded, so the notebooks are inspected again by the next listing.
+
+    If a git object store is provided, the templates can also be listed at a
+    commit from the git objects (see `list_git_templates`).
+
+    A folder can be watched (see `watch`): its listing is then served from
+    memory, without scanning it, and its entries are kept current by
+    `update_templates` from the filesystem events.
+
+    Args:
+        index_file: Index persistence file; the index is kept in memory only if None
+        executor: Executor for the notebooks inspection; default thread pool if None
+        make_executor: Function creating a new executor if the process pool executor is broken
+        log: Logger
+        metrics: Metrics recording the inspections duration and the index hits
+        object_store: Git object store of the templates repository
+    """
+
+    def __init__(
+        self,
+        index_file: tp.Optional[str] = None,
+        executor: tp.Optional[Executor] = None,
+        log: tp.Optional[logging.Logger] = None,
+        metrics: tp.Optional[ReportMetrics] = None,
+        object_store: tp.Optional[GitObjectStore] = None,
+        make_executor: tp.Optional[tp.Callable[[], Executor]] = None,
+    ):
+        self.index_file = None if index_file is None else Path(index_file)
+        self.executor = executor
+        self.make_executor = make_executor
+        self.log = log or app_log
+        self.metrics = metrics
+        self.object_store = object_store
+        # {folder: {relative path: [modification time (ns), size, blob SHA]}}
+        self._directories = {}  # type: tp.Dict[str, tp.Dict[str, tp.List]]
+        # {blob SHA: parameters}
+        self._parameters = {}  # type: tp.Dict[str, tp.List[tp.Dict]]
+        # {folder: generation of the last scan}
+        self._generations = {}  # type: tp.Dict[str, str]
+        # {folder relative to the repository: [commit SHA, {relative path: blob SHA}]}
+        self._trees = {}  # type: tp.Dict[str, tp.List]
+        # Folders whose entries are kept current by a watcher
+        self._watched = set()  # type: tp.Set[str]
+        # {blob SHA: on-going inspection}
+        self._inspections = {}  # type: tp.Dict[str, asyncio.Future]
+        self._load()
+
+    def _load(self):
+        """Load the index from its persistence file."""
+        if self.index_file is None or not self.index_file.exists():
+            return
+
+        try:
+            content = json.loads(self.index_file.read_text())
+            if content.get("version") != INDEX_VERSION:
+                raise ValueError(f"Unsupported index version {content.get('version')}.")
+            self._directories = content["directories"]
+            self._parameters = content["parameters"]
+            self._generations = content.get("generations", {})
+            self._trees = content.get("trees", {})
+        except BaseException:
+            self.log.warning(
+                f"Unable to load the templates index '{self.index_file!s}'; it will be rebuilt.",
+                exc_info=True,
+            )
+            self._directories = {}
+            self._parameters = {}
+            self._generations = {}
+            self._trees = {}
+
+    def save(self):
+        """Save the index in its persistence file.
+
+        Folders no longer existing and unreferenced parameters are dropped.
+        """
+        if self.index_file is None:
+            return
+
+        self._directories = {
+            folder: files
+            for folder, files in self._directories.items()
+            if Path(folder).exists()
+        }
+        self._generations = {
+            folder: generation
+            for folder, generation in self._generations.items()
+            if folder in self._directories
+        }
+        used_blobs = {
+            entry[2] for files in self._directories.values() for entry in files.values()
+        }
+        used_blobs.update(blob for _, files in self._trees.values() for blob in files.values())
+        self._parameters = {
+            blob: parameters
+            for blob, parameters in self._parameters.items()
+            if blob in used_blobs
+        }
+
+        self.index_file.parent.mkdir(parents=True, exist_ok=True)
+        tmp_file = self.index_file.with_name(self.index_file.name + ".tmp")
+        tmp_file.write_text(
+            json.dumps(
+                {
+                    "version": INDEX_VERSION,
+                    "directories": self._directories,
+                    "parameters": self._parameters,
+                    "generations": self._generations,
+                    "trees": self._trees,
+                }
+            )
+        )
+        os.replace(tmp_file, self.index_file)
+
+    async def _read_blob_parameters(self, blob: str) -> tp.List[tp.Dict]:
+        """Read a notebook from the git object store and inspect it."""
+        content = await self.object_store.read(blob)
+        return await asyncio.get_event_loop().run_in_executor(
+            self.executor, _inspect_notebook_content, content
+        )
+
+    async def _inspect(self, notebook: tp.Union[Path, str], blob: str, from_git: bool = False):
+        """Inspect a notebook and store its parameters.
+
+        The inspection is shared by the concurrent listings and does not raise
+        (see `_run_inspection`).
+
+        Args:
+            notebook: Notebook path
+            blob: Notebook blob SHA
+            from_git: Whether to read the notebook from the git object store
+        """
+        inspection = self._inspections.get(blob)
+        if inspection is None:  # Not already requested by another listing
+            inspection = asyncio.ensure_future(self._run_inspection(notebook, blob, from_git))
+            self._inspections[blob] = inspection
+        # A cancelled listing does not cancel the inspection awaited by the other ones
+        await asyncio.shield(inspection)
+
+    async def _run_inspection(self, notebook: tp.Union[Path, str], blob: str, from_git: bool):
+        """Execute the inspection of a notebook (see `_inspect`).
+
+        The parameters are only stored if the inspection succeeded or if the
+        notebook cannot be parsed.
+        """
+        executor = self.executor
+        start = time.monotonic()
+        try:
+            if from_git:
+                parameters = await self._read_blob_parameters(blob)
+            else:
+                loop = asyncio.get_event_loop()
+                parameters = await loop.run_in_executor(
+                    executor, _inspect_notebook, str(notebook)
+                )
+        except _PARSE_ERRORS:
+            self.log.warning(
+                f"Unable to get the parameters for notebook '{notebook!s}'.",
+                exc_info=True,
+            )
+            parameters = []
+        except BrokenProcessPool:
+            self.log.warning(
+                f"Inspection process crashed while inspecting notebook '{notebook!s}'.",
+                exc_info=True,
+            )
+            self._replace_executor(executor)
+            return
+        except Exception:
+            self.log.warning(
+                f"Unable to inspect notebook '{notebook!s}'; it will be inspected again.",
+                exc_info=True,
+            )
+            return
+        finally:
+            del self._inspections[blob]
+            if self.metrics is not None:
+                self.metrics.observe(INSPECTION, time.monotonic() - start)
+        self._parameters[blob] = parameters
+
+    def _replace_executor(self, broken: tp.Optional[Executor]):
+        """Replace a broken inspection executor.
+
+        Args:
+            broken: Executor whose process crashed
+        """
+        if self.make_executor is None or self.executor is not broken:
+            return  # Not replaceable or already replaced by a concurrent inspection
+        self.executor = self.make_executor()
+        if broken is not None:
+            broken.shutdown(wait=False)
+
+    async def list_templates(
+        self,
+        template_dir: tp.Union[str, Path],
+        generation: tp.Optional[str] = None,
+        rescan: bool = False,
+    ) -> tp.List[tp.Dict]:
+        """List the templates and their parameters.
+
+        If a generation is provided (e.g. the git commit SHA of the folder) and
+        it is equal to the one of the previous listing, the folder is not scanned.
+
+        Args:
+            template_dir: Templates folder
+            generation: Folder content identifier
+            rescan: Whether to scan the folder even if it is watched
+
+        Returns:
+            List[Template] List of templates sorted by path
+        """
+        template_dir = Path(template_dir).resolve()
+        key = str(template_dir)
+        known_files = self._directories.get(key, {})
+        known_generation = self._generations.get(key)
+        if (not rescan and key in self._watched and key in self._directories) or (
+            generation is not None and known_generation == generation
+        ):
+            files = known_files
+        else:
+            loop = asyncio.get_event_loop()
+            files = await loop.run_in_executor(
+                None, _scan_folder, template_dir, known_files
+            )
+
+        self._directories[key] = files
+        to_inspect = {
+            entry[2]: template_dir / path
+            for path, entry in files.items()
+            if entry[2] not in self._parameters
+        }
+        if self.metrics is not None:
+            misses = sum(1 for entry in files.values() if entry[2] in to_inspect)
+            self.metrics.record_cache("template_index", True, len(files) - misses)
+            self.metrics.record_cache("template_index", False, misses)
+        await asyncio.gather(
+            *(self._inspect(notebook, blob) for blob, notebook in to_inspect.items())
+        )
+
+        if generation is not None:
+            self._generations[key] = generation
+        else:
+            self._generations.pop(key, None)
+
+        if files != known_files or to_inspect or known_generation != generation:
+            self._save_quietly()
+
+        return [
+            {"path": path, "parameters": self._parameters.get(entry[2], [])}
+            for path, entry in files.items()
+        ]
+
+    def digest(self, template_dir: tp.Union[str, Path]) -> tp.Optional[str]:
+        """Identify the notebooks of a folder at its last listing.
+
+        Args:
+            template_dir: Templates folder
+
+        Returns:
+            The SHA-1 of the notebooks (path, blob SHA) pairs or None if the
+            folder was never listed
+        """
+        files = self._directories.get(str(Path(template_dir).resolve()))
+        if files is None:
+            return None
+        content = json.dumps([[path, entry[2]] for path, entry in sorted(files.items())])
+        return hashlib.sha1(content.encode("utf-8")).hexdigest()
+
+    def watch(self, template_dir: tp.Union[str, Path], watched: bool = True):
+        """Set whether the entries of a folder are kept current by a watcher.
+
+        The listings of a watched folder, once scanned, are served from memory.
+
+        Args:
+            template_dir: Templates folder
+            watched: Whether the folder is watched
+        """
+        key = str(Path(template_dir).resolve())
+        if watched:
+            self._watched.add(key)
+        else:
+            self._watched.discard(key)
+
+    async def update_templates(self, template_dir: tp.Union[str, Path], paths: tp.Iterable[str]):
+        """Update the entries of changed paths of a folder and inspect them.
+
+        Args:
+            template_dir: Templates folder
+            paths: Added, modified or removed notebooks and subfolders relative to the folder
+        """
+        template_dir = Path(template_dir).resolve()
+        key = str(template_dir)
+        known_files = self._directories.get(key, {})
+        loop = asyncio.get_event_loop()
+        files = await loop.run_in_executor(
+            None, _update_entries, template_dir, known_files, list(paths)
+        )
+        self._directories[key] = files
+
+        to_inspect = {
+            entry[2]: template_dir / path
+            for path, entry in files.items()
+            if entry[2] not in self._parameters
+        }
+        await asyncio.gather(
+            *(self._inspect(notebook, blob) for blob, notebook in to_inspect.items())
+        )
+        if files != known_files:
+            self._save_quietly()
+
+    async def list_git_templates(self, commit: str, template_dir: str = ".") -> tp.List[tp.Dict]:
+        """List the templates and their parameters at a commit of the git object store.
+
+        The notebooks are listed and read from the git objects, not from the
+        working tree; only the notebooks whose blob SHA is not indexed are
+        inspected.
+
+        Args:
+            commit: Commit SHA of the templates repository
+            template_dir: Templates folder relative to the repository root
+
+        Returns:
+            List[Template] List of templates sorted by path
+
+        Raises:
+            CalledProcessError: If the templates folder cannot be listed
+        """
+        known = self._trees.get(template_dir)
+        if known is not None and known[0] == commit:
+            files = known[1]
+        else:
+            files = await self.object_store.list_notebooks(commit, template_dir)
+        self._trees[template_dir] = [commit, files]
+
+        to_inspect = {blob: path for path, blob in files.items() if blob not in self._parameters}
+        if self.metrics is not None:
+            misses = sum(1 for blob in files.values() if blob in to_inspect)
+            self.metrics.record_cache("template_index", True, len(files) - misses)
+            self.metrics.record_cache("template_index", False, misses)
+        await asyncio.gather(
+            *(
+                self._inspect(f"{commit}:{path}", blob, from_git=True)
+                for blob, path in to_inspect.items()
+            )
+        )
+
+        if known is None or known[0] != commit or to_inspect:
+            self._save_quietly()
+
+        return [
+            {"path": path, "parameters": self._parameters.get(blob, [])}
+            for path, blob in files.items()
+        ]
+
+    def _save_quietly(self):
+        """Save the index, logging the failures."""
+        try:
+            self.save()
+        except OSError:
+            self.log.warning(
+                f"Unable to save the templates index '{self.index_file!s}'.",
+                exc_info=True,
+            )
@@ -0,0 +1,330 @@
+"""Fast inspection of the notebook templates parameters."""
+import io
+import json
+import re
+import tempfile
+import typing as tp
+from pathlib import Path
+
+import nbformat
+import papermill as pm
+from papermill.translators import papermill_translators
+from papermill.utils import nb_kernel_name, nb_language
+from tornado.log import app_log
+
+CHUNK_SIZE = 64 * 1024
+"""Size in characters of the notebook chunks read."""
+
+_WHITESPACE = re.compile(r"[ \t\n\r]*")
+# Characters of a string up to its closing quote or to an escape cut by the chunk end
+_STRING_CHARS = re.compile(r'[^"\\]*(?:\\.[^"\\]*)*', re.DOTALL)
+# Characters outside strings up to the next structural one
+_NON_STRUCTURAL = re.compile(r'[^\[\]{}"]*')
+_SCALAR_CHARS = re.compile(r"[^,\]}\s]*")
+
+
+class _JsonStream:
+    """Incremental reader of a JSON document.
+
+    Only the unread part of the document and the value being decoded are kept
+    in memory; skipped values are scanned without being decoded.
+
+    Args:
+        stream: Text stream of the document
+        chunk_size: Size in characters of the chunks read
+    """
+
+    def __init__(self, stream: tp.TextIO, chunk_size: int = CHUNK_SIZE):
+        self._stream = stream
+        self._chunk_size = chunk_size
+        self._buffer = ""
+        self._pos = 0
+        # Start of the value being decoded
+        self._start = None  # type: tp.Optional[int]
+
+    def _fill(self) -> bool:
+        """Read the next chunk, dropping the consumed characters.
+
+        Returns:
+            Whether characters were read
+        """
+        chunk = self._stream.read(self._chunk_size)
+        if not chunk:
+            return False
+        keep = self._pos if self._start is None else self._start
+        self._buffer = self._buffer[keep:] + chunk
+        self._pos -= keep
+        if self._start is not None:
+            self._start = 0
+        return True
+
+    def peek(self) -> str:
+        """Get the next non-whitespace character without consuming it.
+
+        Raises:
+            ValueError: At the end of the document
+        """
+        while True:
+            self._pos = _WHITESPACE.match(self._buffer, self._pos).end()
+            if self._pos < len(self._buffer):
+                return self._buffer[self._pos]
+            if not self._fill():
+                raise ValueError("Unexpected end of the JSON document.")
+
+    def expect(self, characters: str) -> str:
+        """Consume the next non-whitespace character.
+
+        Args:
+            characters: Allowed characters
+
+        Returns:
+            The consumed character
+
+        Raises:
+            ValueError: If the character is not allowed
+        """
+        character = self.peek()
+        if character not in characters:
+            raise ValueError(f"Unexpected character '{character}' instead of '{characters}'.")
+        self._pos += 1
+        return character
+
+    def _skip_string(self):
+        """Consume the rest of a string after its opening quote."""
+        while True:
+            self._pos = _STRING_CHARS.match(self._buffer, self._pos).end()
+            if self._pos < len(self._buffer) and self._buffer[self._pos] == '"':
+                self._pos += 1
+                return
+            # End of the chunk, possibly in an escape sequence
+            if not self._fill():
+                raise ValueError("Unterminated JSON string.")
+
+    def _skip_scalar(self):
+        """Consume a number, boolean or null."""
+        while True:
+            self._pos = _SCALAR_CHARS.match(self._buffer, self._pos).end()
+            if self._pos < len(self._buffer) or not self._fill():
+                return
+
+    def skip_value(self):
+        """Consume the next value without decoding it."""
+        character = self.expect('"[{-0123456789tfn')
+        if character == '"':
+            self._skip_string()
+            return
+        if character not in "[{":
+            self._skip_scalar()
+            return
+
+        depth = 1
+        while depth > 0:
+            self._pos = _NON_STRUCTURAL.match(self._buffer, self._pos).end()
+            if self._pos == len(self._buffer):
+                if not self._fill():
+                    raise ValueError("Unexpected end of the JSON document.")
+                continue
+            character = self._buffer[self._pos]
+            self._pos += 1
+            if character == '"':
+                self._skip_string()
+            elif character in "[{":
+                depth += 1
+            else:
+                depth -= 1
+
+    def read_value(self) -> tp.Any:
+        """Decode the next value.
+
+        Returns:
+            The value
+        """
+        self.peek()
+        self._start = self._pos
+        try:
+            self.skip_value()
+            text = self._buffer[self._start : self._pos]
+        finally:
+            self._start = None
+        return json.loads(text)
+
+    def iter_object(self) -> tp.Iterator[str]:
+        """Iterate over the keys of the next object.
+
+        The value of each key must be consumed before resuming the iteration.
+
+        Returns:
+            The keys iterator
+        """
+        self.expect("{")
+        if self.peek() == "}":
+            self._pos += 1
+            return
+        while True:
+            key = self.read_value()
+            if not isinstance(key, str):
+                raise ValueError(f"Invalid JSON object key {key!r}.")
+            self.expect(":")
+            yield key
+            if self.expect(",}") == "}":
+                return
+
+    def iter_array(self) -> tp.Iterator[int]:
+        """Iterate over the items of the next array.
+
+        Each item must be consumed before resuming the iteration.
+
+        Returns:
+            The items index iterator
+        """
+        self.expect("[")
+        if self.peek() == "]":
+            self._pos += 1
+            return
+        index = 0
+        while True:
+            yield index
+            index += 1
+            if self.expect(",]") == "]":
+                return
+
+
+def _read_cell(reader: _JsonStream) -> tp.Dict[str, tp.Any]:
+    """Decode a cell without its outputs and attachments."""
+    cell = {}
+    for key in reader.iter_object():
+        if key in ("outputs", "attachments"):
+            reader.skip_value()
+        else:
+            cell[key] = reader.read_value()
+    return cell
+
+
+def read_parameters_cell(
+    notebook: tp.Union[str, tp.TextIO], chunk_size: int = CHUNK_SIZE
+) -> tp.Tuple[tp.Optional[tp.Dict[str, tp.Any]], tp.Dict[str, tp.Any]]:
+    """Read the parameters cell of a notebook.
+
+    The notebook is streamed: the cells following the parameters cell and
+    the cells outputs are scanned without being decoded, and the reading
+    stops as soon as the parameters cell and the notebook metadata are known.
+
+    Args:
+        notebook: Notebook path or text stream
+        chunk_size: Size in characters of the chunks read
+
+    Returns:
+        The first cell tagged ``parameters`` (without outputs), or None, and
+        the notebook metadata
+
+    Raises:
+        OSError: If the notebook cannot be read
+        ValueError: If the notebook is not a valid JSON notebook in format 4
+    """
+    parameters_cell = None
+    metadata = None
+    version = None
+    cells_read = False
+    with open(notebook, encoding="utf-8") if isinstance(notebook, str) else notebook as stream:
+        reader = _JsonStream(stream, chunk_size)
+        for key in reader.iter_object():
+            if key == "cells":
+                for _ in reader.iter_array():
+                    if parameters_cell is not None:
+                        reader.skip_value()
+                        continue
+                    cell = _read_cell(reader)
+                    if "parameters" in cell.get("metadata", {}).get("tags", []):
+                        parameters_cell = cell
+                        if metadata is not None and version is not None:
+                            break
+                cells_read = True
+            elif key == "metadata":
+                metadata = reader.read_value()
+            elif key == "nbformat":
+                version = reader.read_value()
+            else:
+                reader.skip_value()
+
+            if version is not None and version != 4:
+                raise ValueError(f"Unsupported notebook format {version}.")
+            if (cells_read or parameters_cell is not None) and None not in (metadata, version):
+                break
+
+    if not cells_read and parameters_cell is None:
+        raise ValueError("Notebook without cells.")
+    if version is None:
+        raise ValueError("Notebook without format.")
+    if not isinstance(metadata, dict):
+        raise ValueError("Notebook without metadata.")
+    return parameters_cell, metadata
+
+
+def _infer_parameters(
+    cell: tp.Optional[tp.Dict[str, tp.Any]], metadata: tp.Dict[str, tp.Any]
+) -> tp.Dict[str, tp.Dict[str, tp.Any]]:
+    """Infer the parameters of a parameters cell with the papermill translator of its notebook."""
+    if cell is None:
+        return {}
+
+    source = cell.get("source", "")
+    notebook = nbformat.from_dict(
+        {
+            "cells": [dict(cell, source=source if isinstance(source, str) else "".join(source))],
+            "metadata": metadata,
+        }
+    )
+    translator = papermill_translators.find_translator(
+        nb_kernel_name(notebook), nb_language(notebook)
+    )
+    try:
+        parameters = translator.inspect(notebook.cells[0])
+    except NotImplementedError:
+        app_log.warning(
+            f"Translator for '{nb_language(notebook)}' language does not support"
+            " parameter introspection."
+        )
+        return {}
+    return {p.name: p._asdict() for p in parameters}
+
+
+def inspect_notebook(path: str) -> tp.Dict[str, tp.Dict[str, tp.Any]]:
+    """Get the parameters of a notebook.
+
+    This is a fast equivalent of `papermill.inspect_notebook` for local
+    notebooks: only the parameters cell is decoded (see `read_parameters_cell`).
+    The notebooks not supported by the fast path (e.g. older formats) are
+    inspected by papermill.
+
+    Args:
+        path: Notebook path
+
+    Returns:
+        {parameter name: {name, inferred_type_name, default, help}}
+    """
+    try:
+        cell, metadata = read_parameters_cell(path)
+    except ValueError as error:
+        app_log.debug(f"Notebook '{path}' inspected by papermill: {error!s}")
+        return pm.inspect_notebook(path)
+    return _infer_parameters(cell, metadata)
+
+
+def inspect_notebook_content(content: bytes) -> tp.Dict[str, tp.Dict[str, tp.Any]]:
+    """Get the parameters of a notebook from its content.
+
+    Args:
+        content: Notebook file content (e.g. a git blob)
+
+    Returns:
+        {parameter name: {name, inferred_type_name, default, help}}
+    """
+    try:
+        cell, metadata = read_parameters_cell(io.StringIO(content.decode("utf-8")))
+    except ValueError as error:
+        app_log.debug(f"Notebook content inspected by papermill: {error!s}")
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            notebook = Path(tmp_dir) / "notebook.ipynb"
+            notebook.write_bytes(content)
+            return pm.inspect_notebook(str(notebook))
+    return _infer_parameters(cell, metadata)
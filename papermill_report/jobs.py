@@ -0,0 +1,308 @@
+"""Persistent store of the asynchronous report jobs."""
+import asyncio
+import json
+import logging
+import os
+import shutil
+import time
+import typing as tp
+import uuid
+from pathlib import Path
+
+from tornado.log import app_log
+
+from .scheduler import BATCH
+
+PENDING = "pending"
+RUNNING = "running"
+COMPLETED = "completed"
+FAILED = "failed"
+CANCELLED = "cancelled"
+FINISHED_STATUSES = (COMPLETED, FAILED, CANCELLED)
+
+
+class JobError(Exception):
+    """Job failure described to the user.
+
+    Args:
+        description: Error description (at least a ``message``)
+    """
+
+    def __init__(self, description: tp.Dict[str, tp.Any]):
+        super().__init__(description["message"])
+        self.description = description
+
+
+class Job:
+    """Report generation job.
+
+    Args:
+        id: Job identifier
+        template_path: Template path relative to the templates folder
+        parameters: Template parameters
+        username: User name submitting the job
+        status: Job status
+        created: Submission timestamp
+        started: Execution start timestamp
+        finished: Execution end timestamp
+        error: Error description if the job failed
+        priority: Execution priority class
+    """
+
+    def __init__(
+        self,
+        id: str,  # noqa: A002
+        template_path: str,
+        parameters: tp.Dict[str, tp.Any],
+        username: str,
+        status: str = PENDING,
+        created: tp.Optional[float] = None,
+        started: tp.Optional[float] = None,
+        finished: tp.Optional[float] = None,
+        error: tp.Optional[tp.Dict] = None,
+        priority: str = BATCH,
+    ):
+        self.id = id
+        self.template_path = template_path
+        self.parameters = parameters
+        self.username = username
+        self.status = status
+        self.created = time.time() if created is None else created
+        self.started = started
+        self.finished = finished
+        self.error = error
+        self.priority = priority
+        # Identifier of the shared execution generating the report (not persisted)
+        self.execution_key = None  # type: tp.Optional[str]
+
+    @property
+    def done(self) -> bool:
+        """bool: Whether the job is finished."""
+        return self.status in FINISHED_STATUSES
+
+    def to_dict(self) -> tp.Dict[str, tp.Any]:
+        """Serialize the job in JSON.
+
+        Returns:
+            The job attributes
+        """
+        return {
+            "id": self.id,
+            "template_path": self.template_path,
+            "parameters": self.parameters,
+            "username": self.username,
+            "status": self.status,
+            "created": self.created,
+            "started": self.started,
+            "finished": self.finished,
+            "error": self.error,
+            "priority": self.priority,
+        }
+
+
+class JobStore:
+    """Store of the report jobs.
+
+    Each job is saved as ``<id>.json`` in the jobs folder and the report of a
+    completed job as ``<id>.html``. So the finished jobs and their reports
+    survive a service restart; the jobs interrupted by the restart are marked
+    as failed. The finished jobs are removed after their time-to-live.
+
+    Args:
+        jobs_dir: Jobs folder
+        ttl: Time-to-live in seconds of a finished job
+        log: Logger
+    """
+
+    def __init__(self, jobs_dir: str, ttl: float, log: tp.Optional[logging.Logger] = None):
+        self.jobs_dir = Path(jobs_dir)
+        self.ttl = ttl
+        self.log = log or app_log
+        self._jobs = {}  # type: tp.Dict[str, Job]
+        self._tasks = {}  # type: tp.Dict[str, asyncio.Future]
+        self._load()
+
+    def _metadata(self, job_id: str) -> Path:
+        return self.jobs_dir / (job_id + ".json")
+
+    def report(self, job: Job) -> Path:
+        """Get the report path of a job.
+
+        Args:
+            job: Report job
+
+        Returns:
+            The report path; it exists only if the job is completed
+        """
+        return self.jobs_dir / (job.id + ".html")
+
+    def _load(self):
+        """Load the jobs from the jobs folder."""
+        if not self.jobs_dir.exists():
+            return
+
+        for metadata in self.jobs_dir.glob("*.json"):
+            try:
+                job = Job(**json.loads(metadata.read_text()))
+            except (OSError, ValueError, TypeError):
+                self.log.warning(f"Unable to load the report job '{metadata!s}'.", exc_info=True)
+                continue
+            self._jobs[job.id] = job
+            if not job.done:
+                self._finish(job, FAILED, {"message": "Interrupted by a service restart."})
+        self._collect()
+
+    def _save(self, job: Job):
+        """Save a job metadata."""
+        self.jobs_dir.mkdir(parents=True, exist_ok=True)
+        metadata = self._metadata(job.id)
+        tmp_file = metadata.with_name(metadata.name + ".tmp")
+        tmp_file.write_text(json.dumps(job.to_dict()))
+        os.replace(tmp_file, metadata)
+
+    def _remove(self, job: Job):
+        """Forget a job and remove its files."""
+        self._jobs.pop(job.id, None)
+        for path in (self._metadata(job.id), self.report(job)):
+            try:
+                path.unlink()
+            except FileNotFoundError:
+                pass
+
+    def _collect(self):
+        """Remove the finished jobs older than the time-to-live."""
+        limit = time.time() - self.ttl
+        for job in list(self._jobs.values()):
+            if job.done and job.finished < limit:
+                self._remove(job)
+
+    def _finish(self, job: Job, status: str, error: tp.Optional[tp.Dict] = None):
+        job.status = status
+        job.error = error
+        job.finished = time.time()
+        self._save(job)
+
+    def get(self, job_id: str) -> tp.Optional[Job]:
+        """Get a job.
+
+        Args:
+            job_id: Job identifier
+
+        Returns:
+            The job or None if unknown
+        """
+        return self._jobs.get(job_id)
+
+    def list_jobs(self, username: tp.Optional[str] = None) -> tp.List[Job]:
+        """List the jobs.
+
+        Args:
+            username: Only list the jobs of this user if provided
+
+        Returns:
+            The jobs sorted by submission time
+        """
+        return sorted(
+            (job for job in self._jobs.values() if username is None or job.username == username),
+            key=lambda job: job.created,
+        )
+
+    def submit(
+        self,
+        template_path: str,
+        parameters: tp.Dict[str, tp.Any],
+        username: str,
+        run: tp.Callable[[Job], tp.Awaitable],
+        priority: str = BATCH,
+    ) -> Job:
+        """Create a job and execute it in background.
+
+        Args:
+            template_path: Template path relative to the templates folder
+            parameters: Template parameters
+            username: User name submitting the job
+            run: Coroutine function generating the report; it must call `start`
+                once the execution starts, store the report with `save_report`
+                and raise `JobError` to describe a failure
+            priority: Execution priority class
+
+        Returns:
+            The job
+        """
+        self._collect()
+        job = Job(uuid.uuid4().hex, template_path, parameters, username, priority=priority)
+        self._jobs[job.id] = job
+        self._save(job)
+        task = asyncio.ensure_future(self._run(job, run))
+        self._tasks[job.id] = task
+
+        def forget(future: asyncio.Future):
+            self._tasks.pop(job.id, None)
+            if not job.done:  # Cancelled before starting
+                self._finish(job, CANCELLED)
+
+        task.add_done_callback(forget)
+        return job
+
+    async def _run(self, job: Job, run: tp.Callable[[Job], tp.Awaitable]):
+        """Execute a job and record its outcome."""
+        try:
+            await run(job)
+        except asyncio.CancelledError:
+            self._finish(job, CANCELLED)
+        except JobError as error:
+            self._finish(job, FAILED, error.description)
+        except Exception as error:
+            self.log.warning(f"Report job '{job.id}' failed.", exc_info=error)
+            self._finish(job, FAILED, {"message": str(error)})
+        else:
+            self._finish(job, COMPLETED)
+
+    def start(self, job: Job):
+        """Mark a job as running.
+
+        The job stays pending while it waits for its execution slot.
+
+        Args:
+            job: Report job
+        """
+        if job.status != PENDING:
+            return
+        job.status = RUNNING
+        job.started = time.time()
+        self._save(job)
+
+    async def save_report(self, job: Job, report: Path):
+        """Copy a job report in the jobs folder.
+
+        Args:
+            job: Report job
+            report: Generated report
+        """
+        self.jobs_dir.mkdir(parents=True, exist_ok=True)
+        await asyncio.get_event_loop().run_in_executor(
+            None, shutil.copyfile, str(report), str(self.report(job))
+        )
+
+    def cancel(self, job: Job) -> bool:
+        """Cancel a job.
+
+        Args:
+            job: Report job
+
+        Returns:
+            Whether the job was running
+        """
+        task = self._tasks.get(job.id)
+        if task is None:
+            return False
+        task.cancel()
+        return True
+
+    def delete(self, job: Job):
+        """Remove a finished job and its report.
+
+        Args:
+            job: Finished report job
+        """
+        self._remove(job)
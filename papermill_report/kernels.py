@@ -0,0 +1,288 @@
+"""Pool of pre-started Jupyter kernels."""
+import asyncio
+import logging
+import os
+import shlex
+import tempfile
+import typing as tp
+from collections import defaultdict, deque
+
+from jupyter_client import KernelManager
+from tornado.log import app_log
+from traitlets import DottedObjectName, Unicode
+
+from .utils import is_impersonated, kill_process_tree, pwd
+
+
+def kill_kernel(manager: KernelManager):
+    """Kill a kernel process and all its children without waiting.
+
+    The clients of the kernel fail with a dead kernel error.
+
+    Args:
+        manager: Kernel manager
+    """
+    provisioner = getattr(manager, "provisioner", None)
+    # jupyter_client < 7 exposes the process as the manager kernel
+    process = getattr(provisioner, "process", None) or getattr(manager, "kernel", None)
+    if process is not None:
+        kill_process_tree(process.pid)
+
+
+class UserKernelManager(KernelManager):
+    """Kernel manager starting the kernel as another user.
+
+    The kernel is started through ``su <user> -l -c`` and its connection
+    file is made readable by the user. Its default clients are asynchronous
+    so papermill detects when the kernel dies (e.g. killed on cancellation);
+    use `blocking_client` for synchronous calls.
+    """
+
+    client_class = DottedObjectName("jupyter_client.asynchronous.AsyncKernelClient")
+    username = Unicode(None, allow_none=True, help="User running the kernel")
+
+    def format_kernel_cmd(self, extra_arguments: tp.Optional[tp.List[str]] = None) -> tp.List[str]:
+        """Prefix the kernel command with the user impersonation."""
+        command = super().format_kernel_cmd(extra_arguments)
+        if self.username is None:
+            return command
+        return ["su", self.username, "-l", "-c", " ".join(map(shlex.quote, command))]
+
+    def write_connection_file(self, **kwargs: tp.Any) -> tp.Tuple[str, tp.Dict]:
+        """Write the connection file and give it to the user."""
+        result = super().write_connection_file(**kwargs)
+        if self.username is not None:
+            user = pwd.getpwnam(self.username)
+            os.chown(os.path.dirname(self.connection_file), user.pw_uid, user.pw_gid)
+            os.chown(self.connection_file, user.pw_uid, user.pw_gid)
+        return result
+
+
+class PooledKernel:
+    """Kernel of the pool.
+
+    Args:
+        key: Pool key (kernel name, user name)
+        manager: Kernel manager
+    """
+
+    def __init__(self, key: tp.Tuple[str, tp.Optional[str]], manager: KernelManager):
+        self.key = key
+        self.manager = manager
+        self.uses = 0
+        self.busy = False
+
+    @property
+    def kernel_name(self) -> str:
+        """str: Kernel name."""
+        return self.key[0]
+
+
+class KernelPool:
+    """Pool of pre-started kernels per kernel name and impersonated user.
+
+    A kernel is handed to a single execution at a time. After the execution,
+    its namespace is reset and it goes back to the pool, or it is shut down
+    if it reached its maximal number of uses. The pool starts new kernels in
+    background to keep ``size`` idle kernels for each kernel name and user.
+
+    Args:
+        size: Number of idle kernels to keep per kernel name and user
+        max_uses: Number of executions after which a kernel is shut down
+        startup_code: Code executed when a kernel starts (e.g. heavy imports)
+        log: Logger
+    """
+
+    def __init__(
+        self,
+        size: int = 1,
+        max_uses: int = 1,
+        startup_code: str = "",
+        log: tp.Optional[logging.Logger] = None,
+    ):
+        self.size = size
+        self.max_uses = max_uses
+        self.startup_code = startup_code
+        self.log = log or app_log
+        self._idle = defaultdict(deque)  # type: tp.Dict[tp.Tuple, tp.Deque[PooledKernel]]
+        self._starting = defaultdict(int)  # type: tp.Dict[tp.Tuple, int]
+        self._kernels = set()  # type: tp.Set[PooledKernel]
+
+    def _start_kernel(self, key: tp.Tuple[str, tp.Optional[str]]) -> PooledKernel:
+        """Start a kernel (blocking).
+
+        Args:
+            key: Pool key (kernel name, user name)
+
+        Returns:
+            The started kernel
+        """
+        kernel_name, username = key
+        manager = UserKernelManager(kernel_name=kernel_name)
+        manager.username = username
+        cwd = None
+        if username is not None:
+            # The connection file must be readable by the user
+            manager.connection_file = os.path.join(
+                tempfile.mkdtemp(prefix="pm_report_kernel_"), "kernel.json"
+            )
+            cwd = pwd.getpwnam(username).pw_dir
+        manager.start_kernel(cwd=cwd)
+        if self.startup_code:
+            client = manager.blocking_client()
+            client.start_channels()
+            try:
+                client.wait_for_ready(timeout=60)
+                client.execute_interactive(self.startup_code, store_history=False, timeout=600)
+            finally:
+                client.stop_channels()
+        return PooledKernel(key, manager)
+
+    def _reset_kernel(self, kernel: PooledKernel):
+        """Clear the kernel namespace (blocking).
+
+        Args:
+            kernel: Kernel to reset
+        """
+        client = kernel.manager.blocking_client()
+        client.start_channels()
+        try:
+            client.execute_interactive("%reset -f", store_history=False, timeout=60)
+        finally:
+            client.stop_channels()
+
+    @staticmethod
+    def _shutdown_kernel(kernel: PooledKernel):
+        """Shut down a kernel (blocking).
+
+        Args:
+            kernel: Kernel to stop
+        """
+        kernel.manager.shutdown_kernel(now=True)
+        if kernel.key[1] is not None:
+            folder = os.path.dirname(kernel.manager.connection_file)
+            if os.path.isdir(folder):
+                os.rmdir(folder)
+
+    async def _run(self, function: tp.Callable, *args: tp.Any) -> tp.Any:
+        return await asyncio.get_event_loop().run_in_executor(None, function, *args)
+
+    async def _fill(self, key: tp.Tuple[str, tp.Optional[str]]):
+        """Start kernels to have enough idle kernels for a key.
+
+        Args:
+            key: Pool key (kernel name, user name)
+        """
+        # Busy kernels that will be reused count as available
+        returning = sum(
+            1
+            for kernel in self._kernels
+            if kernel.key == key and kernel.busy and kernel.uses + 1 < self.max_uses
+        )
+        while len(self._idle[key]) + self._starting[key] + returning < self.size:
+            self._starting[key] += 1
+            try:
+                kernel = await self._run(self._start_kernel, key)
+            except Exception:
+                self.log.warning(f"Fail to start a '{key[0]}' kernel for the pool.", exc_info=True)
+                return
+            finally:
+                self._starting[key] -= 1
+            self._kernels.add(kernel)
+            self._idle[key].append(kernel)
+
+    async def acquire(self, kernel_name: str, username: str) -> PooledKernel:
+        """Get a started kernel.
+
+        Args:
+            kernel_name: Kernel name
+            username: User requesting the kernel
+
+        Returns:
+            A kernel dedicated to the caller until it is released
+        """
+        key = (kernel_name, username if is_impersonated(username) else None)
+        kernel = None
+        while self._idle[key]:
+            candidate = self._idle[key].popleft()
+            if candidate.manager.is_alive():
+                kernel = candidate
+                break
+            self._discard(candidate)
+
+        if kernel is None:
+            kernel = await self._run(self._start_kernel, key)
+            self._kernels.add(kernel)
+        kernel.busy = True
+        asyncio.ensure_future(self._fill(key))
+        return kernel
+
+    def _discard(self, kernel: PooledKernel):
+        """Shut down a kernel in background."""
+        self._kernels.discard(kernel)
+
+        async def shutdown():
+            try:
+                await self._run(self._shutdown_kernel, kernel)
+            except Exception:
+                self.log.warning("Fail to shut down a pooled kernel.", exc_info=True)
+
+        asyncio.ensure_future(shutdown())
+
+    def kill(self, kernel: PooledKernel):
+        """Kill a kernel acquired from the pool, interrupting its execution.
+
+        The kernel process and all its children are killed and the kernel is
+        discarded instead of being released.
+
+        Args:
+            kernel: Kernel acquired from the pool
+        """
+        kill_kernel(kernel.manager)
+        kernel.busy = False
+        self._discard(kernel)
+        asyncio.ensure_future(self._fill(kernel.key))
+
+    def release(self, kernel: PooledKernel):
+        """Give back a kernel to the pool.
+
+        The kernel is reset or replaced in background.
+
+        Args:
+            kernel: Kernel acquired from the pool
+        """
+        asyncio.ensure_future(self._recycle(kernel))
+
+    async def _recycle(self, kernel: PooledKernel):
+        """Reset a used kernel or replace it.
+
+        Args:
+            kernel: Kernel acquired from the pool
+        """
+        kernel.uses += 1
+        kernel.busy = False
+        if (
+            kernel.uses >= self.max_uses
+            or len(self._idle[kernel.key]) >= self.size
+            or not kernel.manager.is_alive()
+        ):
+            self._discard(kernel)
+        else:
+            try:
+                await self._run(self._reset_kernel, kernel)
+            except Exception:
+                self.log.warning("Fail to reset a pooled kernel.", exc_info=True)
+                self._discard(kernel)
+            else:
+                self._idle[kernel.key].append(kernel)
+        await self._fill(kernel.key)
+
+    def shutdown(self):
+        """Shut down all kernels (blocking)."""
+        for kernel in list(self._kernels):
+            try:
+                self._shutdown_kernel(kernel)
+            except Exception:
+                self.log.warning("Fail to shut down a pooled kernel.", exc_info=True)
+        self._kernels.clear()
+        self._idle.clear()
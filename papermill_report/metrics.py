@@ -0,0 +1,129 @@
+"""Prometheus metrics of the service."""
+import typing as tp
+
+from prometheus_client import CollectorRegistry, Counter, Gauge, Histogram, generate_latest
+
+GIT_SYNC = "git_sync"
+INSPECTION = "inspection"
+EXECUTION = "execution"
+CONVERSION = "conversion"
+PHASES = (GIT_SYNC, INSPECTION, EXECUTION, CONVERSION)
+"""Timed phases: git repository synchronization, notebook template inspection,
+papermill execution and nbconvert conversion to HTML."""
+
+SUCCESS = "success"
+FAILURE = "failure"
+TIMEOUT = "timeout"
+CANCELLED = "cancelled"
+
+PHASE_BUCKETS = (0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0, 120.0, 300.0, 600.0, 1800.0)
+"""Upper bounds in seconds of the phase duration histogram buckets."""
+
+
+class ReportMetrics:
+    """Metrics of the reports generation.
+
+    The metrics are registered in a dedicated registry exposed in the
+    Prometheus text format by the ``/metrics`` endpoint.
+
+    Example:
+
+        start = time.monotonic()
+        await update()
+        metrics.observe(GIT_SYNC, time.monotonic() - start)
+
+    Args:
+        registry: Metrics registry; a new one if None
+    """
+
+    def __init__(self, registry: tp.Optional[CollectorRegistry] = None):
+        self.registry = CollectorRegistry() if registry is None else registry
+        self.phase_duration = Histogram(
+            "papermill_report_phase_duration_seconds",
+            "Duration of the report generation phases.",
+            ["phase"],
+            buckets=PHASE_BUCKETS,
+            registry=self.registry,
+        )
+        self.reports = Counter(
+            "papermill_report_reports",
+            "Report executions by template and outcome.",
+            ["template", "status"],
+            registry=self.registry,
+        )
+        self.broken_reports = Counter(
+            "papermill_report_broken_reports",
+            "Failed executions whose notebook was copied in the broken reports folder.",
+            ["template"],
+            registry=self.registry,
+        )
+        self.cache_requests = Counter(
+            "papermill_report_cache_requests",
+            "Lookups of the report and template index caches.",
+            ["cache", "result"],
+            registry=self.registry,
+        )
+        self.queued_executions = Gauge(
+            "papermill_report_queued_executions",
+            "Report executions waiting for a slot.",
+            registry=self.registry,
+        )
+        self.running_executions = Gauge(
+            "papermill_report_running_executions",
+            "Report executions running.",
+            registry=self.registry,
+        )
+
+    def observe(self, phase: str, duration: float):
+        """Record the duration of a phase.
+
+        Args:
+            phase: Phase name (see `PHASES`)
+            duration: Duration in seconds
+        """
+        self.phase_duration.labels(phase).observe(duration)
+
+    def record_report(self, template_path: str, status: str):
+        """Record the outcome of a report execution.
+
+        Args:
+            template_path: Template path relative to the templates folder
+            status: `SUCCESS`, `FAILURE`, `TIMEOUT` or `CANCELLED`
+        """
+        self.reports.labels(template_path, status).inc()
+
+    def record_broken(self, template_path: str):
+        """Record a failed notebook copied in the broken reports folder.
+
+        Args:
+            template_path: Template path relative to the templates folder
+        """
+        self.broken_reports.labels(template_path).inc()
+
+    def record_cache(self, cache: str, hit: bool, count: int = 1):
+        """Record cache lookups.
+
+        Args:
+            cache: Cache name (``report`` or ``template_index``)
+            hit: Whether the lookups were hits
+            count: Number of lookups
+        """
+        if count > 0:
+            self.cache_requests.labels(cache, "hit" if hit else "miss").inc(count)
+
+    def track_scheduler(self, scheduler: tp.Any):
+        """Expose the depth of an execution scheduler queue.
+
+        Args:
+            scheduler: Scheduler providing the ``queued`` and ``running`` executions
+        """
+        self.queued_executions.set_function(lambda: scheduler.queued)
+        self.running_executions.set_function(lambda: scheduler.running)
+
+    def export(self) -> bytes:
+        """Export the metrics.
+
+        Returns:
+            The metrics in the Prometheus text format
+        """
+        return generate_latest(self.registry)
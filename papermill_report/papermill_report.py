@@ -1,19 +1,54 @@
 """Webservice API."""
 import logging
+import multiprocessing
 import os
 import socket
 import typing as tp
+from concurrent.futures import Executor, ProcessPoolExecutor, ThreadPoolExecutor
 from pathlib import Path
 from urllib.parse import urlsplit, urlunsplit
 
 from jinja2 import Environment, ChoiceLoader, FileSystemLoader, PackageLoader
+from jupyter_core.paths import jupyter_data_dir
 from tornado import ioloop, web
 from tornado.log import access_log, app_log, gen_log
-from traitlets import Dict, Int, List, Unicode, default, validate
+from traitlets import Bool, Dict, Enum, Float, Int, List, Unicode, default, validate
 from traitlets.config.application import Application
 
-from .handlers import TemplateHandler, TemplatesAPIHandler, TemplatesHandler
-from .utils import update_git_repository
+from .cache import ReportCache
+from .execution import (
+    ExecutionDeduplicator,
+    ForkServerExecutor,
+    KernelPoolExecutor,
+    SubprocessExecutor,
+    WorkerExecutor,
+)
+from .generator import ReportGenerator
+from .gitobjects import GitObjectStore
+from .handlers import (
+    JobAPIHandler,
+    JobProgressHandler,
+    JobReportHandler,
+    JobsAPIHandler,
+    MetricsHandler,
+    ProfilesAPIHandler,
+    ProfilesHandler,
+    TemplateHandler,
+    TemplatesAPIHandler,
+    TemplatesHandler,
+    TemplatesRefreshAPIHandler,
+)
+from .index import TemplateIndex
+from .jobs import JobStore
+from .kernels import KernelPool
+from .metrics import ReportMetrics
+from .profiles import CellProfiles
+from .progress import ProgressTracker
+from .repository import TemplateRepository
+from .scheduler import ExecutionScheduler
+from .stats import ExecutionStats
+from .tracing import TraceExporter
+from .watcher import TemplateWatcher
 
 if os.environ.get("JUPYTERHUB_API_TOKEN"):
     from jupyterhub.services.auth import HubOAuthCallbackHandler
@@ -31,18 +66,78 @@ class PapermillReport(Application):
 
     name = Unicode("papermill-report")
 
+    authenticate_prometheus = Bool(
+        True,
+        help="Whether the metrics endpoint requires an authenticated user or API token.",
+        config=True,
+    )
+
     broken_reports_dir = Unicode(
         "/home/USERNAME/broken_reports",
         help="Folder containing the broken reports",
         config=True,
     )
 
+    cache_dir = Unicode(
+        help="Folder in which the service stores its persistent caches (e.g. templates index).",
+        config=True,
+    )
+
+    @default("cache_dir")
+    def _default_cache_dir(self):
+        return str(Path(jupyter_data_dir()) / "papermill_report")
+
     config_file = Unicode("papermill_report_config", help="Load this config file").tag(
         config=True
     )
 
+    inspection_executor = Enum(
+        ["process", "thread"],
+        default_value="process",
+        help="Kind of pool in which the notebook templates are inspected.",
+        config=True,
+    )
+
+    inspection_workers = Int(
+        0,
+        help="Number of workers inspecting the notebook templates; 0 to use the number of CPUs.",
+        config=True,
+    )
+
     port = Int(8888, help="Port of the service", config=True)
 
+    execution_mode = Enum(
+        ["subprocess", "kernel_pool", "forkserver", "worker"],
+        default_value="subprocess",
+        help=(
+            "How the reports are generated: `subprocess` runs papermill and nbconvert command lines,"
+            " `kernel_pool` runs them in the service on pre-started kernels,"
+            " `forkserver` forks a process per report from a per-template process"
+            " that executed the cells preceding the parameters cell,"
+            " `worker` runs them in a long-lived process (per user when impersonating)."
+        ),
+        config=True,
+    )
+
+    execution_timeout = Float(
+        0.0,
+        help="Maximal execution duration in seconds of a report; 0 for no limit.",
+        config=True,
+    )
+
+    execution_timeouts = Dict(
+        value_trait=Float(),
+        default_value={},
+        help="Maximal execution duration in seconds of the reports per template path glob pattern.",
+        config=True,
+    )
+
+    forkserver_max_servers = Int(
+        16,
+        help="Maximal number of running template fork servers; the least recently used is stopped.",
+        config=True,
+    )
+
     git_auth = Unicode(
         None,
         allow_none=True,
@@ -50,10 +145,120 @@ class PapermillReport(Application):
         config=True,
     )
 
+    git_poll_interval = Float(
+        0.0,
+        help=(
+            "Period in seconds of the background check of the templates git repository remote head;"
+            " if 0, the repository is updated when handling requests."
+        ),
+        config=True,
+    )
+
+    git_sync_ttl = Float(
+        0.0,
+        help="Minimal delay in seconds between two updates of the templates git repository.",
+        config=True,
+    )
+
+    git_webhook_token = Unicode(
+        None,
+        allow_none=True,
+        help="Secret token allowing a git webhook to trigger a templates repository update.",
+        config=True,
+    )
+
+    job_ttl = Float(
+        86400.0,
+        help="Time-to-live in seconds of the finished report jobs and their reports.",
+        config=True,
+    )
+
+    kernel_pool_max_uses = Int(
+        1,
+        help="Number of reports executed by a pooled kernel before it is restarted.",
+        config=True,
+    )
+
+    kernel_pool_size = Int(
+        1,
+        help="Number of idle kernels kept started per kernel name (and user when impersonating).",
+        config=True,
+    )
+
+    kernel_pool_startup_code = Unicode(
+        "",
+        help="Code executed when a pooled kernel starts (e.g. heavy imports).",
+        config=True,
+    )
+
+    max_concurrent_executions = Int(
+        0,
+        help="Maximal number of reports generated concurrently; 0 to use the number of CPUs.",
+        config=True,
+    )
+
+    max_concurrent_executions_per_user = Int(
+        0,
+        help="Maximal number of reports generated concurrently for a user; 0 for no limit.",
+        config=True,
+    )
+
+    max_queued_executions = Int(
+        100,
+        help=(
+            "Maximal number of reports waiting for their execution;"
+            " new requests are rejected with a 503 status. 0 for no limit."
+        ),
+        config=True,
+    )
+
     notebook_dir = Unicode(
         "/home/USERNAME", help="Notebook server root directory", config=True
     )
 
+    progress_poll_interval = Float(
+        0.5,
+        help="Period in seconds of the check of the running reports progress (partial output notebook).",
+        config=True,
+    )
+
+    report_cache_size = Int(
+        0,
+        help="Maximal size in bytes of the generated reports cache; 0 to disable the cache.",
+        config=True,
+    )
+
+    report_cache_ttl = Float(
+        600.0,
+        help="Default time-to-live in seconds of a cached report.",
+        config=True,
+    )
+
+    report_cache_ttls = Dict(
+        value_trait=Float(),
+        default_value={},
+        help="Time-to-live in seconds of the cached reports per template path glob pattern.",
+        config=True,
+    )
+
+    shortest_job_first = Bool(
+        False,
+        help=(
+            "Whether the waiting reports of a priority class are executed by increasing"
+            " expected duration (from the templates runtime statistics) instead of in turn per user."
+        ),
+        config=True,
+    )
+
+    share_impersonated_reports = Bool(
+        False,
+        help=(
+            "Whether reports generated impersonating a user can be shared with other users"
+            " (concurrent identical executions and cached reports)."
+        ),
+        config=True,
+    )
+
     template_root_dir = Unicode(
         "/opt/papermill_report",
         help="Folder containing the notebook templates project on the server.",
@@ -73,6 +278,43 @@ class PapermillReport(Application):
         config=True,
     )
 
+    template_index_mode = Enum(
+        ["worktree", "git"],
+        default_value="worktree",
+        help=(
+            "How the templates are listed: `worktree` scans the templates folder,"
+            " `git` lists and reads them from the git objects at the synchronized commit"
+            " (only with `template_git_url`)."
+        ),
+        config=True,
+    )
+
+    template_snapshots_dir = Unicode(
+        None,
+        allow_none=True,
+        help=(
+            "Folder in which each synchronized commit of the templates git repository is checked out"
+            " as a read-only snapshot; it must not be inside `template_root_dir`."
+            " If None, the templates are read from `template_root_dir`."
+        ),
+        config=True,
+    )
+
+    template_watch = Bool(
+        True,
+        help=(
+            "Whether to watch the templates folder (with inotify on Linux) to keep their index"
+            " current and serve the listings from memory; only without `template_git_url`."
+        ),
+        config=True,
+    )
+
+    template_watch_poll_interval = Float(
+        5.0,
+        help="Period in seconds of the templates folder scan when it cannot be watched with inotify.",
+        config=True,
+    )
+
     template_paths = List(
         trait=Unicode,
         default_value=None,
@@ -81,6 +323,16 @@ class PapermillReport(Application):
         config=True,
     )
 
+    trace_file = Unicode(
+        None,
+        allow_none=True,
+        help=(
+            "File in which the requests phases are appended in the Chrome trace event format"
+            " (e.g. for chrome://tracing or Perfetto). If None, the traces are only logged."
+        ),
+        config=True,
+    )
+
     api_prefix = Unicode(help="Papermill API prefix", config=True)
 
     @default("api_prefix")
@@ -128,6 +380,11 @@ class PapermillReport(Application):
         {"debug": ({"PapermillReport": {"log_level": 10}}, "Set loglevel to DEBUG")}
     )
 
+    _report_executor = None
+    _inspection_executor = None
+    _object_store = None
+    _template_watcher = None
+
     @property
     def git_url(self) -> tp.Optional[str]:
         """Returns the report Git repository URL.
@@ -172,6 +429,72 @@ class PapermillReport(Application):
 
         self._init_logging()
 
+    def _make_inspection_executor(self) -> Executor:
+        """Create the pool in which the notebook templates are inspected.
+
+        Returns:
+            The inspection executor
+        """
+        workers = self.inspection_workers or None
+        if self.inspection_executor == "process":
+            # Spawn the workers to not inherit the service sockets
+            self._inspection_executor = ProcessPoolExecutor(
+                max_workers=workers, mp_context=multiprocessing.get_context("spawn")
+            )
+        else:
+            self._inspection_executor = ThreadPoolExecutor(max_workers=workers)
+        return self._inspection_executor
+
+    def _make_object_store(self) -> tp.Optional[GitObjectStore]:
+        """Create the git object store from which the templates are listed.
+
+        Returns:
+            The object store or None if the templates are listed from their folder
+        """
+        if self.template_index_mode == "git" and self.git_url is not None:
+            self._object_store = GitObjectStore(self.template_root_dir, log=self.log)
+        else:
+            self._object_store = None
+        return self._object_store
+
+    def _make_report_cache(self) -> tp.Optional[ReportCache]:
+        """Create the generated reports cache.
+
+        Returns:
+            The reports cache or None if disabled
+        """
+        if self.report_cache_size <= 0:
+            return None
+        return ReportCache(
+            str(Path(self.cache_dir) / "reports"),
+            self.report_cache_size,
+            self.report_cache_ttl,
+            self.report_cache_ttls,
+            log=self.log,
+        )
+
+    def _make_report_executor(self):
+        """Create the reports generator.
+
+        Returns:
+            The executor for the selected execution mode
+        """
+        if self.execution_mode == "kernel_pool":
+            pool = KernelPool(
+                self.kernel_pool_size,
+                self.kernel_pool_max_uses,
+                self.kernel_pool_startup_code,
+                log=self.log,
+            )
+            self._report_executor = KernelPoolExecutor(pool, log=self.log)
+        elif self.execution_mode == "forkserver":
+            self._report_executor = ForkServerExecutor(self.forkserver_max_servers, log=self.log)
+        elif self.execution_mode == "worker":
+            self._report_executor = WorkerExecutor(log=self.log)
+        else:
+            self._report_executor = SubprocessExecutor(log=self.log)
+        return self._report_executor
+
     def make_app(self) -> web.Application:
         """Create the tornado web application.
 
@@ -186,11 +509,33 @@ class PapermillReport(Application):
             loaders.append(FileSystemLoader(self.template_paths))
         loaders.append(PackageLoader("papermill_report"))
 
+        metrics = ReportMetrics()
+        scheduler = ExecutionScheduler(
+            self.max_concurrent_executions or os.cpu_count() or 1,
+            self.max_concurrent_executions_per_user,
+            self.max_queued_executions,
+            shortest_first=self.shortest_job_first,
+            log=self.log,
+        )
+        metrics.track_scheduler(scheduler)
+
         application = web.Application(
             [
                 (self.api_prefix, TemplatesHandler),
                 (self.api_prefix + "api/templates/", TemplatesAPIHandler),
+                (self.api_prefix + "api/templates/refresh", TemplatesRefreshAPIHandler),
+                (self.api_prefix + "api/jobs/", JobsAPIHandler),
+                (self.api_prefix + r"api/jobs/(?P<job_id>[0-9a-f]+)", JobAPIHandler),
+                (self.api_prefix + r"api/jobs/(?P<job_id>[0-9a-f]+)/progress", JobProgressHandler),
+                (self.api_prefix + r"api/jobs/(?P<job_id>[0-9a-f]+)/report", JobReportHandler),
+                (self.api_prefix + "profile", ProfilesHandler),
+                (self.api_prefix + "api/profile/", ProfilesAPIHandler),
+                (
+                    self.api_prefix + r"api/profile/(?P<template_path>.+\.ipynb)",
+                    ProfilesAPIHandler,
+                ),
                 (self.api_prefix + r"(?P<template_path>.+\.ipynb)", TemplateHandler),
+                (self.api_prefix + "metrics", MetricsHandler),
                 (self.api_prefix + "oauth_callback", HubOAuthCallbackHandler),
             ],
             broken_path=self.broken_reports_dir,
@@ -198,6 +543,45 @@ class PapermillReport(Application):
             report_root_path=self.template_root_dir,
             report_path=self.template_dir,
             report_git_url=self.git_url,
+            git_webhook_token=self.git_webhook_token,
+            job_store=JobStore(str(Path(self.cache_dir) / "jobs"), self.job_ttl, log=self.log),
+            template_repository=TemplateRepository(
+                self.template_root_dir,
+                self.template_dir,
+                self.git_url,
+                ttl=self.git_sync_ttl,
+                background_sync=self.git_url is not None and self.git_poll_interval > 0,
+                snapshots_dir=self.template_snapshots_dir,
+                log=self.log,
+                metrics=metrics,
+            ),
+            report_cache=self._make_report_cache(),
+            report_deduplicator=ExecutionDeduplicator(),
+            report_executor=self._make_report_executor(),
+            report_scheduler=scheduler,
+            report_metrics=metrics,
+            trace_exporter=(
+                None if self.trace_file is None else TraceExporter(self.trace_file, log=self.log)
+            ),
+            authenticate_prometheus=self.authenticate_prometheus,
+            execution_stats=ExecutionStats(
+                str(Path(self.cache_dir) / "execution_stats.json"), log=self.log
+            ),
+            cell_profiles=CellProfiles(
+                str(Path(self.cache_dir) / "cell_profiles.json"), log=self.log
+            ),
+            execution_progress=ProgressTracker(self.progress_poll_interval, log=self.log),
+            execution_timeout=self.execution_timeout,
+            execution_timeouts=self.execution_timeouts,
+            share_impersonated_reports=self.share_impersonated_reports,
+            template_index=TemplateIndex(
+                str(Path(self.cache_dir) / "template_index.json"),
+                executor=self._make_inspection_executor(),
+                log=self.log,
+                metrics=metrics,
+                object_store=self._make_object_store(),
+                make_executor=self._make_inspection_executor,
+            ),
             log=self.log,
             template_path=str(HERE / "templates"),
             static_path=static_path,
@@ -209,22 +593,50 @@ class PapermillReport(Application):
             ),
             cookie_secret=os.urandom(32),
         )
+        # The jobs outlive their submission request, so they are run by the service
+        application.settings["report_generator"] = ReportGenerator(application.settings)
         application.listen(self.port, self.ip)
         return application
 
     def start(self):
         """Start the server."""
-        _ = self.make_app()
+        app = self.make_app()
         self.log.info(f"Papermill service listening on {self.ip}:{self.port}")
         self.log.info("Press Ctrl+C to stop")
         # Schedule repository update (or creation) at startup
-        ioloop.IOLoop.current().spawn_callback(
-            update_git_repository,
-            self.template_root_dir,
-            self.template_dir,
-            self.git_url,
-        )
-        ioloop.IOLoop.current().start()
+        repository = app.settings["template_repository"]
+        ioloop.IOLoop.current().spawn_callback(repository.sync)
+        if repository.background_sync:
+            ioloop.PeriodicCallback(repository.poll, self.git_poll_interval * 1000).start()
+        if self.template_watch and self.git_url is None:
+            self._template_watcher = TemplateWatcher(
+                Path(self.template_root_dir) / self.template_dir,
+                app.settings["template_index"],
+                poll_interval=self.template_watch_poll_interval,
+                log=self.log,
+            )
+            ioloop.IOLoop.current().spawn_callback(self._watch_templates, repository)
+        try:
+            ioloop.IOLoop.current().start()
+        finally:
+            self.stop()
+
+    async def _watch_templates(self, repository: TemplateRepository):
+        """Start watching the templates folder once it is created."""
+        await repository.sync()
+        await self._template_watcher.start()
+
+    def stop(self):
+        """Release the service resources."""
+        if self._template_watcher is not None:
+            self._template_watcher.stop()
+        shutdown = getattr(self._report_executor, "shutdown", None)
+        if shutdown is not None:
+            shutdown()
+        if self._inspection_executor is not None:
+            self._inspection_executor.shutdown(wait=False)
+        if self._object_store is not None:
+            self._object_store.close()
 
 
 def main():
@@ -0,0 +1,248 @@
+"""Persistent per-cell execution profiles of the templates."""
+import asyncio
+import json
+import logging
+import math
+import os
+import time
+import typing as tp
+from pathlib import Path
+
+from tornado.log import app_log
+
+from .utils import git_blob_sha
+
+PROFILES_VERSION = 1
+
+
+def read_cell_durations(notebook: Path) -> tp.List[tp.Dict[str, tp.Any]]:
+    """Read the code cells duration recorded by papermill in an executed notebook.
+
+    Args:
+        notebook: Executed notebook path
+
+    Returns:
+        The ``index``, first ``source`` line and ``duration`` in seconds of
+        the executed code cells
+
+    Raises:
+        OSError: If the notebook cannot be read
+        ValueError: If the notebook is not valid JSON
+    """
+    content = json.loads(notebook.read_text(encoding="utf-8"))
+    cells = []
+    for index, cell in enumerate(content.get("cells", [])):
+        duration = cell.get("metadata", {}).get("papermill", {}).get("duration")
+        if cell.get("cell_type") != "code" or duration is None:
+            continue
+        source = cell.get("source", "")
+        source = source if isinstance(source, str) else "".join(source)
+        lines = source.strip().splitlines()
+        cells.append({"index": index, "source": lines[0][:80] if lines else "", "duration": duration})
+    return cells
+
+
+def percentile(values: tp.List[float], q: float) -> tp.Optional[float]:
+    """Compute a percentile with the nearest-rank method.
+
+    Args:
+        values: Samples
+        q: Percentile in [0, 100]
+
+    Returns:
+        The percentile or None without samples
+    """
+    if not values:
+        return None
+    ordered = sorted(values)
+    return ordered[max(0, math.ceil(q / 100 * len(ordered)) - 1)]
+
+
+def _summarize(durations: tp.List[float]) -> tp.Dict[str, tp.Any]:
+    return {
+        "samples": len(durations),
+        "p50": percentile(durations, 50),
+        "p95": percentile(durations, 95),
+    }
+
+
+class CellProfiles:
+    """Per-cell durations of the successful executions of each template.
+
+    The durations are grouped by template version (its git blob SHA) so the
+    evolution of a template can be followed across commits. Only the most
+    recent versions and samples are kept. The profiles are saved on disk to
+    be reused across service restarts.
+
+    Args:
+        profiles_file: Profiles persistence file; the profiles are kept in memory only if None
+        max_versions: Number of versions kept per template
+        max_samples: Number of durations kept per cell of a version
+        log: Logger
+    """
+
+    def __init__(
+        self,
+        profiles_file: tp.Optional[str] = None,
+        max_versions: int = 10,
+        max_samples: int = 100,
+        log: tp.Optional[logging.Logger] = None,
+    ):
+        self.profiles_file = None if profiles_file is None else Path(profiles_file)
+        self.max_versions = max_versions
+        self.max_samples = max_samples
+        self.log = log or app_log
+        # {template path: [{"blob": SHA, "commit": repository commit, "first_seen": timestamp,
+        #                   "runs": count, "totals": [durations],
+        #                   "cells": {index: {"source": first line, "durations": [...]}}}]}
+        # from the oldest to the newest version
+        self._templates = {}  # type: tp.Dict[str, tp.List[tp.Dict[str, tp.Any]]]
+        self._load()
+
+    def _load(self):
+        """Load the profiles from their persistence file."""
+        if self.profiles_file is None or not self.profiles_file.exists():
+            return
+
+        try:
+            content = json.loads(self.profiles_file.read_text())
+            if content.get("version") != PROFILES_VERSION:
+                raise ValueError(f"Unsupported profiles version {content.get('version')}.")
+            self._templates = content["templates"]
+        except BaseException:
+            self.log.warning(
+                f"Unable to load the cell profiles '{self.profiles_file!s}'.", exc_info=True
+            )
+            self._templates = {}
+
+    def save(self):
+        """Save the profiles in their persistence file."""
+        if self.profiles_file is None:
+            return
+
+        self.profiles_file.parent.mkdir(parents=True, exist_ok=True)
+        tmp_file = self.profiles_file.with_name(self.profiles_file.name + ".tmp")
+        tmp_file.write_text(
+            json.dumps({"version": PROFILES_VERSION, "templates": self._templates})
+        )
+        os.replace(tmp_file, self.profiles_file)
+
+    def add(
+        self,
+        template_path: str,
+        blob: str,
+        cells: tp.List[tp.Dict[str, tp.Any]],
+        commit: tp.Optional[str] = None,
+    ):
+        """Record the cells duration of an execution.
+
+        Args:
+            template_path: Template path relative to the templates folder
+            blob: Template git blob SHA
+            cells: Cells duration (see `read_cell_durations`)
+            commit: Templates repository commit SHA
+        """
+        versions = self._templates.setdefault(template_path, [])
+        version = next((v for v in versions if v["blob"] == blob), None)
+        if version is None:
+            version = {
+                "blob": blob,
+                "commit": commit,
+                "first_seen": time.time(),
+                "runs": 0,
+                "totals": [],
+                "cells": {},
+            }
+            versions.append(version)
+            del versions[: -self.max_versions]
+
+        version["runs"] += 1
+        version["totals"] = (version["totals"] + [sum(c["duration"] for c in cells)])[
+            -self.max_samples :
+        ]
+        for cell in cells:
+            profile = version["cells"].setdefault(
+                str(cell["index"]), {"source": cell["source"], "durations": []}
+            )
+            profile["durations"] = (profile["durations"] + [cell["duration"]])[-self.max_samples :]
+
+        try:
+            self.save()
+        except OSError:
+            self.log.warning(
+                f"Unable to save the cell profiles '{self.profiles_file!s}'.", exc_info=True
+            )
+
+    async def record(
+        self, template_path: str, template: Path, notebook: Path, commit: tp.Optional[str] = None
+    ):
+        """Record the cells duration of an executed notebook.
+
+        Errors are logged as the profiles are not essential to the reports.
+
+        Args:
+            template_path: Template path relative to the templates folder
+            template: Template absolute path
+            notebook: Executed notebook path
+            commit: Templates repository commit SHA
+        """
+
+        def read() -> tp.Tuple[str, tp.List[tp.Dict[str, tp.Any]]]:
+            return git_blob_sha(template.read_bytes()), read_cell_durations(notebook)
+
+        try:
+            blob, cells = await asyncio.get_event_loop().run_in_executor(None, read)
+        except (OSError, ValueError):
+            self.log.warning(f"Unable to read the cells duration of '{notebook!s}'.", exc_info=True)
+            return
+        if cells:
+            self.add(template_path, blob, cells, commit)
+
+    def _summarize_version(self, version: tp.Dict, cells: bool) -> tp.Dict[str, tp.Any]:
+        summary = {
+            "blob": version["blob"],
+            "commit": version["commit"],
+            "first_seen": version["first_seen"],
+            "runs": version["runs"],
+            "total": _summarize(version["totals"]),
+        }
+        if cells:
+            summary["cells"] = [
+                dict(index=int(index), source=profile["source"], **_summarize(profile["durations"]))
+                for index, profile in sorted(version["cells"].items(), key=lambda i: int(i[0]))
+            ]
+        return summary
+
+    def get(self, template_path: str) -> tp.Optional[tp.Dict[str, tp.Any]]:
+        """Get the profile of a template.
+
+        Args:
+            template_path: Template path relative to the templates folder
+
+        Returns:
+            The ``template`` path and its ``versions`` from the newest to the
+            oldest with the ``p50`` and ``p95`` durations of their ``total``
+            and ``cells``; None if the template has never been profiled
+        """
+        versions = self._templates.get(template_path)
+        if not versions:
+            return None
+        return {
+            "template": template_path,
+            "versions": [self._summarize_version(v, True) for v in reversed(versions)],
+        }
+
+    def list_profiles(self) -> tp.List[tp.Dict[str, tp.Any]]:
+        """List the profiled templates.
+
+        Returns:
+            The templates profile, without the cells, sorted by path
+        """
+        return [
+            {
+                "template": template_path,
+                "versions": [self._summarize_version(v, False) for v in reversed(versions)],
+            }
+            for template_path, versions in sorted(self._templates.items())
+            if versions
+        ]
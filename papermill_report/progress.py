@@ -0,0 +1,219 @@
+"""Progress of the running executions read from their partial output notebooks."""
+import asyncio
+import html
+import json
+import logging
+import re
+import typing as tp
+from pathlib import Path
+
+from tornado.log import app_log
+
+_ANSI_ESCAPE = re.compile(r"\x1b\[[0-9;]*[A-Za-z]")
+
+
+def _text(value: tp.Union[str, tp.List[str]]) -> str:
+    return value if isinstance(value, str) else "".join(value)
+
+
+def render_outputs(outputs: tp.List[tp.Dict]) -> str:
+    """Render the outputs of a code cell as an HTML fragment.
+
+    The richest supported representation of each output is kept: HTML, SVG,
+    PNG or JPEG images, then plain text.
+
+    Args:
+        outputs: Cell outputs in the notebook JSON format
+
+    Returns:
+        The HTML fragment
+    """
+    fragments = []
+    for output in outputs:
+        output_type = output.get("output_type")
+        if output_type == "stream":
+            fragments.append(f"<pre>{html.escape(_text(output.get('text', '')))}</pre>")
+        elif output_type == "error":
+            traceback = "\n".join(output.get("traceback", []))
+            fragments.append(f"<pre>{html.escape(_ANSI_ESCAPE.sub('', traceback))}</pre>")
+        elif output_type in ("execute_result", "display_data"):
+            data = output.get("data", {})
+            if "text/html" in data:
+                fragments.append(_text(data["text/html"]))
+            elif "image/svg+xml" in data:
+                fragments.append(_text(data["image/svg+xml"]))
+            elif "image/png" in data or "image/jpeg" in data:
+                mimetype = "image/png" if "image/png" in data else "image/jpeg"
+                image = _text(data[mimetype]).replace("\n", "")
+                fragments.append(f'<img src="data:{mimetype};base64,{image}"/>')
+            elif "text/plain" in data:
+                fragments.append(f"<pre>{html.escape(_text(data['text/plain']))}</pre>")
+    return "\n".join(fragments)
+
+
+def read_cells(notebook: Path) -> tp.List[tp.Dict]:
+    """Read the code cells progress of a notebook executed by papermill.
+
+    Args:
+        notebook: Notebook path
+
+    Returns:
+        The code cells ``index``, ``status`` (``pending``, ``running``,
+        ``completed`` or ``failed``), ``duration`` in seconds, ``execution_count``
+        and ``outputs``
+
+    Raises:
+        OSError: If the notebook cannot be read
+        ValueError: If the notebook is being written
+    """
+    content = json.loads(notebook.read_text(encoding="utf-8"))
+    cells = []
+    for index, cell in enumerate(content.get("cells", [])):
+        if cell.get("cell_type") != "code":
+            continue
+        metadata = cell.get("metadata", {}).get("papermill", {})
+        cells.append(
+            {
+                "index": index,
+                "status": metadata.get("status", "pending"),
+                "duration": metadata.get("duration"),
+                "execution_count": cell.get("execution_count"),
+                "outputs": cell.get("outputs", []),
+            }
+        )
+    return cells
+
+
+class ExecutionProgress:
+    """Cells progress of a running execution.
+
+    The partial output notebook, saved by papermill on each cell execution,
+    is read again when it is modified.
+
+    Args:
+        notebook: Output notebook path
+        interval: Period in seconds of the notebook modification check
+        log: Logger
+    """
+
+    def __init__(
+        self, notebook: Path, interval: float = 0.5, log: tp.Optional[logging.Logger] = None
+    ):
+        self.notebook = notebook
+        self.interval = interval
+        self.log = log or app_log
+        self.cells = []  # type: tp.List[tp.Dict]
+        self.finished = False
+        self._mtime = None  # type: tp.Optional[int]
+        self._changed = asyncio.Event()
+
+    def _notify(self):
+        self._changed.set()
+        self._changed = asyncio.Event()
+
+    async def wait(self, timeout: float):
+        """Wait for a progress update.
+
+        Args:
+            timeout: Maximal waiting time in seconds
+        """
+        changed = self._changed
+        try:
+            await asyncio.wait_for(changed.wait(), timeout)
+        except asyncio.TimeoutError:
+            pass
+
+    async def update(self):
+        """Read the notebook again if it was modified."""
+        try:
+            mtime = self.notebook.stat().st_mtime_ns
+        except OSError:
+            return  # Not created yet
+        if mtime == self._mtime:
+            return
+
+        try:
+            cells = await asyncio.get_event_loop().run_in_executor(None, read_cells, self.notebook)
+        except (OSError, ValueError):
+            return  # Being written; read it with the next check
+        self._mtime = mtime
+        if cells != self.cells:
+            self.cells = cells
+            self._notify()
+
+    async def watch(self):
+        """Update the progress periodically until cancelled."""
+        while True:
+            await self.update()
+            await asyncio.sleep(self.interval)
+
+    async def finish(self):
+        """Read the final notebook and wake up the waiting clients."""
+        await self.update()
+        self.finished = True
+        self._notify()
+
+
+class _Tracking:
+    """Asynchronous context tracking the progress of an execution."""
+
+    def __init__(self, tracker: "ProgressTracker", key: str, notebook: Path):
+        self._tracker = tracker
+        self._key = key
+        self._progress = ExecutionProgress(notebook, tracker.interval, tracker.log)
+        self._watching = None  # type: tp.Optional[asyncio.Future]
+
+    async def __aenter__(self) -> ExecutionProgress:
+        self._tracker._executions[self._key] = self._progress
+        self._watching = asyncio.ensure_future(self._progress.watch())
+        return self._progress
+
+    async def __aexit__(self, *args):
+        self._watching.cancel()
+        try:
+            await self._progress.finish()
+        finally:
+            if self._tracker._executions.get(self._key) is self._progress:
+                del self._tracker._executions[self._key]
+
+
+class ProgressTracker:
+    """Progress of the running executions.
+
+    Example:
+
+        async with tracker.track(key, output_dir / "report.ipynb"):
+            await execute()
+
+    Args:
+        interval: Period in seconds of the notebooks modification check
+        log: Logger
+    """
+
+    def __init__(self, interval: float = 0.5, log: tp.Optional[logging.Logger] = None):
+        self.interval = interval
+        self.log = log or app_log
+        self._executions = {}  # type: tp.Dict[str, ExecutionProgress]
+
+    def track(self, key: str, notebook: Path) -> _Tracking:
+        """Follow the progress of an execution.
+
+        Args:
+            key: Execution identifier
+            notebook: Output notebook path
+
+        Returns:
+            Asynchronous context providing the execution progress
+        """
+        return _Tracking(self, key, notebook)
+
+    def get(self, key: str) -> tp.Optional[ExecutionProgress]:
+        """Get the progress of a running execution.
+
+        Args:
+            key: Execution identifier
+
+        Returns:
+            The progress or None if no execution is running for the key
+        """
+        return self._executions.get(key)
@@ -0,0 +1,313 @@
+"""Notebook templates repository."""
+import asyncio
+import logging
+import os
+import shutil
+import stat
+import time
+import typing as tp
+from contextlib import contextmanager
+from pathlib import Path
+
+from tornado.log import app_log
+
+from .metrics import GIT_SYNC, ReportMetrics
+from .utils import _execute_command, update_git_repository
+
+
+def _set_read_only(folder: Path, read_only: bool = True):
+    """Remove (or restore) the write permissions on a folder tree.
+
+    Args:
+        folder: Folder to update
+        read_only: Whether to remove or restore the write permissions
+    """
+    write = stat.S_IWUSR | stat.S_IWGRP | stat.S_IWOTH
+    for root, dirs, files in os.walk(str(folder)):
+        for name in files + dirs + [""]:
+            path = os.path.join(root, name)
+            if os.path.islink(path):
+                continue
+            mode = os.stat(path).st_mode
+            os.chmod(path, mode & ~write if read_only else mode | stat.S_IWUSR)
+
+
+def _remove_folder(folder: Path):
+    """Remove a read-only folder tree.
+
+    Args:
+        folder: Folder to remove
+    """
+    if folder.exists():
+        _set_read_only(folder, False)
+        shutil.rmtree(str(folder), ignore_errors=True)
+
+
+class Snapshot:
+    """Read-only checkout of a templates repository commit.
+
+    Args:
+        commit: Commit SHA
+        path: Snapshot folder
+    """
+
+    def __init__(self, commit: str, path: Path):
+        self.commit = commit
+        self.path = path
+        self.users = 0
+
+
+class TemplateRepository:
+    """Synchronize the templates repository.
+
+    Concurrent synchronization requests are coalesced into a single update
+    and the update is skipped if the last successful one is younger than
+    the time-to-live.
+
+    If the repository is synchronized in background (see `poll`), the requests
+    only update it if it has never been synchronized.
+
+    If a snapshots folder is provided, each synchronized commit is checked out
+    as a read-only git worktree in it. Executions keep reading the snapshot they
+    started with (see `checkout`) while the new ones use the latest snapshot.
+    Outdated snapshots are removed once they are no longer used.
+
+    Args:
+        template_root_dir: Templates project folder
+        template_dir: Templates folder relative to its root (default: ".")
+        git_url: Git repository URL (default: None)
+        ttl: Minimal delay in seconds between two updates (default: 0)
+        background_sync: Whether the repository is synchronized in background (default: False)
+        snapshots_dir: Folder of the commit snapshots; no snapshot if None (default: None)
+        log: Logger
+        metrics: Metrics recording the updates duration
+    """
+
+    def __init__(
+        self,
+        template_root_dir: str,
+        template_dir: str = ".",
+        git_url: tp.Optional[str] = None,
+        ttl: float = 0.0,
+        background_sync: bool = False,
+        snapshots_dir: tp.Optional[str] = None,
+        log: tp.Optional[logging.Logger] = None,
+        metrics: tp.Optional[ReportMetrics] = None,
+    ):
+        self.template_root_dir = template_root_dir
+        self.template_dir = template_dir
+        self.git_url = git_url
+        self.ttl = ttl
+        self.background_sync = background_sync
+        self.snapshots_dir = (
+            None if snapshots_dir is None or git_url is None else Path(snapshots_dir)
+        )
+        self.log = log or app_log
+        self.metrics = metrics
+        self._commit = None  # type: tp.Optional[str]
+        self._snapshot = None  # type: tp.Optional[Snapshot]
+        self._snapshots = {}  # type: tp.Dict[str, Snapshot]
+        self._last_sync = None  # type: tp.Optional[float]
+        self._sync = None  # type: tp.Optional[asyncio.Future]
+
+    @property
+    def commit(self) -> tp.Optional[str]:
+        """str or None: Commit SHA of the last synchronization; None without git repository."""
+        return self._commit
+
+    @property
+    def path(self) -> Path:
+        """Path: Templates folder."""
+        return Path(self.template_root_dir) / self.template_dir
+
+    async def _update(self) -> tp.Optional[str]:
+        """Update the repository and read its current commit.
+
+        Returns:
+            The current commit SHA
+        """
+        start = time.monotonic()
+        await update_git_repository(self.template_root_dir, self.template_dir, self.git_url)
+        if self.git_url is not None:
+            _, output, _ = await _execute_command(
+                ("git", "rev-parse", "HEAD"), cwd=str(self.template_root_dir)
+            )
+            self._commit = output.strip()
+            if self.snapshots_dir is not None:
+                await self._make_snapshot(self._commit)
+        self._last_sync = time.monotonic()
+        if self.metrics is not None:
+            self.metrics.observe(GIT_SYNC, self._last_sync - start)
+        return self._commit
+
+    async def _make_snapshot(self, commit: str):
+        """Checkout a commit as the current snapshot.
+
+        Args:
+            commit: Commit SHA
+        """
+        if not self._snapshots and self.snapshots_dir.exists():
+            # Register the snapshots of a previous run to collect them
+            for path in self.snapshots_dir.iterdir():
+                self._snapshots[path.name] = Snapshot(path.name, path)
+
+        snapshot = self._snapshots.get(commit)
+        if snapshot is None or not (snapshot.path / ".git").exists():
+            path = self.snapshots_dir / commit
+            if path.exists():  # Incomplete snapshot
+                await self._remove_worktree(path)
+            self.snapshots_dir.mkdir(parents=True, exist_ok=True)
+            await _execute_command(
+                ("git", "worktree", "add", "--detach", str(path), commit),
+                cwd=str(self.template_root_dir),
+            )
+            await asyncio.get_event_loop().run_in_executor(None, _set_read_only, path)
+            snapshot = Snapshot(commit, path)
+            self._snapshots[commit] = snapshot
+
+        self._snapshot = snapshot
+        self._collect_snapshots()
+
+    async def _remove_worktree(self, path: Path):
+        """Remove a snapshot worktree.
+
+        Args:
+            path: Snapshot folder
+        """
+        await asyncio.get_event_loop().run_in_executor(None, _remove_folder, path)
+        await _execute_command(("git", "worktree", "prune"), cwd=str(self.template_root_dir))
+
+    async def _remove_snapshot(self, snapshot: Snapshot):
+        """Remove an unused snapshot.
+
+        Errors are logged as this is meant to be run in background.
+
+        Args:
+            snapshot: Snapshot to remove
+        """
+        try:
+            await self._remove_worktree(snapshot.path)
+        except Exception as error:
+            self.log.warning(
+                f"Fail to remove the templates snapshot '{snapshot.path!s}'.", exc_info=error
+            )
+
+    def _collect_snapshots(self):
+        """Remove the outdated snapshots no longer used."""
+        for commit, snapshot in list(self._snapshots.items()):
+            if snapshot is not self._snapshot and snapshot.users == 0:
+                del self._snapshots[commit]
+                asyncio.ensure_future(self._remove_snapshot(snapshot))
+
+    @contextmanager
+    def checkout(self) -> tp.Iterator[Path]:
+        """Provide the templates project folder to use.
+
+        This is the current snapshot folder if snapshots are enabled and
+        the snapshot is kept until the context exits. Otherwise this is the
+        templates project folder.
+
+        Yields:
+            The templates project folder
+        """
+        snapshot = self._snapshot
+        if snapshot is None:
+            yield Path(self.template_root_dir)
+            return
+
+        snapshot.users += 1
+        try:
+            yield snapshot.path
+        finally:
+            snapshot.users -= 1
+            self._collect_snapshots()
+
+    def _clear_sync(self, future: asyncio.Future):
+        """Forget the finished synchronization."""
+        if self._sync is future:
+            self._sync = None
+
+    async def sync(self, force: bool = False) -> tp.Optional[str]:
+        """Synchronize the repository.
+
+        Args:
+            force: Whether to ignore the time-to-live
+
+        Returns:
+            The current commit SHA
+
+        Raises:
+            CalledProcessError: If the git repository cannot be updated.
+        """
+        if self._sync is not None:
+            if not force:
+                return await asyncio.shield(self._sync)
+            try:  # The on-going update may have started before the requested one
+                await asyncio.shield(self._sync)
+            except Exception:
+                pass
+            return await self.sync(force)
+
+        if (
+            not force
+            and self._last_sync is not None
+            and time.monotonic() - self._last_sync < self.ttl
+        ):
+            return self._commit
+
+        self._sync = asyncio.ensure_future(self._update())
+        self._sync.add_done_callback(self._clear_sync)
+        return await asyncio.shield(self._sync)
+
+    async def refresh(self) -> tp.Optional[str]:
+        """Synchronize the repository when a request needs it.
+
+        Returns:
+            The current commit SHA
+
+        Raises:
+            CalledProcessError: If the git repository cannot be updated.
+        """
+        if self.background_sync and self._last_sync is not None:
+            return self._commit
+        return await self.sync()
+
+    async def get_remote_commit(self) -> tp.Optional[str]:
+        """Get the commit SHA of the remote repository head.
+
+        Returns:
+            The remote commit SHA; None without git repository
+
+        Raises:
+            CalledProcessError: If the remote repository cannot be reached.
+        """
+        if self.git_url is None:
+            return None
+
+        _, output, _ = await _execute_command(
+            ("git", "ls-remote", self.git_url, "refs/heads/master"),
+            cwd=str(Path(self.template_root_dir).parent),
+        )
+        return output.split()[0] if output.strip() else None
+
+    async def poll(self, force: bool = False):
+        """Synchronize the repository if its remote head moved.
+
+        Errors are logged as this is meant to be run in background.
+
+        Args:
+            force: Whether to synchronize without checking the remote head
+        """
+        try:
+            if not force:
+                remote_commit = await self.get_remote_commit()
+                if self._commit is not None and remote_commit == self._commit:
+                    return
+            commit = await self.sync(force=True)
+        except Exception as error:
+            self.log.error(
+                f"Fail to update the Jupyter reports repository '{self.git_url}'.",
+                exc_info=error,
+            )
+        else:
+            self.log.info(f"Jupyter reports repository updated to commit '{commit}'.")
@@ -0,0 +1,240 @@
+"""Scheduler bounding the concurrent report executions."""
+import asyncio
+import logging
+import math
+import time
+import typing as tp
+from collections import Counter, OrderedDict, deque
+
+from tornado.log import app_log
+
+INTERACTIVE = "interactive"
+BATCH = "batch"
+PRIORITIES = (INTERACTIVE, BATCH)
+"""Priority classes from the highest to the lowest."""
+
+
+class QueueFull(Exception):
+    """The executions queue is full.
+
+    Args:
+        retry_after: Estimated delay in seconds before a slot is available
+    """
+
+    def __init__(self, retry_after: int):
+        super().__init__(f"Too many reports are being generated; retry in {retry_after} seconds.")
+        self.retry_after = retry_after
+
+
+class _Waiter:
+    """Execution waiting for a slot."""
+
+    def __init__(self, priority: str, expected_duration: tp.Optional[float]):
+        self.future = asyncio.get_event_loop().create_future()
+        self.priority = PRIORITIES.index(priority)
+        self.expected_duration = expected_duration
+        self.enqueued = time.monotonic()
+
+
+class _Slot:
+    """Asynchronous context holding an execution slot."""
+
+    def __init__(
+        self,
+        scheduler: "ExecutionScheduler",
+        username: str,
+        priority: str,
+        expected_duration: tp.Optional[float],
+    ):
+        self._scheduler = scheduler
+        self._username = username
+        self._priority = priority
+        self._expected_duration = expected_duration
+        self._start = None  # type: tp.Optional[float]
+
+    async def __aenter__(self):
+        await self._scheduler._acquire(self._username, self._priority, self._expected_duration)
+        self._start = time.monotonic()
+
+    async def __aexit__(self, *args):
+        self._scheduler._release(self._username, time.monotonic() - self._start)
+
+
+class ExecutionScheduler:
+    """Bound the number of concurrent executions.
+
+    An execution waits in its user queue if the global limit or its user limit
+    is reached. When a slot is released, the waiting executions of the highest
+    priority class are served first. Within a class, the users with waiting
+    executions are served in turn (round-robin) so a user submitting many
+    reports does not starve the others. If the number of waiting executions
+    reaches the queue size, new executions are rejected with `QueueFull`.
+
+    With the shortest-job-first ordering, the waiting execution of the class
+    with the smallest expected duration is served first instead. The time spent
+    waiting is deduced from the expected duration so long executions are not
+    starved. Executions with unknown duration are considered instantaneous.
+
+    Example:
+
+        async with scheduler.slot(username, BATCH, expected_duration=12.5):
+            await execute()
+
+    Args:
+        max_concurrency: Maximal number of concurrent executions
+        max_per_user: Maximal number of concurrent executions per user; 0 for no limit
+        max_queued: Maximal number of waiting executions; 0 for no limit
+        shortest_first: Whether to serve the shortest expected executions first
+        log: Logger
+    """
+
+    def __init__(
+        self,
+        max_concurrency: int,
+        max_per_user: int = 0,
+        max_queued: int = 0,
+        shortest_first: bool = False,
+        log: tp.Optional[logging.Logger] = None,
+    ):
+        self.max_concurrency = max_concurrency
+        self.max_per_user = max_per_user
+        self.max_queued = max_queued
+        self.shortest_first = shortest_first
+        self.log = log or app_log
+        self._running = Counter()  # type: tp.Dict[str, int]
+        # {user: waiting executions} in serving order
+        self._queues = OrderedDict()  # type: tp.Dict[str, tp.Deque[_Waiter]]
+        self._mean_duration = None  # type: tp.Optional[float]
+
+    @property
+    def running(self) -> int:
+        """int: Number of running executions."""
+        return sum(self._running.values())
+
+    @property
+    def queued(self) -> int:
+        """int: Number of waiting executions."""
+        return sum(len(queue) for queue in self._queues.values())
+
+    @property
+    def full(self) -> bool:
+        """bool: Whether a new execution would be rejected."""
+        return self.max_queued > 0 and self.queued >= self.max_queued
+
+    def retry_after(self) -> int:
+        """Estimate the delay before an execution slot is available.
+
+        Returns:
+            The delay in seconds computed from the mean execution duration
+        """
+        duration = self._mean_duration or 1.0
+        return max(1, math.ceil(duration * (self.queued + 1) / self.max_concurrency))
+
+    def slot(
+        self,
+        username: str,
+        priority: str = INTERACTIVE,
+        expected_duration: tp.Optional[float] = None,
+    ) -> _Slot:
+        """Wait for an execution slot.
+
+        Args:
+            username: User name requesting the execution
+            priority: Priority class (see `PRIORITIES`)
+            expected_duration: Expected execution duration in seconds if known
+
+        Returns:
+            Asynchronous context holding the slot
+
+        Raises:
+            QueueFull: When entering the context if the queue is full
+        """
+        return _Slot(self, username, priority, expected_duration)
+
+    def _can_run(self, username: str) -> bool:
+        return self.running < self.max_concurrency and (
+            self.max_per_user <= 0 or self._running[username] < self.max_per_user
+        )
+
+    async def _acquire(
+        self, username: str, priority: str, expected_duration: tp.Optional[float]
+    ):
+        if not self._queues and self._can_run(username):
+            self._running[username] += 1
+            return
+
+        if self.full:
+            raise QueueFull(self.retry_after())
+
+        waiter = _Waiter(priority, expected_duration)
+        self._queues.setdefault(username, deque()).append(waiter)
+        self._dispatch()  # Other users may be blocked by their limit only
+        self.log.debug(f"Report execution of '{username}' queued ({self.queued} waiting).")
+        try:
+            await waiter.future
+        except asyncio.CancelledError:
+            if waiter.future.done() and not waiter.future.cancelled():
+                self._release(username)  # The slot was granted meanwhile
+            else:
+                self._remove_waiter(username, waiter)
+            raise
+
+    def _remove_waiter(self, username: str, waiter: _Waiter):
+        queue = self._queues.get(username)
+        if queue is not None and waiter in queue:
+            queue.remove(waiter)
+            if not queue:
+                del self._queues[username]
+
+    def _release(self, username: str, duration: tp.Optional[float] = None):
+        self._running[username] -= 1
+        if self._running[username] <= 0:
+            del self._running[username]
+        if duration is not None:
+            self._mean_duration = (
+                duration
+                if self._mean_duration is None
+                else 0.8 * self._mean_duration + 0.2 * duration
+            )
+        self._dispatch()
+
+    def _next(self) -> tp.Optional[tp.Tuple[str, _Waiter]]:
+        """Select the next execution to serve.
+
+        Returns:
+            The user name and the waiter or None if no waiting execution can run
+        """
+        candidates = [
+            (username, waiter)
+            for username, queue in self._queues.items()
+            if self._can_run(username)
+            for waiter in queue
+        ]
+        if not candidates:
+            return None
+
+        priority = min(waiter.priority for _, waiter in candidates)
+        candidates = [c for c in candidates if c[1].priority == priority]
+        if not self.shortest_first:
+            return candidates[0]  # Users are stored in round-robin order
+
+        now = time.monotonic()
+        return min(
+            candidates, key=lambda c: (c[1].expected_duration or 0.0) - (now - c[1].enqueued)
+        )
+
+    def _dispatch(self):
+        """Grant the free slots to the waiting executions."""
+        while self.running < self.max_concurrency:
+            selected = self._next()
+            if selected is None:
+                return
+
+            username, waiter = selected
+            queue = self._queues.pop(username)
+            queue.remove(waiter)
+            if queue:  # Serve the other users first
+                self._queues[username] = queue
+            if not waiter.future.cancelled():
+                self._running[username] += 1
+                waiter.future.set_result(None)
@@ -0,0 +1,129 @@
+"""Persistent statistics of the templates executions."""
+import json
+import logging
+import os
+import typing as tp
+from pathlib import Path
+
+from tornado.log import app_log
+
+STATS_VERSION = 1
+
+
+class ExecutionStats:
+    """Runtime statistics per template.
+
+    The execution duration of a template is averaged with an exponential
+    moving average to follow the template evolutions. The statistics are
+    saved on disk to be reused across service restarts.
+
+    Args:
+        stats_file: Statistics persistence file; the statistics are kept in memory only if None
+        smoothing: Weight of the last execution in the moving average
+        log: Logger
+    """
+
+    def __init__(
+        self,
+        stats_file: tp.Optional[str] = None,
+        smoothing: float = 0.2,
+        log: tp.Optional[logging.Logger] = None,
+    ):
+        self.stats_file = None if stats_file is None else Path(stats_file)
+        self.smoothing = smoothing
+        self.log = log or app_log
+        # {template path: {"count": executions, "mean": duration, "last": duration,
+        #                  "cancelled": cancelled executions, "timeouts": timed out executions}}
+        self._templates = {}  # type: tp.Dict[str, tp.Dict[str, tp.Any]]
+        self._load()
+
+    def _load(self):
+        """Load the statistics from their persistence file."""
+        if self.stats_file is None or not self.stats_file.exists():
+            return
+
+        try:
+            content = json.loads(self.stats_file.read_text())
+            if content.get("version") != STATS_VERSION:
+                raise ValueError(f"Unsupported statistics version {content.get('version')}.")
+            self._templates = content["templates"]
+        except BaseException:
+            self.log.warning(
+                f"Unable to load the execution statistics '{self.stats_file!s}'.", exc_info=True
+            )
+            self._templates = {}
+
+    def save(self):
+        """Save the statistics in their persistence file."""
+        if self.stats_file is None:
+            return
+
+        self.stats_file.parent.mkdir(parents=True, exist_ok=True)
+        tmp_file = self.stats_file.with_name(self.stats_file.name + ".tmp")
+        tmp_file.write_text(json.dumps({"version": STATS_VERSION, "templates": self._templates}))
+        os.replace(tmp_file, self.stats_file)
+
+    def _update(self, template_path: str, **values: tp.Any) -> tp.Dict[str, tp.Any]:
+        stats = self._templates.setdefault(template_path, {"count": 0, "mean": None})
+        stats.update(values)
+        try:
+            self.save()
+        except OSError:
+            self.log.warning(
+                f"Unable to save the execution statistics '{self.stats_file!s}'.", exc_info=True
+            )
+        return stats
+
+    def record(self, template_path: str, duration: float):
+        """Record a successful execution.
+
+        Args:
+            template_path: Template path relative to the templates folder
+            duration: Execution duration in seconds
+        """
+        stats = self._templates.get(template_path, {})
+        mean = stats.get("mean")
+        self._update(
+            template_path,
+            count=stats.get("count", 0) + 1,
+            mean=duration if mean is None else (1 - self.smoothing) * mean + self.smoothing * duration,
+            last=duration,
+        )
+
+    def record_cancellation(self, template_path: str, timeout: bool = False):
+        """Record an interrupted execution.
+
+        Args:
+            template_path: Template path relative to the templates folder
+            timeout: Whether the execution exceeded its timeout; cancelled by the clients otherwise
+        """
+        counter = "timeouts" if timeout else "cancelled"
+        stats = self._templates.get(template_path, {})
+        self._update(template_path, **{counter: stats.get(counter, 0) + 1})
+
+    def get(self, template_path: str) -> tp.Dict[str, tp.Any]:
+        """Get the statistics of a template.
+
+        Args:
+            template_path: Template path relative to the templates folder
+
+        Returns:
+            The template statistics; empty if it has never been executed
+        """
+        return dict(self._templates.get(template_path, {}))
+
+    def expected_duration(self, template_path: str) -> tp.Optional[float]:
+        """Estimate the execution duration of a template.
+
+        Args:
+            template_path: Template path relative to the templates folder
+
+        Returns:
+            The average duration in seconds of the template; the average of all
+            templates if it has never been executed or None if no template has been.
+        """
+        mean = self._templates.get(template_path, {}).get("mean")
+        if mean is None:
+            known = [s["mean"] for s in self._templates.values() if s.get("mean") is not None]
+            mean = sum(known) / len(known) if known else None
+        return mean
@@ -6,7 +6,9 @@ import pytest
 from jupyter_client import kernelspec
 from nbformat.v4 import new_code_cell, new_markdown_cell, new_notebook
 
+from papermill_report.execution import ReportJob
 from papermill_report.papermill_report import PapermillReport
+from papermill_report.utils import ANONYMOUS_USER
 
 
 FORBIDDEN = re.compile(r"[\/\.:\s]+")
@@ -76,8 +78,31 @@ def template_root_dir(tmp_path):
 def app(tmp_path, template_root_dir, git_project):
     service = PapermillReport(
         broken_reports_dir=str(tmp_path / "broken_reports"),
+        cache_dir=str(tmp_path / "cache"),
+        port=0,  # Let the OS pick a free port for the listener opened by make_app
         template_root_dir=str(template_root_dir),
         template_git_url=str(git_project),
     )
     service.initialize()
-    return service.make_app()
+    yield service.make_app()
+    service.stop()
+
+
+@pytest.fixture
+def notebook_metadata():
+    return {
+        "kernelspec": {"name": "python3", "language": "python", "display_name": "Python 3"},
+        "language_info": {"name": "python"},
+    }
+
+
+@pytest.fixture
+def make_job(tmp_path):
+    def make(template, parameters, name, on_phase=None):
+        output_dir = tmp_path / name
+        output_dir.mkdir()
+        return ReportJob(
+            template, template.name, parameters, ANONYMOUS_USER, output_dir, on_phase=on_phase
+        )
+
+    return make
@@ -1,10 +1,28 @@
+import asyncio
+import gzip
 import json
+import time
 from unittest.mock import patch
 from urllib.parse import urlencode
 
+import nbformat
 import pytest
 from tornado.httpclient import HTTPClientError
 
+from papermill_report.cache import ReportCache
+from papermill_report.execution import (
+    ExecutionError,
+    ForkServerExecutor,
+    KernelPoolExecutor,
+    WorkerExecutor,
+)
+from papermill_report.gitobjects import GitObjectStore
+from papermill_report.index import TemplateIndex
+from papermill_report.kernels import KernelPool
+from papermill_report.scheduler import ExecutionScheduler
+from papermill_report.tracing import TraceExporter
+from papermill_report.utils import ANONYMOUS_USER
+
 
 async def test_get_templates(http_server_client):
     response = await http_server_client.fetch("/api/templates/")
@@ -56,6 +74,28 @@ async def test_get_templates_subfolder(http_server_client):
         ]
 
 
+async def test_get_templates_git_objects(app, template_root_dir, http_server_client):
+    store = GitObjectStore(str(template_root_dir))
+    app.settings["template_index"] = TemplateIndex(object_store=store)
+    try:
+        with patch.object(store, "read", wraps=store.read) as read:
+            response = await http_server_client.fetch("/api/templates/")
+        answer = json.loads(response.body.decode("utf-8"))
+        assert [t["path"] for t in answer["templates"]] == [
+            "notebook1.ipynb",
+            "subfolder/notebook2.ipynb",
+        ]
+        assert answer["templates"][0]["parameters"][0]["name"] == "a"
+        assert read.call_count == 2
+
+        with patch("papermill_report.handlers.ReportHandler.report_path", "subfolder"):
+            response = await http_server_client.fetch("/api/templates/")
+        answer = json.loads(response.body.decode("utf-8"))
+        assert [t["path"] for t in answer["templates"]] == ["notebook2.ipynb"]
+    finally:
+        store.close()
+
+
 @pytest.mark.parametrize("endpoint", ["/hello", "/my_script.py", "/hello/"])
 async def test_bad_template_url(http_server_client, endpoint):
     with pytest.raises(HTTPClientError, match="HTTP 404:"):
@@ -75,3 +115,550 @@ async def test_generate_template_with_parameters(http_server_client):
     )
     assert response.code == 200
     assert param_b + "eaver" in response.body.decode("utf-8")
+
+
+async def test_refresh_templates(http_server_client):
+    with patch(
+        "papermill_report.repository.TemplateRepository.poll", autospec=True
+    ) as poll:
+        response = await http_server_client.fetch(
+            "/api/templates/refresh", method="POST", body=""
+        )
+    assert response.code == 202
+    poll.assert_called_once()
+
+
+async def test_refresh_templates_get(http_server_client):
+    response = await http_server_client.fetch("/api/templates/refresh", raise_error=False)
+    assert response.code == 405
+    assert response.headers["Content-Type"] == "application/json"
+    assert "templates" not in json.loads(response.body)
+
+
+async def test_refresh_templates_token(app, http_server_client):
+    app.settings["git_webhook_token"] = "secret"
+    with patch(
+        "papermill_report.repository.TemplateRepository.poll", autospec=True
+    ) as poll:
+        response = await http_server_client.fetch(
+            "/api/templates/refresh?token=secret", method="POST", body=""
+        )
+    assert response.code == 202
+    poll.assert_called_once()
+
+
+async def test_generate_template_kernel_pool(app, http_server_client):
+    pool = KernelPool()
+    app.settings["report_executor"] = KernelPoolExecutor(pool)
+    try:
+        param_b = "The agile w"
+        response = await http_server_client.fetch(
+            "/subfolder/notebook2.ipynb?" + urlencode(dict(b=param_b))
+        )
+        assert response.code == 200
+        assert param_b + "eaver" in response.body.decode("utf-8")
+    finally:
+        pool.shutdown()
+
+
+async def test_generate_template_forkserver(app, http_server_client):
+    executor = ForkServerExecutor()
+    app.settings["report_executor"] = executor
+    try:
+        param_b = "The agile w"
+        response = await http_server_client.fetch(
+            "/subfolder/notebook2.ipynb?" + urlencode(dict(b=param_b))
+        )
+        assert response.code == 200
+        assert param_b + "eaver" in response.body.decode("utf-8")
+    finally:
+        executor.shutdown()
+
+
+async def test_generate_template_worker(app, http_server_client):
+    executor = WorkerExecutor()
+    app.settings["report_executor"] = executor
+    try:
+        param_b = "The agile w"
+        response = await http_server_client.fetch(
+            "/subfolder/notebook2.ipynb?" + urlencode(dict(b=param_b))
+        )
+        assert response.code == 200
+        assert param_b + "eaver" in response.body.decode("utf-8")
+    finally:
+        executor.shutdown()
+
+
+async def test_generate_template_cache(tmp_path, app, http_server_client):
+    app.settings["report_cache"] = ReportCache(str(tmp_path / "reports"), 10000, 60)
+
+    async def execute(job):
+        report = job.output_dir / "report.html"
+        report.write_text(f"Hello {job.parameters['b']}")
+        return report
+
+    with patch(
+        "papermill_report.execution.SubprocessExecutor.execute", side_effect=execute
+    ) as execute_mock:
+        url = "/subfolder/notebook2.ipynb?" + urlencode(dict(b="'world'"))
+        first = await http_server_client.fetch(url)
+        second = await http_server_client.fetch(url)
+        bypass = await http_server_client.fetch(url, headers={"Cache-Control": "no-cache"})
+
+    assert first.headers["X-Report-Cache"] == "MISS"
+    assert second.headers["X-Report-Cache"] == "HIT"
+    assert first.body == second.body == bypass.body == b"Hello world"
+    assert execute_mock.call_count == 2
+
+
+@pytest.mark.parametrize("endpoint", ["/", "/api/templates/"])
+async def test_get_templates_not_modified(http_server_client, endpoint):
+    first = await http_server_client.fetch(endpoint)
+    etag = first.headers["Etag"]
+    assert first.headers["Cache-Control"] == "private, no-cache"
+
+    with patch("papermill_report.index.TemplateIndex.list_templates") as list_mock:
+        second = await http_server_client.fetch(
+            endpoint, headers={"If-None-Match": etag}, raise_error=False
+        )
+    assert second.code == 304
+    assert second.headers["Etag"] == etag
+    list_mock.assert_not_called()
+
+
+@pytest.mark.parametrize("endpoint", ["/", "/api/templates/"])
+async def test_get_templates_not_modified_without_commit(
+    app, template_root_dir, http_server_client, endpoint
+):
+    await http_server_client.fetch(endpoint)  # Clone the templates
+
+    async def no_commit():
+        return None
+
+    with patch(
+        "papermill_report.repository.TemplateRepository.refresh", side_effect=no_commit
+    ):
+        first = await http_server_client.fetch(endpoint)
+        etag = first.headers["Etag"]
+        digest = app.settings["template_index"].digest(template_root_dir)
+        assert etag.startswith(f'"{digest}-')
+
+        second = await http_server_client.fetch(
+            endpoint, headers={"If-None-Match": etag}, raise_error=False
+        )
+        assert second.code == 304
+        assert second.headers["Etag"] == etag
+
+        # Modified notebook
+        notebook = template_root_dir / "notebook1.ipynb"
+        notebook.write_text(notebook.read_text().replace("Beautiful", "Modified"))
+        third = await http_server_client.fetch(
+            endpoint, headers={"If-None-Match": etag}, raise_error=False
+        )
+        assert third.code == 200
+        assert third.headers["Etag"] != etag
+
+
+async def test_generate_template_not_modified(tmp_path, app, http_server_client):
+    app.settings["report_cache"] = ReportCache(str(tmp_path / "reports"), 10000, 60)
+
+    async def execute(job):
+        report = job.output_dir / "report.html"
+        report.write_text(f"Hello {job.parameters['b']}")
+        return report
+
+    with patch(
+        "papermill_report.execution.SubprocessExecutor.execute", side_effect=execute
+    ) as execute_mock:
+        url = "/subfolder/notebook2.ipynb?" + urlencode(dict(b="'world'"))
+        first = await http_server_client.fetch(url, decompress_response=False)
+        etag = first.headers["Etag"]
+        second = await http_server_client.fetch(
+            url, headers={"If-None-Match": etag}, decompress_response=False, raise_error=False
+        )
+        compressed = await http_server_client.fetch(
+            url, headers={"Accept-Encoding": "gzip", "If-None-Match": etag}
+        )
+        other = await http_server_client.fetch(
+            "/subfolder/notebook2.ipynb?b='you'", headers={"If-None-Match": etag}
+        )
+
+    assert first.code == 200
+    assert first.headers["Cache-Control"] == "private, no-cache"
+    assert second.code == 304
+    assert second.headers["Etag"] == etag
+    assert compressed.code == 200
+    assert compressed.headers["Etag"] != etag
+    assert other.code == 200
+    assert execute_mock.call_count == 2
+
+
+async def test_metrics(tmp_path, app, http_server_client):
+    app.settings["report_cache"] = ReportCache(str(tmp_path / "reports"), 10000, 60)
+
+    async def execute(job):
+        report = job.output_dir / "report.html"
+        report.write_text("Hello")
+        return report
+
+    with patch("papermill_report.execution.SubprocessExecutor.execute", side_effect=execute):
+        for _ in range(2):
+            await http_server_client.fetch("/subfolder/notebook2.ipynb")
+    await http_server_client.fetch("/api/templates/")
+
+    response = await http_server_client.fetch("/metrics")
+    assert response.headers["Content-Type"].startswith("text/plain")
+    metrics = response.body.decode("utf-8")
+    for line in (
+        'papermill_report_reports_total{status="success",template="subfolder/notebook2.ipynb"} 1.0',
+        'papermill_report_cache_requests_total{cache="report",result="hit"} 1.0',
+        'papermill_report_cache_requests_total{cache="report",result="miss"} 1.0',
+        'papermill_report_cache_requests_total{cache="template_index",result="miss"} 2.0',
+        "papermill_report_running_executions 0.0",
+    ):
+        assert line in metrics.splitlines()
+    assert 'papermill_report_phase_duration_seconds_count{phase="git_sync"}' in metrics
+    assert 'papermill_report_phase_duration_seconds_count{phase="inspection"} 2.0' in metrics
+
+
+async def test_request_trace(tmp_path, app, http_server_client):
+    app.settings["trace_exporter"] = TraceExporter(str(tmp_path / "trace.json"))
+
+    async def execute(job):
+        job.record_phase("execution", time.time(), 0.5)
+        job.record_phase("conversion", time.time(), 0.25)
+        report = job.output_dir / "report.html"
+        report.write_text("Hello")
+        return report
+
+    with patch("papermill_report.execution.SubprocessExecutor.execute", side_effect=execute):
+        with patch.object(app.settings["log"], "info") as info:
+            response = await http_server_client.fetch("/subfolder/notebook2.ipynb")
+
+    names = [metric.split(";")[0] for metric in response.headers["Server-Timing"].split(", ")]
+    assert names == [
+        "git_update",
+        "parameters",
+        "execution",
+        "papermill",
+        "nbconvert",
+        "total",
+    ]
+    assert "papermill;dur=500.0" in response.headers["Server-Timing"]
+
+    traces = [c[0][0] for c in info.call_args_list if c[0][0].startswith("Request trace ")]
+    record = json.loads(traces[-1][len("Request trace "):])
+    assert record["path"] == "/subfolder/notebook2.ipynb"
+    assert record["status"] == 200
+    assert [span["name"] for span in record["spans"]] == [
+        "git_update",
+        "parameters",
+        "execution",
+        "response",
+    ]
+    assert record["spans"][-1]["duration"] is not None
+
+    events = json.loads((tmp_path / "trace.json").read_text().rstrip().rstrip(",") + "]")
+    assert "papermill" in [event["name"] for event in events]
+
+
+async def test_profiles(app, http_server_client):
+    async def execute(job):
+        notebook = nbformat.read(str(job.template), as_version=4)
+        for index, cell in enumerate(notebook.cells):
+            cell.metadata["papermill"] = {"status": "completed", "duration": float(index)}
+        nbformat.write(notebook, str(job.output_dir / job.template.name))
+        report = job.output_dir / "report.html"
+        report.write_text("Hello")
+        return report
+
+    with patch("papermill_report.execution.SubprocessExecutor.execute", side_effect=execute):
+        await http_server_client.fetch("/subfolder/notebook2.ipynb")
+
+    response = await http_server_client.fetch("/api/profile/")
+    profiles = json.loads(response.body)["profiles"]
+    assert [p["template"] for p in profiles] == ["subfolder/notebook2.ipynb"]
+    assert profiles[0]["versions"][0]["runs"] == 1
+
+    response = await http_server_client.fetch("/api/profile/subfolder/notebook2.ipynb")
+    profile = json.loads(response.body)
+    assert profile["versions"][0]["cells"]
+    assert all(c["p50"] == c["index"] for c in profile["versions"][0]["cells"])
+
+    response = await http_server_client.fetch("/profile")
+    assert "subfolder/notebook2.ipynb" in response.body.decode("utf-8")
+
+    with pytest.raises(HTTPClientError) as info:
+        await http_server_client.fetch("/api/profile/unknown.ipynb")
+    assert info.value.code == 404
+
+
+async def test_report_job(app, http_server_client):
+    async def execute(job):
+        report = job.output_dir / "report.html"
+        report.write_text(f"Hello {job.parameters['b']}")
+        return report
+
+    with patch("papermill_report.execution.SubprocessExecutor.execute", side_effect=execute):
+        response = await http_server_client.fetch(
+            "/api/jobs/",
+            method="POST",
+            body=json.dumps({"template": "subfolder/notebook2.ipynb", "parameters": {"b": "world"}}),
+        )
+        assert response.code == 202
+        job = json.loads(response.body)
+        assert response.headers["Location"] == "/api/jobs/" + job["id"]
+
+        for _ in range(50):
+            response = await http_server_client.fetch("/api/jobs/" + job["id"])
+            if json.loads(response.body)["status"] == "completed":
+                break
+            await asyncio.sleep(0.1)
+
+    response = await http_server_client.fetch(f"/api/jobs/{job['id']}/report")
+    assert response.body == b"Hello world"
+    assert response.headers["Cache-Control"].startswith("private, max-age=")
+    response = await http_server_client.fetch(
+        f"/api/jobs/{job['id']}/report",
+        headers={"If-None-Match": response.headers["Etag"]},
+        raise_error=False,
+    )
+    assert response.code == 304
+
+    response = await http_server_client.fetch("/api/jobs/")
+    assert [j["id"] for j in json.loads(response.body)["jobs"]] == [job["id"]]
+
+    response = await http_server_client.fetch("/api/jobs/" + job["id"], method="DELETE")
+    assert response.code == 204
+    with pytest.raises(HTTPClientError) as info:
+        await http_server_client.fetch("/api/jobs/" + job["id"])
+    assert info.value.code == 404
+
+
+async def test_report_job_pending(app, http_server_client):
+    app.settings["report_scheduler"] = ExecutionScheduler(1)
+    release = asyncio.Event()
+
+    async def execute(job):
+        await release.wait()
+        report = job.output_dir / "report.html"
+        report.write_text(f"Hello {job.parameters['b']}")
+        return report
+
+    async def get_job(job_id):
+        response = await http_server_client.fetch("/api/jobs/" + job_id)
+        return json.loads(response.body)
+
+    with patch("papermill_report.execution.SubprocessExecutor.execute", side_effect=execute):
+        jobs = []
+        for b in ("first", "second"):
+            response = await http_server_client.fetch(
+                "/api/jobs/",
+                method="POST",
+                body=json.dumps({"template": "subfolder/notebook2.ipynb", "parameters": {"b": b}}),
+            )
+            jobs.append(json.loads(response.body)["id"])
+        await asyncio.sleep(0.5)
+
+        # The second job waits for the execution slot of the first one
+        first, second = [await get_job(job_id) for job_id in jobs]
+        assert first["status"] == "running" and first["started"] is not None
+        assert second["status"] == "pending" and second["started"] is None
+
+        release.set()
+        for _ in range(50):
+            second = await get_job(jobs[1])
+            if second["status"] == "completed":
+                break
+            await asyncio.sleep(0.1)
+
+    assert second["status"] == "completed"
+    assert second["started"] >= (await get_job(jobs[0]))["finished"] - 1
+
+
+async def test_report_job_unknown_template(app, http_server_client):
+    with pytest.raises(HTTPClientError) as info:
+        await http_server_client.fetch(
+            "/api/jobs/", method="POST", body=json.dumps({"template": "missing.ipynb"})
+        )
+    assert info.value.code == 404
+
+
+async def test_report_job_broken_report(tmp_path, app):
+    # The job runs without any request: the broken report goes to its user folder
+    app.settings["broken_path"] = str(tmp_path / "USERNAME" / "broken_reports")
+    await app.settings["template_repository"].refresh()
+    job_store = app.settings["job_store"]
+
+    async def execute(job):
+        notebook = job.output_dir / job.template.name
+        notebook.write_text("broken")
+        raise ExecutionError("Broken report", ValueError("broken"), notebook)
+
+    with patch("papermill_report.execution.SubprocessExecutor.execute", side_effect=execute):
+        job = job_store.submit(
+            "subfolder/notebook2.ipynb", {}, ANONYMOUS_USER, app.settings["report_generator"].run_job
+        )
+        for _ in range(50):
+            if job.done:
+                break
+            await asyncio.sleep(0.1)
+
+    assert job.status == "failed"
+    assert job.started is not None
+    (broken_report,) = (tmp_path / ANONYMOUS_USER / "broken_reports").glob("*_broken_notebook2.ipynb")
+    assert job.error["broken_report"] == str(broken_report)
+
+
+async def test_generate_template_queue_full(app, http_server_client):
+    app.settings["report_scheduler"] = ExecutionScheduler(1, max_queued=1)
+    release = asyncio.Event()
+
+    async def execute(job):
+        await release.wait()
+        report = job.output_dir / "report.html"
+        report.write_text(f"Hello {job.parameters['b']}")
+        return report
+
+    with patch("papermill_report.execution.SubprocessExecutor.execute", side_effect=execute):
+        running = [
+            asyncio.ensure_future(
+                http_server_client.fetch("/subfolder/notebook2.ipynb?" + urlencode(dict(b=b)))
+            )
+            for b in ("'first'", "'second'")
+        ]
+        await asyncio.sleep(0.5)
+        with pytest.raises(HTTPClientError) as info:
+            await http_server_client.fetch("/subfolder/notebook2.ipynb?b='third'")
+        release.set()
+        responses = await asyncio.gather(*running)
+
+    assert info.value.code == 503
+    assert int(info.value.response.headers["Retry-After"]) >= 1
+    assert [response.body for response in responses] == [b"Hello first", b"Hello second"]
+
+
+async def test_generate_template_client_disconnect(app, http_server_client):
+    cancelled = asyncio.Event()
+
+    async def execute(job):
+        try:
+            await asyncio.sleep(60)
+        except asyncio.CancelledError:
+            cancelled.set()
+            raise
+
+    with patch("papermill_report.execution.SubprocessExecutor.execute", side_effect=execute):
+        with pytest.raises(HTTPClientError) as info:
+            await http_server_client.fetch(
+                "/subfolder/notebook2.ipynb?b='gone'", request_timeout=0.5
+            )
+        await asyncio.wait_for(cancelled.wait(), 5)
+
+    assert info.value.code == 599
+    assert app.settings["execution_stats"].get("subfolder/notebook2.ipynb")["cancelled"] == 1
+
+
+async def test_generate_template_timeout(app, http_server_client):
+    app.settings["execution_timeout"] = 60
+    app.settings["execution_timeouts"] = {"subfolder/*": 0.2}
+
+    async def execute(job):
+        await asyncio.sleep(60)
+
+    with patch("papermill_report.execution.SubprocessExecutor.execute", side_effect=execute):
+        with pytest.raises(HTTPClientError) as info:
+            await http_server_client.fetch("/subfolder/notebook2.ipynb?b='slow'")
+
+    assert info.value.code == 500
+    assert "timeout" in info.value.response.body.decode("utf-8")
+    assert app.settings["execution_stats"].get("subfolder/notebook2.ipynb")["timeouts"] == 1
+
+
+async def test_generate_template_broken_report(tmp_path, app, http_server_client):
+    folders = []
+
+    async def execute(job):
+        folders.append(job.output_dir)
+        notebook = job.output_dir / job.template.name
+        notebook.write_text("broken")
+        raise ExecutionError("Broken report", ValueError("broken"), notebook)
+
+    with patch("papermill_report.execution.SubprocessExecutor.execute", side_effect=execute):
+        with pytest.raises(HTTPClientError) as info:
+            await http_server_client.fetch("/subfolder/notebook2.ipynb?b='broken'")
+
+    assert info.value.code == 500
+    assert "The broken report has been copied" in info.value.response.body.decode("utf-8")
+    (broken_report,) = (tmp_path / "broken_reports").glob("*_broken_notebook2.ipynb")
+    assert broken_report.read_text() == "broken"
+    # The execution folder is removed once the notebook is copied
+    assert not folders[0].exists()
+
+
+async def test_report_job_progress(app, http_server_client):
+    release = asyncio.Event()
+
+    async def execute(job):
+        notebook = job.output_dir / job.template.name
+        nb = nbformat.read(str(job.template), as_version=4)
+        for index, cell in enumerate(c for c in nb.cells if c.cell_type == "code"):
+            cell.metadata["papermill"] = {"status": "completed" if index == 0 else "running"}
+            if index == 0:
+                cell.outputs = [nbformat.v4.new_output("stream", name="stdout", text="first\n")]
+        nbformat.write(nb, str(notebook))
+        await release.wait()
+        report = job.output_dir / "report.html"
+        report.write_text("Hello")
+        return report
+
+    events = []
+
+    def on_chunk(chunk):
+        events.extend(e for e in chunk.decode("utf-8").split("\n\n") if e)
+        if any(e.startswith("event: cell") for e in events):
+            release.set()
+
+    with patch("papermill_report.execution.SubprocessExecutor.execute", side_effect=execute):
+        response = await http_server_client.fetch(
+            "/api/jobs/",
+            method="POST",
+            body=json.dumps({"template": "subfolder/notebook2.ipynb", "parameters": {"b": "x"}}),
+        )
+        job = json.loads(response.body)
+        response = await http_server_client.fetch(
+            f"/api/jobs/{job['id']}/progress?html=true", streaming_callback=on_chunk, request_timeout=20
+        )
+
+    assert response.headers["Content-Type"] == "text/event-stream"
+    cells = [json.loads(e.split("data: ", 1)[1]) for e in events if e.startswith("event: cell")]
+    assert cells[0]["status"] == "completed"
+    assert cells[0]["html"] == "<pre>first\n</pre>"
+    assert cells[1]["status"] == "running"
+    statuses = [json.loads(e.split("data: ", 1)[1])["status"] for e in events if e.startswith("event: status")]
+    assert statuses[-1] == "completed"
+
+
+async def test_generate_template_compressed(tmp_path, app, http_server_client):
+    app.settings["report_cache"] = ReportCache(str(tmp_path / "reports"), 100000, 60)
+    content = "<p>Hello world</p>" * 1000
+
+    async def execute(job):
+        report = job.output_dir / "report.html"
+        report.write_text(content)
+        return report
+
+    with patch("papermill_report.execution.SubprocessExecutor.execute", side_effect=execute):
+        url = "/subfolder/notebook2.ipynb?b='world'"
+        headers = {"Accept-Encoding": "gzip"}
+        first = await http_server_client.fetch(url, headers=headers, decompress_response=False)
+        second = await http_server_client.fetch(url, headers=headers, decompress_response=False)
+        plain = await http_server_client.fetch(url, headers={"Accept-Encoding": "identity"})
+
+    for response in (first, second):
+        assert response.headers["Content-Encoding"] == "gzip"
+        assert gzip.decompress(response.body).decode("utf-8") == content
+    assert second.headers["X-Report-Cache"] == "HIT"
+    assert int(second.headers["Content-Length"]) == len(second.body)
+    assert "Content-Encoding" not in plain.headers
+    assert plain.body.decode("utf-8") == content
@@ -0,0 +1,95 @@
+import gzip
+import time
+
+from papermill_report.cache import ReportCache
+
+
+def make_report(tmp_path, content="<html>report</html>"):
+    report = tmp_path / "output" / "report.html"
+    report.parent.mkdir(exist_ok=True)
+    report.write_text(content)
+    return report
+
+
+def test_make_key():
+    key = ReportCache.make_key("sha", {"a": 1, "b": "hello"})
+    assert key == ReportCache.make_key("sha", {"b": "hello", "a": 1})
+    assert key != ReportCache.make_key("sha", {"a": 2, "b": "hello"})
+    assert key != ReportCache.make_key("other", {"a": 1, "b": "hello"})
+    assert key != ReportCache.make_key("sha", {"a": 1, "b": "hello"}, username="marc")
+
+
+async def test_put_get(tmp_path):
+    cache = ReportCache(str(tmp_path / "cache"), 1000, 60)
+    key = ReportCache.make_key("sha", {})
+    assert cache.get(key) is None
+
+    cached = await cache.put(key, "notebook.ipynb", make_report(tmp_path))
+
+    assert cache.get(key) == cached
+    assert cached.read_text() == "<html>report</html>"
+    # Entries are reloaded from disk
+    assert ReportCache(str(tmp_path / "cache"), 1000, 60).get(key) == cached
+
+
+async def test_get_metadata(tmp_path):
+    cache = ReportCache(str(tmp_path / "cache"), 1000, 60)
+    key = ReportCache.make_key("sha", {})
+    assert cache.get_metadata(key) is None
+
+    await cache.put(key, "notebook.ipynb", make_report(tmp_path))
+    metadata = cache.get_metadata(key)
+    assert metadata["template"] == "notebook.ipynb"
+    assert metadata["expires"] == metadata["created"] + 60
+
+    # A new report creates a new entry version
+    await cache.put(key, "notebook.ipynb", make_report(tmp_path))
+    assert cache.get_metadata(key)["created"] > metadata["created"]
+
+
+async def test_expiration(tmp_path):
+    cache = ReportCache(
+        str(tmp_path / "cache"), 1000, 60, template_ttls={"daily/*": 0.1, "never/*": 0}
+    )
+    key = ReportCache.make_key("sha", {})
+    await cache.put(key, "daily/notebook.ipynb", make_report(tmp_path))
+    assert cache.get(key) is not None
+
+    time.sleep(0.2)
+    assert cache.get(key) is None
+
+    key = ReportCache.make_key("other", {})
+    await cache.put(key, "never/notebook.ipynb", make_report(tmp_path))
+    assert cache.get(key) is None
+
+
+async def test_lru_eviction(tmp_path):
+    cache = ReportCache(str(tmp_path / "cache"), 50, 60)
+    keys = [ReportCache.make_key(str(i), {}) for i in range(3)]
+
+    await cache.put(keys[0], "nb.ipynb", make_report(tmp_path, "a" * 20))
+    await cache.put(keys[1], "nb.ipynb", make_report(tmp_path, "b" * 20))
+    assert cache.get(keys[0]) is not None  # keys[1] becomes the least recently used
+    await cache.put(keys[2], "nb.ipynb", make_report(tmp_path, "c" * 20))
+
+    assert cache.get(keys[1]) is None
+    assert cache.get(keys[0]) is not None
+    assert cache.get(keys[2]) is not None
+
+
+async def test_compressed_variant(tmp_path):
+    cache = ReportCache(str(tmp_path / "cache"), 10000, 60)
+    key = ReportCache.make_key("sha", {})
+    assert await cache.compressed(key, "gzip") is None
+
+    cached = await cache.put(key, "notebook.ipynb", make_report(tmp_path, "<html>" * 100))
+    variant = await cache.compressed(key, "gzip")
+
+    assert gzip.decompress(variant.read_bytes()) == cached.read_bytes()
+    assert await cache.compressed(key, "gzip") == variant
+    assert cache._size == cached.stat().st_size + variant.stat().st_size
+    # The variant is accounted when reloading the cache and removed with its entry
+    reloaded = ReportCache(str(tmp_path / "cache"), 10000, 60)
+    assert reloaded._size == cache._size
+    reloaded._remove(key)
+    assert not variant.exists()
@@ -0,0 +1,46 @@
+import gzip
+
+import pytest
+
+from papermill_report.compression import Compressor, compress_file, negotiate_encoding
+
+
+@pytest.mark.parametrize(
+    "header, expected",
+    [
+        ("", None),
+        ("identity", None),
+        ("gzip, deflate", "gzip"),
+        ("deflate;q=1.0, gzip;q=0.5", "gzip"),
+        ("gzip;q=0", None),
+        ("*", "gzip"),
+        ("*, gzip;q=0", None),
+    ],
+)
+def test_negotiate_encoding(header, expected, monkeypatch):
+    monkeypatch.setattr("papermill_report.compression.brotli", None)
+    assert negotiate_encoding(header) == expected
+
+
+def test_compressor_gzip():
+    compressor = Compressor("gzip")
+    data = compressor.compress(b"hello " * 1000) + compressor.compress(b"world")
+    data += compressor.flush()
+
+    assert gzip.decompress(data) == b"hello " * 1000 + b"world"
+
+
+def test_compressor_unsupported():
+    with pytest.raises(ValueError):
+        Compressor("deflate")
+
+
+def test_compress_file(tmp_path):
+    source = tmp_path / "report.html"
+    source.write_bytes(b"<html>" * 10000)
+    target = tmp_path / "report.html.gzip"
+
+    compress_file(source, target, "gzip", chunk_size=1000)
+
+    assert gzip.decompress(target.read_bytes()) == source.read_bytes()
+    assert sorted(tmp_path.iterdir()) == sorted([source, target])
@@ -1,5 +1,7 @@
 import json
 
+import pytest
+
 from papermill_report.papermill_report import PapermillReport
 
 
@@ -70,3 +72,17 @@ def test_configuration_cli():
     assert app.template_git_url == git_tpl
     assert app.template_root_dir == tpl_folder
     assert app.template_paths == tpl_paths
+
+
+def test_stop_inspection_executor(tmp_path):
+    service = PapermillReport(
+        cache_dir=str(tmp_path / "cache"), port=0, template_root_dir=str(tmp_path / "templates")
+    )
+    service.initialize([])
+    service.make_app()
+    executor = service._inspection_executor
+
+    service.stop()
+
+    with pytest.raises(RuntimeError):
+        executor.submit(print)
@@ -0,0 +1,192 @@
+import asyncio
+import json
+from pathlib import Path
+
+import pytest
+from nbformat.v4 import new_code_cell, new_notebook
+
+from papermill_report.execution import ExecutionDeduplicator, KernelPoolExecutor, ReportJob
+from papermill_report.kernels import KernelPool
+from papermill_report.utils import ANONYMOUS_USER, _execute_command
+
+
+async def test_deduplicator_share():
+    deduplicator = ExecutionDeduplicator()
+    calls = []
+
+    async def generate(output_dir):
+        calls.append(output_dir)
+        await asyncio.sleep(0.1)
+        report = output_dir / "report.html"
+        report.write_text("report")
+        return report
+
+    async def request(key):
+        async with deduplicator.share(key, generate) as report:
+            assert report.read_text() == "report"
+            return report
+
+    reports = await asyncio.gather(request("a"), request("a"), request("b"))
+
+    assert len(calls) == 2
+    assert reports[0] == reports[1] != reports[2]
+    # The execution folders are removed once all requests are done
+    assert not any(output_dir.exists() for output_dir in calls)
+
+    # A finished execution is not reused
+    await request("a")
+    assert len(calls) == 3
+
+
+async def test_deduplicator_start():
+    deduplicator = ExecutionDeduplicator()
+    slot = asyncio.Event()
+    started = []
+
+    async def generate(output_dir):
+        await slot.wait()
+        deduplicator.start("a")
+        await asyncio.sleep(0.1)
+        return output_dir
+
+    async def request(on_start):
+        async with deduplicator.share("a", generate, on_start=on_start):
+            pass
+
+    first = asyncio.ensure_future(request(lambda: started.append("first")))
+    cancelled = asyncio.ensure_future(request(lambda: started.append("cancelled")))
+    await asyncio.sleep(0.05)
+    assert started == []
+
+    # A request detached before the start is not notified
+    cancelled.cancel()
+    await asyncio.sleep(0.05)
+    slot.set()
+    await asyncio.sleep(0.05)
+    assert started == ["first"]
+
+    # A request joining a started execution is notified immediately
+    await request(lambda: started.append("second"))
+    await first
+    assert started == ["first", "second"]
+
+
+async def test_deduplicator_error():
+    deduplicator = ExecutionDeduplicator()
+    folders = []
+
+    async def generate(output_dir):
+        folders.append(output_dir)
+        (output_dir / "notebook.ipynb").write_text("{}")
+        await asyncio.sleep(0.1)
+        raise ValueError("Broken")
+
+    async def request():
+        async with deduplicator.share("a", generate):
+            pass
+
+    results = await asyncio.gather(request(), request(), return_exceptions=True)
+
+    assert all(isinstance(r, ValueError) for r in results)
+    # The folder of the failed execution is removed
+    assert not folders[0].exists()
+    with pytest.raises(ValueError):
+        await request()
+
+
+async def test_deduplicator_cancel():
+    deduplicator = ExecutionDeduplicator()
+    started = asyncio.Event()
+    cancelled = asyncio.Event()
+    folders = []
+
+    async def generate(output_dir):
+        folders.append(output_dir)
+        started.set()
+        try:
+            await asyncio.sleep(60)
+        except asyncio.CancelledError:
+            cancelled.set()
+            raise
+
+    async def request():
+        async with deduplicator.share("a", generate):
+            pass
+
+    first = asyncio.ensure_future(request())
+    second = asyncio.ensure_future(request())
+    await started.wait()
+
+    # The execution continues while a request is waiting for it
+    first.cancel()
+    await asyncio.sleep(0.1)
+    assert not cancelled.is_set()
+
+    second.cancel()
+    await asyncio.wait_for(cancelled.wait(), 1)
+    await asyncio.sleep(0.1)
+    assert not folders[0].exists()
+
+
+def is_running(pid):
+    try:
+        state = Path(f"/proc/{pid}/stat").read_text().rsplit(")", 1)[1].split()[0]
+    except FileNotFoundError:
+        return False
+    return state != "Z"
+
+
+@pytest.mark.skipif(not Path("/proc").exists(), reason="Requires /proc")
+async def test_execute_command_cancel(tmp_path):
+    pid_file = tmp_path / "pid"
+    task = asyncio.ensure_future(
+        _execute_command(["sh", "-c", f"sleep 60 & echo $! > {pid_file!s}; wait"], cwd=tmp_path)
+    )
+    for _ in range(50):
+        if pid_file.exists() and pid_file.read_text().strip():
+            break
+        await asyncio.sleep(0.1)
+    pid = int(pid_file.read_text())
+
+    task.cancel()
+    with pytest.raises(asyncio.CancelledError):
+        await task
+    await asyncio.sleep(0.1)
+
+    assert not is_running(pid)
+
+
+@pytest.mark.skipif(not Path("/proc").exists(), reason="Requires /proc")
+async def test_kernel_pool_executor_cancel(tmp_path):
+    pid_file = tmp_path / "pid"
+    template = tmp_path / "slow.ipynb"
+    notebook = new_notebook(
+        cells=[
+            new_code_cell(
+                f"import os, time\nopen({str(pid_file)!r}, 'w').write(str(os.getpid()))\ntime.sleep(60)"
+            ),
+        ],
+        metadata={"kernelspec": {"name": "python3", "language": "python", "display_name": "Python 3"}},
+    )
+    template.write_text(json.dumps(notebook))
+    pool = KernelPool(size=0)
+    executor = KernelPoolExecutor(pool)
+    try:
+        task = asyncio.ensure_future(
+            executor.execute(ReportJob(template, template.name, {}, ANONYMOUS_USER, tmp_path))
+        )
+        for _ in range(200):
+            if pid_file.exists() and pid_file.read_text():
+                break
+            await asyncio.sleep(0.1)
+        pid = int(pid_file.read_text())
+
+        task.cancel()
+        with pytest.raises(asyncio.CancelledError):
+            await task
+        await asyncio.sleep(0.5)
+
+        assert not is_running(pid)
+        assert not pool._kernels
+    finally:
+        pool.shutdown()
@@ -0,0 +1,126 @@
+import asyncio
+import json
+import os
+
+import nbformat
+import pytest
+from nbformat.v4 import new_code_cell, new_notebook
+from papermill.exceptions import PapermillExecutionError
+
+from papermill_report.execution import ExecutionError, ForkServerExecutor
+
+
+@pytest.fixture
+def write_template(notebook_metadata):
+    def write(path, setup, body):
+        notebook = new_notebook(
+            cells=[
+                new_code_cell(setup),
+                new_code_cell("name = 'world'", metadata={"tags": ["parameters"]}),
+                new_code_cell(body),
+            ],
+            metadata=notebook_metadata,
+        )
+        path.write_text(json.dumps(notebook))
+
+    return write
+
+
+async def test_forkserver_setup_executed_once(tmp_path, write_template, make_job):
+    counter = tmp_path / "setup_count"
+    template = tmp_path / "template.ipynb"
+    write_template(
+        template,
+        f"with open({str(counter)!r}, 'a') as f:\n    f.write('x')\nprint('setup')",
+        "f'Hello {name}!'",
+    )
+    executor = ForkServerExecutor()
+    try:
+        first = await executor.execute(make_job(template, {"name": "Alice"}, "first"))
+        second = await executor.execute(make_job(template, {"name": "Bob"}, "second"))
+    finally:
+        executor.shutdown()
+
+    assert counter.read_text() == "x"
+    assert "Hello Alice!" in first.read_text()
+    assert "Hello Bob!" in second.read_text()
+    notebook = nbformat.read(str(second.with_suffix(".ipynb")), as_version=4)
+    assert notebook.cells[0].outputs[0].text == "setup\n"
+    assert "injected-parameters" in notebook.cells[2].metadata.tags
+    assert notebook.cells[3].metadata.papermill["status"] == "completed"
+
+
+async def test_forkserver_template_change(tmp_path, write_template, make_job):
+    template = tmp_path / "template.ipynb"
+    write_template(template, "greeting = 'Hello'", "f'{greeting} {name}!'")
+    executor = ForkServerExecutor()
+    try:
+        first = await executor.execute(make_job(template, {}, "first"))
+        write_template(template, "greeting = 'Goodbye'", "f'{greeting} {name}!'")
+        second = await executor.execute(make_job(template, {}, "second"))
+    finally:
+        executor.shutdown()
+
+    assert "Hello world!" in first.read_text()
+    assert "Goodbye world!" in second.read_text()
+
+
+async def test_forkserver_error(tmp_path, write_template, make_job):
+    template = tmp_path / "template.ipynb"
+    write_template(template, "import os", "raise ValueError(name)")
+    executor = ForkServerExecutor()
+    try:
+        with pytest.raises(ExecutionError) as info:
+            await executor.execute(make_job(template, {"name": "boom"}, "error"))
+    finally:
+        executor.shutdown()
+
+    assert isinstance(info.value.error, PapermillExecutionError)
+    assert info.value.error.ename == "ValueError"
+    assert info.value.error.evalue == "boom"
+    notebook = nbformat.read(str(info.value.notebook), as_version=4)
+    assert notebook.cells[3].outputs[-1].output_type == "error"
+
+
+@pytest.mark.skipif(not os.path.exists("/proc"), reason="Requires /proc")
+async def test_forkserver_cancel(tmp_path, write_template, make_job):
+    pid_file = tmp_path / "pid"
+    template = tmp_path / "template.ipynb"
+    write_template(
+        template,
+        "import os, time",
+        f"open({str(pid_file)!r}, 'w').write(str(os.getpid()))\ntime.sleep(60)",
+    )
+    executor = ForkServerExecutor()
+    try:
+        task = asyncio.ensure_future(executor.execute(make_job(template, {}, "cancel")))
+        for _ in range(100):
+            if pid_file.exists() and pid_file.read_text():
+                break
+            await asyncio.sleep(0.1)
+        pid = int(pid_file.read_text())
+
+        task.cancel()
+        with pytest.raises(asyncio.CancelledError):
+            await task
+        for _ in range(50):  # The server reaps its children every second
+            if not os.path.exists(f"/proc/{pid}"):
+                break
+            await asyncio.sleep(0.1)
+        assert not os.path.exists(f"/proc/{pid}")
+    finally:
+        executor.shutdown()
+
+
+async def test_forkserver_process_died(tmp_path, write_template, make_job):
+    template = tmp_path / "template.ipynb"
+    write_template(template, "import os", "os._exit(1)")
+    executor = ForkServerExecutor()
+    try:
+        with pytest.raises(ExecutionError) as info:
+            await executor.execute(make_job(template, {}, "died"))
+    finally:
+        executor.shutdown()
+
+    assert isinstance(info.value.error, RuntimeError)
+    assert "The execution process died." in str(info.value.error)
@@ -0,0 +1,49 @@
+from subprocess import check_output
+
+import pytest
+
+from papermill_report.gitobjects import GitObjectStore
+
+
+def head(repository) -> str:
+    return check_output(["git", "rev-parse", "HEAD"], cwd=str(repository)).decode().strip()
+
+
+async def test_list_notebooks(git_project):
+    (git_project / "data.csv").write_text("a,b\n")
+    store = GitObjectStore(str(git_project))
+
+    notebooks = await store.list_notebooks(head(git_project))
+
+    assert list(notebooks) == ["notebook1.ipynb", "subfolder/notebook2.ipynb"]
+    assert all(len(blob) == 40 for blob in notebooks.values())
+
+
+async def test_list_notebooks_subfolder(git_project):
+    store = GitObjectStore(str(git_project))
+
+    notebooks = await store.list_notebooks(head(git_project), "subfolder")
+
+    assert list(notebooks) == ["notebook2.ipynb"]
+
+
+async def test_read(git_project):
+    store = GitObjectStore(str(git_project))
+    notebooks = await store.list_notebooks(head(git_project))
+    try:
+        contents = [await store.read(blob) for blob in notebooks.values()]
+        process = store._process
+        assert contents == [
+            (git_project / "notebook1.ipynb").read_bytes(),
+            (git_project / "subfolder" / "notebook2.ipynb").read_bytes(),
+        ]
+
+        # The git process is reused
+        await store.read(notebooks["notebook1.ipynb"])
+        assert store._process is process
+
+        with pytest.raises(KeyError):
+            await store.read("0" * 40)
+    finally:
+        store.close()
+    assert store._process is None
@@ -0,0 +1,234 @@
+import asyncio
+import json
+import time
+from concurrent.futures import ThreadPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from subprocess import check_call, check_output
+from unittest.mock import patch
+
+from nbformat.v4 import new_code_cell, new_notebook
+
+from papermill_report.gitobjects import GitObjectStore
+from papermill_report.index import TemplateIndex, _inspect_notebook, _inspect_notebook_content
+
+
+async def test_list_templates(git_project):
+    index = TemplateIndex()
+
+    templates = await index.list_templates(git_project)
+
+    assert [t["path"] for t in templates] == [
+        "notebook1.ipynb",
+        "subfolder/notebook2.ipynb",
+    ]
+    assert templates[0]["parameters"] == [
+        {"default": "2", "help": "Beautiful", "inferred_type_name": "int", "name": "a"}
+    ]
+
+
+async def test_list_templates_executor(git_project):
+    executor = ThreadPoolExecutor(2)
+    index = TemplateIndex(executor=executor)
+
+    with patch.object(executor, "submit", wraps=executor.submit) as submit:
+        templates = await index.list_templates(git_project)
+
+    assert len(templates) == 2
+    assert submit.call_count == 2
+    assert {c.args[1] for c in submit.call_args_list} == {
+        str(git_project / t["path"]) for t in templates
+    }
+
+
+async def test_list_templates_incremental(git_project):
+    index = TemplateIndex()
+    await index.list_templates(git_project)
+
+    nb = git_project / "notebook1.ipynb"
+    nb.write_text(
+        json.dumps(
+            new_notebook(
+                cells=[new_code_cell("c = 3", metadata={"tags": ["parameters"]})],
+                metadata={
+                    "kernelspec": {
+                        "name": "python3",
+                        "language": "python",
+                        "display_name": "Python 3",
+                    }
+                },
+            )
+        )
+    )
+    (git_project / "subfolder" / "notebook2.ipynb").unlink()
+
+    with patch(
+        "papermill_report.index._inspect_notebook", wraps=_inspect_notebook
+    ) as inspect:
+        templates = await index.list_templates(git_project)
+
+    inspect.assert_called_once_with(str(nb))
+    assert templates == [
+        {
+            "path": "notebook1.ipynb",
+            "parameters": [
+                {"default": "3", "help": "", "inferred_type_name": "None", "name": "c"}
+            ],
+        }
+    ]
+
+
+async def test_index_persistence(tmp_path, git_project):
+    index_file = tmp_path / "index.json"
+    templates = await TemplateIndex(str(index_file)).list_templates(git_project)
+    assert index_file.exists()
+
+    with patch("papermill_report.index._inspect_notebook") as inspect:
+        assert await TemplateIndex(str(index_file)).list_templates(git_project) == templates
+
+    inspect.assert_not_called()
+
+
+async def test_index_corrupted_file(tmp_path, git_project):
+    index_file = tmp_path / "index.json"
+    index_file.write_text("{not json")
+
+    templates = await TemplateIndex(str(index_file)).list_templates(git_project)
+
+    assert len(templates) == 2
+    assert json.loads(index_file.read_text())["version"] == 1
+
+
+async def test_list_templates_generation(git_project):
+    index = TemplateIndex()
+    templates = await index.list_templates(git_project, generation="commit1")
+
+    (git_project / "subfolder" / "notebook2.ipynb").unlink()
+
+    assert await index.list_templates(git_project, generation="commit1") == templates
+    assert len(await index.list_templates(git_project, generation="commit2")) == 1
+
+
+async def test_list_git_templates(tmp_path, git_project):
+    index_file = tmp_path / "index.json"
+    store = GitObjectStore(str(git_project))
+    index = TemplateIndex(str(index_file), object_store=store)
+    commit = check_output(["git", "rev-parse", "HEAD"], cwd=str(git_project)).decode().strip()
+    try:
+        templates = await index.list_git_templates(commit)
+
+        assert [t["path"] for t in templates] == ["notebook1.ipynb", "subfolder/notebook2.ipynb"]
+        assert templates[0]["parameters"] == [
+            {"default": "2", "help": "Beautiful", "inferred_type_name": "int", "name": "a"}
+        ]
+
+        # Uncommitted changes are ignored
+        (git_project / "notebook1.ipynb").unlink()
+        (git_project / "notebook3.ipynb").write_text("{}")
+        with patch.object(store, "list_notebooks", wraps=store.list_notebooks) as list_notebooks:
+            assert await index.list_git_templates(commit) == templates
+        list_notebooks.assert_not_called()
+
+        # Only the modified notebooks are inspected at a new commit
+        check_call(["git", "checkout", "--", "notebook1.ipynb"], cwd=str(git_project))
+        (git_project / "notebook3.ipynb").unlink()
+        notebook2 = git_project / "subfolder" / "notebook2.ipynb"
+        notebook2.write_text(notebook2.read_text().replace("The famous B", "The new B"))
+        check_call(["git", "commit", "-qam", "Update"], cwd=str(git_project))
+        new_commit = check_output(["git", "rev-parse", "HEAD"], cwd=str(git_project))
+        with patch(
+            "papermill_report.index._inspect_notebook_content", wraps=_inspect_notebook_content
+        ) as inspect:
+            templates = await index.list_git_templates(new_commit.decode().strip())
+
+        assert inspect.call_count == 1
+        assert templates[1]["parameters"][0]["default"] == "'The new B'"
+        assert await TemplateIndex(str(index_file)).list_git_templates(
+            new_commit.decode().strip()
+        ) == templates
+    finally:
+        store.close()
+
+
+async def test_update_templates(git_project):
+    index = TemplateIndex()
+    await index.list_templates(git_project)
+    index.watch(git_project)
+
+    (git_project / "subfolder" / "notebook2.ipynb").unlink()
+    (git_project / "notebook1.ipynb").rename(git_project / "renamed.ipynb")
+    with patch("papermill_report.index._scan_folder", side_effect=AssertionError):
+        # Listings of a watched folder are served from memory
+        assert len(await index.list_templates(git_project)) == 2
+
+        with patch(
+            "papermill_report.index._inspect_notebook", wraps=_inspect_notebook
+        ) as inspect:
+            await index.update_templates(
+                git_project, ["notebook1.ipynb", "renamed.ipynb", "subfolder/notebook2.ipynb"]
+            )
+        templates = await index.list_templates(git_project)
+
+    inspect.assert_not_called()  # Same content
+    assert [t["path"] for t in templates] == ["renamed.ipynb"]
+    assert templates[0]["parameters"][0]["name"] == "a"
+
+    await index.update_templates(git_project, ["subfolder"])
+    assert [t["path"] for t in await index.list_templates(git_project)] == ["renamed.ipynb"]
+
+
+async def test_list_templates_concurrent_broken_notebook(tmp_path):
+    (tmp_path / "broken.ipynb").write_text("not JSON")
+
+    def slow_inspection(path):
+        time.sleep(0.2)
+        return _inspect_notebook(path)
+
+    index = TemplateIndex()
+    with patch("papermill_report.index._inspect_notebook", side_effect=slow_inspection) as inspect:
+        listings = await asyncio.gather(
+            index.list_templates(tmp_path), index.list_templates(tmp_path)
+        )
+
+    assert inspect.call_count == 1
+    assert listings == [[{"path": "broken.ipynb", "parameters": []}]] * 2
+
+
+async def test_digest(git_project):
+    index = TemplateIndex()
+    assert index.digest(git_project) is None
+
+    await index.list_templates(git_project)
+    digest = index.digest(git_project)
+    await index.list_templates(git_project)
+    assert index.digest(git_project) == digest
+
+    (git_project / "subfolder" / "notebook2.ipynb").rename(git_project / "renamed.ipynb")
+    await index.list_templates(git_project)
+    assert index.digest(git_project) != digest
+
+
+async def test_list_templates_transient_error(git_project):
+    index = TemplateIndex()
+
+    with patch("papermill_report.index._inspect_notebook", side_effect=OSError("busy")):
+        templates = await index.list_templates(git_project)
+    assert [t["parameters"] for t in templates] == [[], []]
+
+    # The failed inspections are not recorded
+    templates = await index.list_templates(git_project)
+    assert [p["name"] for p in templates[0]["parameters"]] == ["a"]
+
+
+async def test_list_templates_broken_process_pool(git_project):
+    broken = ThreadPoolExecutor(1)
+    replacement = ThreadPoolExecutor(1)
+    index = TemplateIndex(executor=broken, make_executor=lambda: replacement)
+
+    with patch("papermill_report.index._inspect_notebook", side_effect=BrokenProcessPool()):
+        templates = await index.list_templates(git_project)
+    assert [t["parameters"] for t in templates] == [[], []]
+    assert index.executor is replacement
+
+    templates = await index.list_templates(git_project)
+    assert [p["name"] for p in templates[0]["parameters"]] == ["a"]
+    replacement.shutdown()
@@ -0,0 +1,133 @@
+import io
+import json
+from pathlib import Path
+from unittest.mock import patch
+
+import nbformat
+import papermill as pm
+import pytest
+from nbformat.v4 import new_code_cell, new_markdown_cell, new_notebook, new_output
+
+from papermill_report.inspection import _JsonStream, inspect_notebook, read_parameters_cell
+
+EXAMPLES = sorted((Path(__file__).parents[2] / "examples").glob("**/*.ipynb"))
+
+KERNELSPEC = {"name": "python3", "language": "python", "display_name": "Python 3"}
+
+
+def write_notebook(path: Path, cells, metadata=None) -> str:
+    metadata = {"kernelspec": KERNELSPEC} if metadata is None else metadata
+    path.write_text(json.dumps(new_notebook(cells=cells, metadata=metadata)))
+    return str(path)
+
+
+@pytest.mark.parametrize("notebook", EXAMPLES, ids=lambda p: p.name)
+def test_inspect_notebook_same_as_papermill(notebook):
+    assert inspect_notebook(str(notebook)) == pm.inspect_notebook(str(notebook))
+
+
+def test_inspect_notebook_skips_outputs(tmp_path):
+    outputs = [new_output("stream", name="stdout", text='"\\}]ü' * 10000)]
+    path = write_notebook(
+        tmp_path / "heavy.ipynb",
+        [
+            new_markdown_cell("# Title"),
+            new_code_cell("import os", outputs=outputs),
+            new_code_cell(
+                'msg = "hello"  # Message\nn = 2', metadata={"tags": ["parameters"]}, outputs=outputs
+            ),
+            new_code_cell("print(msg)", outputs=outputs),
+        ],
+    )
+
+    with patch("papermill_report.inspection.pm.inspect_notebook") as papermill:
+        parameters = inspect_notebook(path)
+
+    papermill.assert_not_called()
+    assert parameters == pm.inspect_notebook(path)
+    assert list(parameters) == ["msg", "n"]
+    assert parameters["msg"]["help"] == "Message"
+
+
+@pytest.mark.parametrize("chunk_size", [1, 3, 7, 64])
+def test_read_parameters_cell_chunks(tmp_path, chunk_size):
+    cell = new_code_cell('a = "\\u00e9\\"]"', metadata={"tags": ["parameters"]})
+    path = write_notebook(
+        tmp_path / "notebook.ipynb",
+        [
+            new_code_cell(
+                "x = [1, {}]",
+                outputs=[new_output("execute_result", {"text/plain": '[\\"]'}, execution_count=1)],
+            ),
+            cell,
+        ],
+    )
+
+    parameters_cell, metadata = read_parameters_cell(path, chunk_size)
+
+    assert parameters_cell["source"] == cell["source"]
+    assert "outputs" not in parameters_cell
+    assert metadata == {"kernelspec": KERNELSPEC}
+
+
+def test_read_parameters_cell_stops_reading(tmp_path):
+    content = (
+        '{"metadata": {"kernelspec": {"name": "python3"}}, "nbformat": 4, "cells": ['
+        '{"cell_type": "code", "metadata": {"tags": ["parameters"]}, "source": "a = 1"}, '
+        "not JSON"
+    )
+    path = tmp_path / "notebook.ipynb"
+    path.write_text(content)
+
+    parameters_cell, metadata = read_parameters_cell(str(path))
+
+    assert parameters_cell["source"] == "a = 1"
+    assert metadata == {"kernelspec": {"name": "python3"}}
+
+
+def test_inspect_notebook_without_parameters(tmp_path):
+    path = write_notebook(tmp_path / "notebook.ipynb", [new_code_cell("a = 1")])
+
+    assert inspect_notebook(path) == {}
+
+
+def test_inspect_notebook_fallback(tmp_path):
+    notebook = nbformat.v3.new_notebook(
+        worksheets=[
+            nbformat.v3.new_worksheet(
+                cells=[nbformat.v3.new_code_cell("a = 1", metadata={"tags": ["parameters"]})]
+            )
+        ],
+        metadata={"kernelspec": KERNELSPEC},
+    )
+    path = tmp_path / "notebook.ipynb"
+    path.write_text(nbformat.writes(notebook, version=3))
+
+    with patch(
+        "papermill_report.inspection.pm.inspect_notebook", wraps=pm.inspect_notebook
+    ) as papermill:
+        parameters = inspect_notebook(str(path))
+
+    papermill.assert_called_once_with(str(path))
+    assert list(parameters) == ["a"]
+
+
+def test_inspect_notebook_invalid(tmp_path):
+    path = tmp_path / "notebook.ipynb"
+    path.write_text('{"cells": [')
+
+    with pytest.raises(Exception):
+        inspect_notebook(str(path))
+
+
+def test_json_stream_skip_and_read():
+    reader = _JsonStream(io.StringIO('{"a": [1, {"b": "}"}], "c": -1.5e3, "d": null}'), 2)
+
+    values = {}
+    for key in reader.iter_object():
+        if key == "a":
+            reader.skip_value()
+        else:
+            values[key] = reader.read_value()
+
+    assert values == {"c": -1500.0, "d": None}
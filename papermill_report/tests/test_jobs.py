@@ -0,0 +1,101 @@
+import asyncio
+import json
+import time
+
+from papermill_report.jobs import (
+    CANCELLED,
+    COMPLETED,
+    FAILED,
+    PENDING,
+    RUNNING,
+    Job,
+    JobError,
+    JobStore,
+)
+
+
+async def test_job_store_completed(tmp_path):
+    store = JobStore(str(tmp_path / "jobs"), 60)
+    report = tmp_path / "report.html"
+    report.write_text("Hello")
+
+    async def run(job):
+        await store.save_report(job, report)
+
+    job = store.submit("template.ipynb", {"a": 1}, "user", run)
+    await asyncio.sleep(0.1)
+    assert job.status == COMPLETED
+    assert store.report(job).read_text() == "Hello"
+
+    # Finished jobs survive a restart
+    reloaded = JobStore(str(tmp_path / "jobs"), 60)
+    assert reloaded.get(job.id).to_dict() == job.to_dict()
+    assert reloaded.report(job).read_text() == "Hello"
+    assert [j.id for j in reloaded.list_jobs("user")] == [job.id]
+    assert reloaded.list_jobs("other") == []
+
+
+async def test_job_store_pending(tmp_path):
+    store = JobStore(str(tmp_path / "jobs"), 60)
+    slot = asyncio.Event()
+    release = asyncio.Event()
+
+    async def run(job):
+        await slot.wait()
+        store.start(job)
+        await release.wait()
+
+    job = store.submit("template.ipynb", {}, "user", run)
+    await asyncio.sleep(0.1)
+    # The job is pending until its execution starts
+    assert job.status == PENDING and job.started is None
+
+    slot.set()
+    await asyncio.sleep(0.1)
+    assert job.status == RUNNING and job.started is not None
+    assert JobStore(str(tmp_path / "jobs"), 60).get(job.id).started == job.started
+
+    release.set()
+    await asyncio.sleep(0.1)
+    assert job.status == COMPLETED
+
+
+async def test_job_store_failed(tmp_path):
+    store = JobStore(str(tmp_path / "jobs"), 60)
+
+    async def run(job):
+        raise JobError({"message": "Broken"})
+
+    job = store.submit("template.ipynb", {}, "user", run)
+    await asyncio.sleep(0.1)
+    assert job.status == FAILED
+    assert job.error == {"message": "Broken"}
+
+
+async def test_job_store_cancel(tmp_path):
+    store = JobStore(str(tmp_path / "jobs"), 60)
+
+    async def run(job):
+        await asyncio.sleep(10)
+
+    job = store.submit("template.ipynb", {}, "user", run)
+    await asyncio.sleep(0.1)
+    assert store.cancel(job)
+    await asyncio.sleep(0.1)
+    assert job.status == CANCELLED
+    assert not store.cancel(job)
+
+
+def test_job_store_restart(tmp_path):
+    jobs_dir = tmp_path / "jobs"
+    jobs_dir.mkdir()
+    running = Job("1", "template.ipynb", {}, "user", status="running")
+    expired = Job("2", "template.ipynb", {}, "user", status="completed", finished=time.time() - 120)
+    for job in (running, expired):
+        (jobs_dir / (job.id + ".json")).write_text(json.dumps(job.to_dict()))
+
+    store = JobStore(str(jobs_dir), 60)
+
+    assert store.get("1").status == FAILED
+    assert store.get("2") is None
+    assert not (jobs_dir / "2.json").exists()
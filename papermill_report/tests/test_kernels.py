@@ -0,0 +1,33 @@
+import asyncio
+
+from papermill_report.kernels import KernelPool
+from papermill_report.utils import ANONYMOUS_USER
+
+
+async def wait_idle(pool, key, count):
+    for _ in range(300):
+        if len(pool._idle[key]) == count and not pool._starting[key]:
+            return
+        await asyncio.sleep(0.1)
+
+
+async def test_kernel_pool_reuse():
+    pool = KernelPool(size=1, max_uses=2, startup_code="started = True")
+    key = ("python3", None)
+    try:
+        first = await pool.acquire("python3", ANONYMOUS_USER)
+        assert first.manager.is_alive()
+        pool.release(first)
+        await wait_idle(pool, key, 1)
+
+        second = await pool.acquire("python3", ANONYMOUS_USER)
+        assert second is first  # Reused once
+        pool.release(second)
+        await wait_idle(pool, key, 1)
+
+        third = await pool.acquire("python3", ANONYMOUS_USER)
+        assert third is not first  # Maximal number of uses reached
+        assert third.manager.is_alive()
+        pool.release(third)
+    finally:
+        pool.shutdown()
@@ -0,0 +1,58 @@
+from prometheus_client.parser import text_string_to_metric_families
+
+from papermill_report.metrics import GIT_SYNC, SUCCESS, ReportMetrics
+from papermill_report.scheduler import ExecutionScheduler
+
+
+def samples(metrics):
+    return {
+        (sample.name, tuple(sorted(sample.labels.items()))): sample.value
+        for family in text_string_to_metric_families(metrics.export().decode("utf-8"))
+        for sample in family.samples
+    }
+
+
+def test_phase_duration():
+    metrics = ReportMetrics()
+    metrics.observe(GIT_SYNC, 0.3)
+    metrics.observe(GIT_SYNC, 0.01)
+
+    values = samples(metrics)
+    phase = (("phase", GIT_SYNC),)
+    assert values[("papermill_report_phase_duration_seconds_count", phase)] == 2
+    assert values[("papermill_report_phase_duration_seconds_bucket", (("le", "0.25"),) + phase)] == 1
+    assert values[("papermill_report_phase_duration_seconds_bucket", (("le", "0.5"),) + phase)] == 2
+
+
+def test_counters():
+    metrics = ReportMetrics()
+    metrics.record_report("a.ipynb", SUCCESS)
+    metrics.record_report("a.ipynb", SUCCESS)
+    metrics.record_broken("b.ipynb")
+    metrics.record_cache("report", True)
+    metrics.record_cache("report", False, 3)
+    metrics.record_cache("report", False, 0)
+
+    values = samples(metrics)
+    assert values[
+        ("papermill_report_reports_total", (("status", SUCCESS), ("template", "a.ipynb")))
+    ] == 2
+    assert values[("papermill_report_broken_reports_total", (("template", "b.ipynb"),))] == 1
+    assert values[
+        ("papermill_report_cache_requests_total", (("cache", "report"), ("result", "hit")))
+    ] == 1
+    assert values[
+        ("papermill_report_cache_requests_total", (("cache", "report"), ("result", "miss")))
+    ] == 3
+
+
+async def test_track_scheduler():
+    metrics = ReportMetrics()
+    scheduler = ExecutionScheduler(1)
+    metrics.track_scheduler(scheduler)
+
+    async with scheduler.slot("alice"):
+        values = samples(metrics)
+    assert values[("papermill_report_running_executions", ())] == 1
+    assert values[("papermill_report_queued_executions", ())] == 0
+    assert samples(metrics)[("papermill_report_running_executions", ())] == 0
@@ -0,0 +1,73 @@
+import json
+
+from nbformat.v4 import new_code_cell, new_markdown_cell, new_notebook
+
+from papermill_report.profiles import CellProfiles, percentile, read_cell_durations
+
+
+def make_notebook(path, durations):
+    cells = [new_markdown_cell("# Title")]
+    for index, duration in enumerate(durations):
+        cell = new_code_cell(f"# Step {index}\nx = {index}")
+        if duration is not None:
+            cell.metadata["papermill"] = {"status": "completed", "duration": duration}
+        cells.append(cell)
+    path.write_text(json.dumps(new_notebook(cells=cells)))
+    return path
+
+
+def test_read_cell_durations(tmp_path):
+    notebook = make_notebook(tmp_path / "executed.ipynb", [0.5, None, 2.0])
+    assert read_cell_durations(notebook) == [
+        {"index": 1, "source": "# Step 0", "duration": 0.5},
+        {"index": 3, "source": "# Step 2", "duration": 2.0},
+    ]
+
+
+def test_percentile():
+    assert percentile([], 50) is None
+    values = list(range(1, 101))
+    assert percentile(values, 50) == 50
+    assert percentile(values, 95) == 95
+    assert percentile([3.0], 95) == 3.0
+
+
+def test_profiles(tmp_path):
+    profiles_file = tmp_path / "profiles.json"
+    profiles = CellProfiles(str(profiles_file), max_versions=2, max_samples=3)
+    assert profiles.get("a.ipynb") is None
+
+    for duration in (1.0, 2.0, 3.0, 4.0):
+        profiles.add("a.ipynb", "blob1", [{"index": 1, "source": "x = 1", "duration": duration}], "c1")
+    profiles.add("a.ipynb", "blob2", [{"index": 1, "source": "x = 2", "duration": 10.0}], "c2")
+
+    profile = profiles.get("a.ipynb")
+    assert [v["blob"] for v in profile["versions"]] == ["blob2", "blob1"]
+    oldest = profile["versions"][1]
+    assert oldest["runs"] == 4
+    assert oldest["commit"] == "c1"
+    # Only the last samples are kept
+    assert oldest["cells"] == [{"index": 1, "source": "x = 1", "samples": 3, "p50": 3.0, "p95": 4.0}]
+    assert oldest["total"] == {"samples": 3, "p50": 3.0, "p95": 4.0}
+
+    profiles.add("a.ipynb", "blob3", [{"index": 1, "source": "x = 3", "duration": 1.0}])
+    assert [v["blob"] for v in profiles.get("a.ipynb")["versions"]] == ["blob3", "blob2"]
+
+    # Profiles are reloaded from disk
+    listing = CellProfiles(str(profiles_file)).list_profiles()
+    assert [p["template"] for p in listing] == ["a.ipynb"]
+    assert "cells" not in listing[0]["versions"][0]
+
+
+async def test_record(tmp_path):
+    template = make_notebook(tmp_path / "template.ipynb", [None])
+    executed = make_notebook(tmp_path / "executed.ipynb", [0.5])
+    profiles = CellProfiles()
+
+    await profiles.record("template.ipynb", template, executed, "commit")
+    await profiles.record("template.ipynb", template, tmp_path / "missing.ipynb", "commit")
+
+    versions = profiles.get("template.ipynb")["versions"]
+    assert len(versions) == 1
+    assert versions[0]["runs"] == 1
+    assert versions[0]["cells"][0]["p50"] == 0.5
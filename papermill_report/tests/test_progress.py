@@ -0,0 +1,66 @@
+import json
+
+from nbformat.v4 import new_code_cell, new_markdown_cell, new_notebook, new_output
+
+from papermill_report.progress import ProgressTracker, read_cells, render_outputs
+
+
+def write_notebook(path, statuses):
+    cells = [new_markdown_cell("# Title")]
+    for status in statuses:
+        cell = new_code_cell("print('hello')")
+        cell.metadata["papermill"] = {"status": status, "duration": 1.5 if status == "completed" else None}
+        if status == "completed":
+            cell.outputs = [new_output("stream", name="stdout", text="hello <world>\n")]
+        cells.append(cell)
+    path.write_text(json.dumps(new_notebook(cells=cells)))
+
+
+def test_read_cells(tmp_path):
+    notebook = tmp_path / "report.ipynb"
+    write_notebook(notebook, ["completed", "running", "pending"])
+
+    cells = read_cells(notebook)
+
+    assert [(c["index"], c["status"], c["duration"]) for c in cells] == [
+        (1, "completed", 1.5),
+        (2, "running", None),
+        (3, "pending", None),
+    ]
+
+
+def test_render_outputs():
+    outputs = [
+        new_output("stream", name="stdout", text="a < b\n"),
+        new_output("display_data", data={"text/html": "<b>bold</b>", "text/plain": "bold"}),
+        new_output("display_data", data={"image/png": "iVBORw0KGgo=\n", "text/plain": "figure"}),
+        new_output("error", ename="ValueError", evalue="boom", traceback=["\x1b[0;31mValueError\x1b[0m: boom"]),
+    ]
+
+    html = render_outputs(outputs)
+
+    assert "<pre>a &lt; b\n</pre>" in html
+    assert "<b>bold</b>" in html
+    assert '<img src="data:image/png;base64,iVBORw0KGgo="/>' in html
+    assert "<pre>ValueError: boom</pre>" in html
+
+
+async def test_progress_tracker(tmp_path):
+    notebook = tmp_path / "report.ipynb"
+    tracker = ProgressTracker(interval=0.05)
+
+    async with tracker.track("key", notebook) as progress:
+        assert tracker.get("key") is progress
+        await progress.wait(0.1)
+        assert progress.cells == []  # Not created yet
+
+        write_notebook(notebook, ["running", "pending"])
+        await progress.wait(1)
+        assert [c["status"] for c in progress.cells] == ["running", "pending"]
+
+        write_notebook(notebook, ["completed", "completed"])
+
+    # The final notebook is read when the execution ends
+    assert progress.finished
+    assert [c["status"] for c in progress.cells] == ["completed", "completed"]
+    assert tracker.get("key") is None
@@ -0,0 +1,103 @@
+import asyncio
+from subprocess import check_call, check_output
+from unittest.mock import patch
+
+from papermill_report.repository import TemplateRepository
+from papermill_report.utils import update_git_repository
+
+
+async def test_sync_commit(template_root_dir, git_project):
+    repository = TemplateRepository(str(template_root_dir), git_url=str(git_project))
+
+    commit = await repository.sync()
+
+    assert commit == check_output(["git", "rev-parse", "HEAD"], cwd=str(git_project)).decode().strip()
+    assert repository.commit == commit
+    assert (template_root_dir / "notebook1.ipynb").exists()
+
+
+async def test_sync_single_flight(template_root_dir, git_project):
+    repository = TemplateRepository(str(template_root_dir), git_url=str(git_project))
+
+    with patch(
+        "papermill_report.repository.update_git_repository", wraps=update_git_repository
+    ) as update:
+        commits = await asyncio.gather(*(repository.sync() for _ in range(5)))
+
+    update.assert_called_once()
+    assert len(set(commits)) == 1
+
+
+async def test_sync_ttl(template_root_dir, git_project):
+    repository = TemplateRepository(str(template_root_dir), git_url=str(git_project), ttl=3600)
+
+    with patch(
+        "papermill_report.repository.update_git_repository", wraps=update_git_repository
+    ) as update:
+        await repository.sync()
+        await repository.sync()
+        assert update.call_count == 1
+
+        await repository.sync(force=True)
+        assert update.call_count == 2
+
+
+async def test_sync_without_git(template_root_dir):
+    repository = TemplateRepository(str(template_root_dir), "templates")
+
+    assert await repository.sync() is None
+    assert (template_root_dir / "templates").is_dir()
+
+
+async def test_poll(template_root_dir, git_project):
+    repository = TemplateRepository(
+        str(template_root_dir), git_url=str(git_project), background_sync=True
+    )
+    await repository.poll()
+    first_commit = repository.commit
+    assert first_commit is not None
+
+    with patch.object(repository, "sync", wraps=repository.sync) as sync:
+        await repository.poll()
+        sync.assert_not_called()
+        assert await repository.refresh() == first_commit
+        sync.assert_not_called()
+
+    (git_project / "notebook3.ipynb").write_text((git_project / "notebook1.ipynb").read_text())
+    check_call(["git", "add", "-A"], cwd=str(git_project))
+    check_call(["git", "commit", "-m", "New notebook"], cwd=str(git_project))
+
+    await repository.poll()
+
+    assert repository.commit != first_commit
+    assert (template_root_dir / "notebook3.ipynb").exists()
+
+
+async def test_snapshots(tmp_path, template_root_dir, git_project):
+    snapshots_dir = tmp_path / "snapshots"
+    repository = TemplateRepository(
+        str(template_root_dir), git_url=str(git_project), snapshots_dir=str(snapshots_dir)
+    )
+    first_commit = await repository.sync()
+
+    with repository.checkout() as first_snapshot:
+        assert first_snapshot == snapshots_dir / first_commit
+        assert (first_snapshot / "notebook1.ipynb").exists()
+
+        (git_project / "notebook1.ipynb").unlink()
+        check_call(["git", "commit", "-am", "Remove notebook"], cwd=str(git_project))
+        second_commit = await repository.sync()
+
+        # The running execution keeps its snapshot
+        assert (first_snapshot / "notebook1.ipynb").exists()
+        with repository.checkout() as second_snapshot:
+            assert second_snapshot == snapshots_dir / second_commit
+            assert not (second_snapshot / "notebook1.ipynb").exists()
+
+    # Let the unused snapshot be removed
+    for _ in range(50):
+        if not first_snapshot.exists():
+            break
+        await asyncio.sleep(0.1)
+    assert not first_snapshot.exists()
+    assert (snapshots_dir / second_commit).exists()
@@ -0,0 +1,116 @@
+import asyncio
+
+import pytest
+
+from papermill_report.scheduler import BATCH, INTERACTIVE, ExecutionScheduler, QueueFull
+
+
+async def run(scheduler, username, order, release, priority=INTERACTIVE, expected=None):
+    async with scheduler.slot(username, priority, expected):
+        order.append(username)
+        await release.wait()
+
+
+async def test_scheduler_round_robin():
+    scheduler = ExecutionScheduler(1)
+    order = []
+    release = asyncio.Event()
+    tasks = [
+        asyncio.ensure_future(run(scheduler, username, order, release))
+        for username in ("alice", "alice", "alice", "bob", "carol")
+    ]
+    await asyncio.sleep(0.01)
+    assert order == ["alice"]
+    assert scheduler.running == 1
+    assert scheduler.queued == 4
+
+    release.set()
+    await asyncio.gather(*tasks)
+    assert order == ["alice", "alice", "bob", "carol", "alice"]
+    assert scheduler.running == 0
+
+
+async def test_scheduler_user_limit():
+    scheduler = ExecutionScheduler(3, max_per_user=1)
+    order = []
+    release = asyncio.Event()
+    tasks = [
+        asyncio.ensure_future(run(scheduler, username, order, release))
+        for username in ("alice", "alice", "bob")
+    ]
+    await asyncio.sleep(0.01)
+    assert order == ["alice", "bob"]
+
+    release.set()
+    await asyncio.gather(*tasks)
+    assert order == ["alice", "bob", "alice"]
+
+
+async def test_scheduler_queue_full():
+    scheduler = ExecutionScheduler(1, max_queued=1)
+    order = []
+    release = asyncio.Event()
+    tasks = [
+        asyncio.ensure_future(run(scheduler, username, order, release))
+        for username in ("alice", "bob")
+    ]
+    await asyncio.sleep(0.01)
+    assert scheduler.full
+
+    with pytest.raises(QueueFull) as info:
+        await run(scheduler, "carol", order, release)
+    assert info.value.retry_after >= 1
+
+    release.set()
+    await asyncio.gather(*tasks)
+    assert order == ["alice", "bob"]
+
+
+async def test_scheduler_cancel_waiting():
+    scheduler = ExecutionScheduler(1)
+    order = []
+    release = asyncio.Event()
+    first = asyncio.ensure_future(run(scheduler, "alice", order, release))
+    second = asyncio.ensure_future(run(scheduler, "bob", order, release))
+    await asyncio.sleep(0.01)
+    second.cancel()
+    await asyncio.sleep(0.01)
+    assert scheduler.queued == 0
+
+    release.set()
+    await first
+    assert scheduler.running == 0
+
+
+async def test_scheduler_priority():
+    scheduler = ExecutionScheduler(1)
+    order = []
+    release = asyncio.Event()
+    tasks = [
+        asyncio.ensure_future(run(scheduler, username, order, release, priority))
+        for username, priority in (
+            ("first", INTERACTIVE),
+            ("nightly", BATCH),
+            ("dashboard", INTERACTIVE),
+        )
+    ]
+    await asyncio.sleep(0.01)
+
+    release.set()
+    await asyncio.gather(*tasks)
+    assert order == ["first", "dashboard", "nightly"]
+
+
+async def test_scheduler_shortest_first():
+    scheduler = ExecutionScheduler(1, shortest_first=True)
+    order = []
+    release = asyncio.Event()
+    tasks = [
+        asyncio.ensure_future(run(scheduler, username, order, release, expected=expected))
+        for username, expected in (("first", None), ("long", 600), ("medium", 60), ("quick", 2))
+    ]
+    await asyncio.sleep(0.01)
+
+    release.set()
+    await asyncio.gather(*tasks)
+    assert order == ["first", "quick", "medium", "long"]
@@ -0,0 +1,40 @@
+import pytest
+
+from papermill_report.stats import ExecutionStats
+
+
+def test_stats_record(tmp_path):
+    stats_file = tmp_path / "stats.json"
+    stats = ExecutionStats(str(stats_file), smoothing=0.5)
+    assert stats.expected_duration("a.ipynb") is None
+
+    stats.record("a.ipynb", 10.0)
+    stats.record("a.ipynb", 20.0)
+
+    assert stats.expected_duration("a.ipynb") == pytest.approx(15.0)
+    stats.record("b.ipynb", 5.0)
+    assert stats.expected_duration("unknown.ipynb") == pytest.approx(10.0)
+    assert stats.get("a.ipynb") == {"count": 2, "mean": 15.0, "last": 20.0}
+
+    # Statistics survive a restart
+    assert ExecutionStats(str(stats_file)).get("a.ipynb") == stats.get("a.ipynb")
+
+
+def test_stats_corrupted(tmp_path):
+    stats_file = tmp_path / "stats.json"
+    stats_file.write_text("{")
+
+    stats = ExecutionStats(str(stats_file))
+
+    assert stats.get("a.ipynb") == {}
+
+
+def test_stats_record_cancellation():
+    stats = ExecutionStats()
+
+    stats.record_cancellation("a.ipynb")
+    stats.record_cancellation("a.ipynb", timeout=True)
+    stats.record_cancellation("a.ipynb")
+
+    assert stats.get("a.ipynb") == {"count": 0, "mean": None, "cancelled": 2, "timeouts": 1}
+    assert stats.expected_duration("a.ipynb") is None
@@ -0,0 +1,69 @@
+import json
+import time
+
+from papermill_report.tracing import RequestTrace, TraceExporter
+
+
+class Context:
+    def __init__(self):
+        self.exited = False
+
+    async def __aenter__(self):
+        time.sleep(0.01)
+        return "value"
+
+    async def __aexit__(self, *args):
+        self.exited = True
+
+
+def test_span_tree():
+    trace = RequestTrace("GET /report.ipynb")
+    with trace.span("execution"):
+        trace.add("papermill", time.time(), 0.5)
+        trace.add("nbconvert", time.time(), 0.25)
+    with trace.span("response"):
+        timing = trace.server_timing(1.0)
+    trace.finish(1.5)
+
+    tree = trace.root.to_dict()
+    assert tree["duration"] == 1500
+    assert [child["name"] for child in tree["children"]] == ["execution", "response"]
+    assert [child["name"] for child in tree["children"][0]["children"]] == ["papermill", "nbconvert"]
+    # Running spans are not sent
+    names = [metric.split(";")[0] for metric in timing.split(", ")]
+    assert names == ["execution", "papermill", "nbconvert", "total"]
+    assert "papermill;dur=500.0" in timing
+    assert timing.endswith("total;dur=1000.0")
+
+
+async def test_span_entering():
+    trace = RequestTrace("GET /")
+    context = Context()
+    async with trace.span_entering("wait", context) as value:
+        assert value == "value"
+        assert trace.root.children[0].duration >= 0.01
+    assert context.exited
+
+
+def test_export(tmp_path):
+    trace_file = tmp_path / "traces" / "trace.json"
+    exporter = TraceExporter(str(trace_file))
+    for name in ("GET /a", "GET /b"):
+        trace = RequestTrace(name)
+        with trace.span("git_update"):
+            pass
+        trace.finish(0.1)
+        exporter.export(trace)
+
+    content = trace_file.read_text()
+    assert content.startswith("[\n")
+    # The closing bracket is optional in the trace event format
+    events = json.loads(content.rstrip().rstrip(",") + "]")
+    assert [(e["name"], e["tid"]) for e in events] == [
+        ("GET /a", 1),
+        ("git_update", 1),
+        ("GET /b", 2),
+        ("git_update", 2),
+    ]
+    assert all(e["ph"] == "X" for e in events)
+    assert events[0]["dur"] == 100000
@@ -0,0 +1,165 @@
+import asyncio
+import json
+import shutil
+import time
+from unittest.mock import patch
+
+from nbformat.v4 import new_code_cell, new_notebook
+
+from papermill_report.index import TemplateIndex, _scan_folder
+from papermill_report.watcher import TemplateWatcher
+
+KERNELSPEC = {"name": "python3", "language": "python", "display_name": "Python 3"}
+
+
+def write_notebook(path, parameters="a = 1"):
+    path.parent.mkdir(parents=True, exist_ok=True)
+    path.write_text(
+        json.dumps(
+            new_notebook(
+                cells=[new_code_cell(parameters, metadata={"tags": ["parameters"]})],
+                metadata={"kernelspec": KERNELSPEC},
+            )
+        )
+    )
+
+
+async def wait_for_listing(index, template_dir, expected, timeout=5.0):
+    deadline = time.monotonic() + timeout
+    while True:
+        templates = await index.list_templates(template_dir)
+        listing = {t["path"]: [p["name"] for p in t["parameters"]] for t in templates}
+        if listing == expected or time.monotonic() > deadline:
+            return listing
+        await asyncio.sleep(0.02)
+
+
+async def test_watcher(tmp_path):
+    template_dir = tmp_path / "templates"
+    write_notebook(template_dir / "notebook1.ipynb")
+    index = TemplateIndex()
+    watcher = TemplateWatcher(template_dir, index, delay=0.01)
+    await watcher.start()
+    try:
+        assert not watcher.polling
+        # The listings are served from memory
+        with patch("papermill_report.index._scan_folder", wraps=_scan_folder) as scan:
+            assert await wait_for_listing(index, template_dir, {"notebook1.ipynb": ["a"]}) == {
+                "notebook1.ipynb": ["a"]
+            }
+
+            # Added notebook
+            write_notebook(template_dir / "notebook2.ipynb", "b = 2")
+            expected = {"notebook1.ipynb": ["a"], "notebook2.ipynb": ["b"]}
+            assert await wait_for_listing(index, template_dir, expected) == expected
+
+            # Modified notebook
+            write_notebook(template_dir / "notebook1.ipynb", "c = 3")
+            expected = {"notebook1.ipynb": ["c"], "notebook2.ipynb": ["b"]}
+            assert await wait_for_listing(index, template_dir, expected) == expected
+
+            # Renamed notebook
+            (template_dir / "notebook2.ipynb").rename(template_dir / "renamed.ipynb")
+            expected = {"notebook1.ipynb": ["c"], "renamed.ipynb": ["b"]}
+            assert await wait_for_listing(index, template_dir, expected) == expected
+
+            # Removed notebook
+            (template_dir / "notebook1.ipynb").unlink()
+            expected = {"renamed.ipynb": ["b"]}
+            assert await wait_for_listing(index, template_dir, expected) == expected
+
+            # Folder moved in, modified then moved out
+            write_notebook(tmp_path / "outside" / "notebook3.ipynb", "d = 4")
+            (tmp_path / "outside").rename(template_dir / "subfolder")
+            expected = {"renamed.ipynb": ["b"], "subfolder/notebook3.ipynb": ["d"]}
+            assert await wait_for_listing(index, template_dir, expected) == expected
+
+            write_notebook(template_dir / "subfolder" / "deeper" / "notebook4.ipynb", "e = 5")
+            expected["subfolder/deeper/notebook4.ipynb"] = ["e"]
+            assert await wait_for_listing(index, template_dir, expected) == expected
+
+            (template_dir / "subfolder").rename(tmp_path / "outside")
+            expected = {"renamed.ipynb": ["b"]}
+            assert await wait_for_listing(index, template_dir, expected) == expected
+
+            # Removed folder
+            write_notebook(template_dir / "removed" / "notebook5.ipynb", "f = 6")
+            expected = {"renamed.ipynb": ["b"], "removed/notebook5.ipynb": ["f"]}
+            assert await wait_for_listing(index, template_dir, expected) == expected
+            shutil.rmtree(str(template_dir / "removed"))
+            expected = {"renamed.ipynb": ["b"]}
+            assert await wait_for_listing(index, template_dir, expected) == expected
+
+        # Only the added folders were scanned
+        assert {c.args[0] for c in scan.call_args_list} == {
+            template_dir.resolve() / "subfolder",
+            template_dir.resolve() / "subfolder" / "deeper",
+            template_dir.resolve() / "removed",
+        }
+    finally:
+        watcher.stop()
+
+    # The folder is scanned again once unwatched
+    write_notebook(template_dir / "notebook6.ipynb", "g = 7")
+    templates = await index.list_templates(template_dir)
+    assert [t["path"] for t in templates] == ["notebook6.ipynb", "renamed.ipynb"]
+
+
+async def test_watcher_polling(tmp_path):
+    template_dir = tmp_path / "templates"
+    write_notebook(template_dir / "notebook1.ipynb")
+    index = TemplateIndex()
+    watcher = TemplateWatcher(template_dir, index, poll_interval=0.05)
+    with patch("papermill_report.watcher.Inotify", side_effect=OSError("unavailable")):
+        await watcher.start()
+    try:
+        assert watcher.polling
+
+        write_notebook(template_dir / "notebook2.ipynb", "b = 2")
+        expected = {"notebook1.ipynb": ["a"], "notebook2.ipynb": ["b"]}
+        assert await wait_for_listing(index, template_dir, expected) == expected
+    finally:
+        watcher.stop()
+
+
+async def test_watcher_folder_replaced(tmp_path):
+    template_dir = tmp_path / "templates"
+    write_notebook(template_dir / "notebook1.ipynb")
+    index = TemplateIndex()
+    watcher = TemplateWatcher(template_dir, index, delay=0.01)
+    await watcher.start()
+    try:
+        template_dir.rename(tmp_path / "old")
+        write_notebook(template_dir / "notebook2.ipynb", "b = 2")
+        expected = {"notebook2.ipynb": ["b"]}
+        assert await wait_for_listing(index, template_dir, expected) == expected
+
+        # The new folder is watched
+        write_notebook(template_dir / "notebook3.ipynb", "c = 3")
+        expected = {"notebook2.ipynb": ["b"], "notebook3.ipynb": ["c"]}
+        assert await wait_for_listing(index, template_dir, expected) == expected
+        assert not watcher.polling
+        assert list(watcher._folders.values()) == ["."]
+    finally:
+        watcher.stop()
+
+
+async def test_watcher_overflow(tmp_path):
+    template_dir = tmp_path / "templates"
+    write_notebook(template_dir / "notebook1.ipynb")
+    index = TemplateIndex()
+    watcher = TemplateWatcher(template_dir, index, poll_interval=0.05, delay=0.01)
+    await watcher.start()
+    try:
+        # The watches cannot be created again after the events queue overflow
+        with patch("papermill_report.watcher.Inotify", side_effect=OSError("unavailable")):
+            watcher._rescan = True
+            watcher._schedule_update()
+            await asyncio.wait_for(watcher._update, 5)
+        assert watcher.polling
+
+        write_notebook(template_dir / "notebook2.ipynb", "b = 2")
+        expected = {"notebook1.ipynb": ["a"], "notebook2.ipynb": ["b"]}
+        assert await wait_for_listing(index, template_dir, expected) == expected
+    finally:
+        watcher.stop()
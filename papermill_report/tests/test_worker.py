@@ -0,0 +1,111 @@
+import asyncio
+import json
+import os
+
+import pytest
+from nbformat.v4 import new_code_cell, new_notebook
+from papermill.exceptions import PapermillExecutionError
+
+from papermill_report.execution import ExecutionError, WorkerExecutor
+from papermill_report.utils import ANONYMOUS_USER
+
+
+@pytest.fixture
+def template(tmp_path, notebook_metadata):
+    path = tmp_path / "template.ipynb"
+    notebook = new_notebook(
+        cells=[
+            new_code_cell("name = 'world'", metadata={"tags": ["parameters"]}),
+            new_code_cell("assert name != 'boom', name\nf'Hello {name}!'"),
+        ],
+        metadata=notebook_metadata,
+    )
+    path.write_text(json.dumps(notebook))
+    return path
+
+
+async def test_worker_reused(tmp_path, template, make_job):
+    executor = WorkerExecutor()
+    try:
+        first = await executor.execute(make_job(template, {"name": "Alice"}, "first"))
+        worker = await executor._get_worker(ANONYMOUS_USER)
+        second = await executor.execute(make_job(template, {"name": "Bob"}, "second"))
+        assert await executor._get_worker(ANONYMOUS_USER) is worker
+    finally:
+        executor.shutdown()
+
+    # The report is written by the worker in the job output folder
+    assert first == tmp_path / "first" / "template.html"
+    assert "Hello Alice!" in first.read_text()
+    assert "Hello Bob!" in second.read_text()
+    assert not worker.is_alive() or worker.process.stdin.is_closing()
+
+
+async def test_worker_phases(template, make_job):
+    phases = []
+    executor = WorkerExecutor()
+    try:
+        await executor.execute(
+            make_job(template, {}, "phases", lambda *phase: phases.append(phase))
+        )
+    finally:
+        executor.shutdown()
+
+    assert [name for name, _, _ in phases] == ["execution", "conversion"]
+    assert phases[0][1] <= phases[1][1]
+    assert all(duration > 0 for _, _, duration in phases)
+
+
+async def test_worker_error(template, make_job):
+    phases = []
+    executor = WorkerExecutor()
+    try:
+        with pytest.raises(ExecutionError) as info:
+            await executor.execute(
+                make_job(template, {"name": "boom"}, "error", lambda *p: phases.append(p))
+            )
+    finally:
+        executor.shutdown()
+
+    assert [name for name, _, _ in phases] == ["execution"]
+
+    assert isinstance(info.value.error, PapermillExecutionError)
+    assert info.value.error.ename == "AssertionError"
+    assert info.value.notebook is not None and info.value.notebook.exists()
+
+
+@pytest.mark.skipif(not os.path.exists("/proc"), reason="Requires /proc")
+async def test_worker_cancel(tmp_path, notebook_metadata, make_job):
+    pid_file = tmp_path / "pid"
+    template = tmp_path / "slow.ipynb"
+    notebook = new_notebook(
+        cells=[
+            new_code_cell(
+                f"import os, time\nopen({str(pid_file)!r}, 'w').write(str(os.getpid()))\ntime.sleep(60)"
+            ),
+        ],
+        metadata=notebook_metadata,
+    )
+    template.write_text(json.dumps(notebook))
+    executor = WorkerExecutor()
+    try:
+        task = asyncio.ensure_future(executor.execute(make_job(template, {}, "cancel")))
+        for _ in range(200):
+            if pid_file.exists() and pid_file.read_text():
+                break
+            await asyncio.sleep(0.1)
+        pid = int(pid_file.read_text())
+        worker = await executor._get_worker(ANONYMOUS_USER)
+
+        task.cancel()
+        with pytest.raises(asyncio.CancelledError):
+            await task
+        for _ in range(50):
+            if not os.path.exists(f"/proc/{pid}"):
+                break
+            await asyncio.sleep(0.1)
+
+        assert not os.path.exists(f"/proc/{pid}")
+        assert worker.is_alive()
+    finally:
+        executor.shutdown()
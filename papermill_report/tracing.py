@@ -0,0 +1,220 @@
+"""Lightweight phase timing traces of the requests."""
+import itertools
+import json
+import logging
+import os
+import time
+import typing as tp
+from pathlib import Path
+
+from tornado.log import app_log
+
+
+class Span:
+    """Timed phase of a request.
+
+    Args:
+        name: Phase name
+        start: Start timestamp
+        duration: Duration in seconds; None while running
+    """
+
+    def __init__(self, name: str, start: float, duration: tp.Optional[float] = None):
+        self.name = name
+        self.start = start
+        self.duration = duration
+        self.children = []  # type: tp.List[Span]
+
+    def walk(self) -> tp.Iterator["Span"]:
+        """Iterate over the span and its descendants depth-first.
+
+        Returns:
+            The spans iterator
+        """
+        yield self
+        for child in self.children:
+            yield from child.walk()
+
+    def to_dict(self) -> tp.Dict[str, tp.Any]:
+        """Serialize the span tree in JSON.
+
+        Returns:
+            The span ``name``, ``start`` timestamp, ``duration`` in milliseconds and ``children``
+        """
+        return {
+            "name": self.name,
+            "start": self.start,
+            "duration": None if self.duration is None else round(self.duration * 1000, 3),
+            "children": [child.to_dict() for child in self.children],
+        }
+
+
+class _SpanTimer:
+    """Context timing a span."""
+
+    def __init__(self, trace: "RequestTrace", name: str):
+        self._trace = trace
+        self._name = name
+        self._span = None  # type: tp.Optional[Span]
+        self._clock = None  # type: tp.Optional[float]
+
+    def __enter__(self) -> Span:
+        self._span = Span(self._name, time.time())
+        self._trace._current.children.append(self._span)
+        self._trace._stack.append(self._span)
+        self._clock = time.monotonic()
+        return self._span
+
+    def __exit__(self, *args):
+        self._span.duration = time.monotonic() - self._clock
+        self._trace._stack.remove(self._span)
+
+
+class _EnteringTimer:
+    """Asynchronous context timing the entry of another one."""
+
+    def __init__(self, trace: "RequestTrace", name: str, context: tp.Any):
+        self._trace = trace
+        self._name = name
+        self._context = context
+
+    async def __aenter__(self) -> tp.Any:
+        with self._trace.span(self._name):
+            return await self._context.__aenter__()
+
+    async def __aexit__(self, *args):
+        return await self._context.__aexit__(*args)
+
+
+class RequestTrace:
+    """Span tree of a request.
+
+    The spans opened while another one is running are its children.
+
+    Example:
+
+        with trace.span("git_update"):
+            await repository.refresh()
+
+    Args:
+        name: Request name
+        start: Request start timestamp; now if None
+    """
+
+    def __init__(self, name: str, start: tp.Optional[float] = None):
+        self.root = Span(name, time.time() if start is None else start)
+        self._stack = [self.root]
+
+    @property
+    def _current(self) -> Span:
+        return self._stack[-1]
+
+    def span(self, name: str) -> _SpanTimer:
+        """Time a phase.
+
+        Args:
+            name: Phase name
+
+        Returns:
+            Context timing its body
+        """
+        return _SpanTimer(self, name)
+
+    def span_entering(self, name: str, context: tp.Any) -> _EnteringTimer:
+        """Time the entry of an asynchronous context (e.g. waiting for a resource).
+
+        Args:
+            name: Phase name
+            context: Asynchronous context
+
+        Returns:
+            Asynchronous context wrapping it
+        """
+        return _EnteringTimer(self, name, context)
+
+    def add(self, name: str, start: float, duration: float):
+        """Add a phase timed elsewhere (e.g. in another process).
+
+        Args:
+            name: Phase name
+            start: Start timestamp
+            duration: Duration in seconds
+        """
+        self._current.children.append(Span(name, start, duration))
+
+    def finish(self, duration: float):
+        """Close the request span.
+
+        Args:
+            duration: Request duration in seconds
+        """
+        self.root.duration = duration
+
+    def server_timing(self, elapsed: float) -> str:
+        """Format the completed spans as a ``Server-Timing`` header.
+
+        Args:
+            elapsed: Time in seconds elapsed since the request start
+
+        Returns:
+            The header value with the request ``total`` duration so far
+        """
+        metrics = [
+            f"{span.name};dur={span.duration * 1000:.1f}"
+            for span in itertools.islice(self.root.walk(), 1, None)
+            if span.duration is not None
+        ]
+        metrics.append(f"total;dur={elapsed * 1000:.1f}")
+        return ", ".join(metrics)
+
+
+class TraceExporter:
+    """Append the request traces to a file in the Chrome trace event format.
+
+    The file is a JSON array of complete events (``"ph": "X"``) whose closing
+    bracket is omitted, as allowed by the format, so the traces are appended
+    without rewriting it. It can be loaded in ``chrome://tracing`` or Perfetto.
+    Each request is displayed on its own row.
+
+    Args:
+        trace_file: Export file path
+        log: Logger
+    """
+
+    def __init__(self, trace_file: str, log: tp.Optional[logging.Logger] = None):
+        self.trace_file = Path(trace_file)
+        self.log = log or app_log
+        self._ids = itertools.count(1)
+
+    def _events(self, trace: RequestTrace, tid: int) -> tp.Iterator[tp.Dict[str, tp.Any]]:
+        pid = os.getpid()
+        for span in trace.root.walk():
+            if span.duration is None:
+                continue
+            yield {
+                "name": span.name,
+                "cat": "request" if span is trace.root else "phase",
+                "ph": "X",
+                "ts": round(span.start * 1e6),
+                "dur": round(span.duration * 1e6),
+                "pid": pid,
+                "tid": tid,
+            }
+
+    def export(self, trace: RequestTrace):
+        """Append a request trace to the export file.
+
+        Args:
+            trace: Finished request trace
+        """
+        events = "".join(
+            json.dumps(event) + ",\n" for event in self._events(trace, next(self._ids))
+        )
+        try:
+            self.trace_file.parent.mkdir(parents=True, exist_ok=True)
+            with self.trace_file.open("a", encoding="utf-8") as stream:
+                if stream.tell() == 0:
+                    stream.write("[\n")
+                stream.write(events)
+        except OSError:
+            self.log.warning(f"Unable to export the trace in '{self.trace_file!s}'.", exc_info=True)
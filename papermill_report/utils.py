@@ -1,9 +1,139 @@
+import asyncio
+import hashlib
+import json
+import logging
 import os
+import shutil
+import signal
+import sys
+import tempfile
+import threading
 import typing as tp
 from asyncio.subprocess import PIPE, create_subprocess_exec
+from collections import defaultdict
 from pathlib import Path
 from subprocess import CalledProcessError
 
+import nbformat
+from nbconvert import HTMLExporter
+from tornado.log import app_log
+
+ANONYMOUS_USER = "anonymous_pm_report"
+
+try:
+    import pwd
+except ImportError:  # None Unix
+    pwd = None
+
+try:
+    import psutil
+except ImportError:  # Optional dependency
+    psutil = None
+
+
+def is_impersonated(username: str) -> bool:
+    """Whether the reports of a user are generated impersonating the user.
+
+    Args:
+        username: User name
+
+    Returns:
+        True if the report processes are executed as the user
+    """
+    return pwd is not None and username != ANONYMOUS_USER
+
+
+def git_blob_sha(content: bytes) -> str:
+    """Compute the git blob SHA of a file content.
+
+    This is the identifier ``git hash-object`` would return for the content.
+
+    Args:
+        content: File content
+
+    Returns:
+        The hexadecimal blob SHA
+    """
+    digest = hashlib.sha1(f"blob {len(content)}\0".encode("ascii"))
+    digest.update(content)
+    return digest.hexdigest()
+
+
+_local = threading.local()
+
+
+def convert_to_html(notebook: nbformat.NotebookNode) -> str:
+    """Convert a notebook to HTML.
+
+    The exporter is created once per thread.
+
+    Args:
+        notebook: Notebook to convert
+
+    Returns:
+        The HTML page
+    """
+    exporter = getattr(_local, "html_exporter", None)
+    if exporter is None:
+        exporter = _local.html_exporter = HTMLExporter()
+    html, _ = exporter.from_notebook_node(notebook)
+    return html
+
+
+def _descendants(pid: int) -> tp.List[int]:
+    """List the descendants of a process from ``/proc``.
+
+    Args:
+        pid: Process identifier
+
+    Returns:
+        The descendant process identifiers; empty if ``/proc`` is not available
+    """
+    children = defaultdict(list)  # type: tp.Dict[int, tp.List[int]]
+    for stat_file in Path("/proc").glob("[0-9]*/stat"):
+        try:
+            # The command name in parenthesis may contain spaces
+            parent = int(stat_file.read_text().rsplit(")", 1)[1].split()[1])
+        except (OSError, IndexError, ValueError):
+            continue  # Process exited meanwhile
+        children[parent].append(int(stat_file.parent.name))
+
+    descendants = []
+    stack = [pid]
+    while stack:
+        for child in children.get(stack.pop(), []):
+            descendants.append(child)
+            stack.append(child)
+    return descendants
+
+
+def kill_process_tree(pid: int, sig: int = signal.SIGKILL):
+    """Kill a process and all its descendants.
+
+    The descendants are listed before signaling any process as they are
+    re-parented when their parent dies. Kernels are started in their own
+    session, so killing the process group is not enough.
+
+    Args:
+        pid: Root process identifier
+        sig: Signal to send
+    """
+    if psutil is not None:
+        try:
+            process = psutil.Process(pid)
+            processes = [process] + process.children(recursive=True)
+        except psutil.NoSuchProcess:
+            return
+        pids = [p.pid for p in processes]
+    else:
+        pids = [pid] + _descendants(pid)
+
+    for process_id in pids:
+        try:
+            os.kill(process_id, sig)
+        except (ProcessLookupError, PermissionError):
+            pass
+
 
 async def _execute_command(cmd: tp.List[str], cwd: Path) -> tp.Tuple[int, str, str]:
     """Execute the command in the provided directory
@@ -19,9 +149,13 @@ async def _execute_command(cmd: tp.List[str], cwd: Path) -> tp.Tuple[int, str, s
         CalledProcessError if the return code is non-zero
     """
     process = await create_subprocess_exec(
-        *cmd, cwd=cwd, stdout=PIPE, stderr=PIPE, env=os.environ
+        *cmd, cwd=cwd, stdout=PIPE, stderr=PIPE, env=os.environ, start_new_session=True
     )
-    output, error = await process.communicate()
+    try:
+        output, error = await process.communicate()
+    except asyncio.CancelledError:
+        kill_process_tree(process.pid)
+        raise
 
     if process.returncode != 0:
         raise CalledProcessError(
@@ -70,3 +204,114 @@ async def update_git_repository(
         await _execute_command(
             ("git", "pull", git_url, "master"), cwd=str(template_root_dir)
         )
+
+
+def write_message(stream: tp.IO, message: tp.Dict):
+    """Write a JSON line message on a stream.
+
+    Args:
+        stream: Text stream
+        message: Message to send
+    """
+    stream.write(json.dumps(message) + "\n")
+    stream.flush()
+
+
+class LocalServer:
+    """Handle of a helper process serving requests on a unix socket.
+
+    The process is started with ``python -m <module> <arguments> <socket>``
+    through ``su <user> -l -c`` when impersonating a user. It must write a JSON
+    status line on its standard output once ready (``{"status": "ready"}``)
+    and exit when its standard input is closed. Requests and replies are
+    JSON lines.
+
+    Args:
+        module: Python module to execute
+        arguments: Module command line arguments
+        username: User running the process if impersonated, None otherwise
+        log: Logger
+    """
+
+    def __init__(
+        self,
+        module: str,
+        arguments: tp.List[str],
+        username: tp.Optional[str] = None,
+        log: tp.Optional[logging.Logger] = None,
+    ):
+        self.module = module
+        self.arguments = arguments
+        self.username = username
+        self.log = log or app_log
+        self.folder = None  # type: tp.Optional[str]
+        self.process = None  # type: tp.Optional[asyncio.subprocess.Process]
+
+    @property
+    def socket_path(self) -> str:
+        """str: Unix socket path of the server."""
+        return os.path.join(self.folder, "server.sock")
+
+    def is_alive(self) -> bool:
+        """Whether the server process is running."""
+        return self.process is not None and self.process.returncode is None
+
+    async def start(self) -> tp.Dict:
+        """Start the process and wait for its status.
+
+        Returns:
+            The process status; ``status`` is ``ready`` if it is serving
+
+        Raises:
+            RuntimeError: If the process exits without status
+        """
+        self.folder = tempfile.mkdtemp(prefix="pm_report_server_")
+        command = [sys.executable, "-m", self.module, *self.arguments, self.socket_path]
+        if self.username is not None:
+            user = pwd.getpwnam(self.username)
+            os.chown(self.folder, user.pw_uid, user.pw_gid)
+            command = ["su", self.username, "-l", "-c", " ".join(command)]
+
+        self.process = await create_subprocess_exec(
+            *command, stdin=PIPE, stdout=PIPE, cwd=self.folder
+        )
+        line = await self.process.stdout.readline()
+        if not line:
+            self.stop()
+            raise RuntimeError(f"Process '{self.module}' exited before being ready.")
+        status = json.loads(line)
+        if status["status"] != "ready":
+            self.stop()
+        return status
+
+    async def request(self, message: tp.Dict) -> tp.AsyncIterator[tp.Dict]:
+        """Send a request to the server.
+
+        Args:
+            message: Request
+
+        Yields:
+            The replies until the server closes the connection
+        """
+        # The replies are short status lines; the reports are exchanged through files
+        reader, writer = await asyncio.open_unix_connection(self.socket_path, limit=2 ** 20)
+        try:
+            writer.write((json.dumps(message) + "\n").encode("utf-8"))
+            await writer.drain()
+            line = await reader.readline()
+            while line:
+                yield json.loads(line)
+                line = await reader.readline()
+        finally:
+            writer.close()
+
+    def stop(self):
+        """Stop the process; the requests being served may be interrupted."""
+        if self.is_alive():
+            self.process.stdin.close()
+            try:
+                self.process.send_signal(signal.SIGTERM)
+            except ProcessLookupError:
+                pass
+        if self.folder is not None:
+            shutil.rmtree(self.folder, ignore_errors=True)
@@ -0,0 +1,319 @@
+"""Watch the templates folder to keep its index current."""
+import asyncio
+import ctypes
+import ctypes.util
+import errno
+import logging
+import os
+import struct
+import sys
+import typing as tp
+from pathlib import Path
+
+from tornado.log import app_log
+
+from .index import TemplateIndex
+
+# inotify(7) flags
+IN_ATTRIB = 0x00000004
+IN_CLOSE_WRITE = 0x00000008
+IN_MOVED_FROM = 0x00000040
+IN_MOVED_TO = 0x00000080
+IN_CREATE = 0x00000100
+IN_DELETE = 0x00000200
+IN_DELETE_SELF = 0x00000400
+IN_MOVE_SELF = 0x00000800
+IN_Q_OVERFLOW = 0x00004000
+IN_IGNORED = 0x00008000
+IN_ONLYDIR = 0x01000000
+IN_ISDIR = 0x40000000
+IN_NONBLOCK = os.O_NONBLOCK
+IN_CLOEXEC = getattr(os, "O_CLOEXEC", 0o2000000)
+
+WATCH_MASK = (
+    IN_CLOSE_WRITE
+    | IN_ATTRIB
+    | IN_MOVED_FROM
+    | IN_MOVED_TO
+    | IN_CREATE
+    | IN_DELETE
+    | IN_DELETE_SELF
+    | IN_MOVE_SELF
+    | IN_ONLYDIR
+)
+"""Events watched on each folder."""
+
+_EVENT_HEADER = struct.Struct("iIII")
+
+
+class Inotify:
+    """Minimal binding of the Linux inotify API.
+
+    Raises:
+        OSError: If inotify is not available
+    """
+
+    def __init__(self):
+        if not sys.platform.startswith("linux"):
+            raise OSError(errno.ENOSYS, "inotify is only available on Linux.")
+        self._libc = ctypes.CDLL(ctypes.util.find_library("c") or "libc.so.6", use_errno=True)
+        if not hasattr(self._libc, "inotify_init1"):
+            raise OSError(errno.ENOSYS, "inotify is not available.")
+        self.fd = self._libc.inotify_init1(IN_NONBLOCK | IN_CLOEXEC)
+        if self.fd < 0:
+            error = ctypes.get_errno()
+            raise OSError(error, os.strerror(error))
+
+    def add_watch(self, path: str, mask: int = WATCH_MASK) -> int:
+        """Watch a folder.
+
+        Args:
+            path: Folder path
+            mask: Watched events
+
+        Returns:
+            The watch descriptor
+
+        Raises:
+            OSError: If the folder cannot be watched (e.g. too many watches)
+        """
+        wd = self._libc.inotify_add_watch(self.fd, os.fsencode(path), mask)
+        if wd < 0:
+            error = ctypes.get_errno()
+            raise OSError(error, os.strerror(error), path)
+        return wd
+
+    def remove_watch(self, wd: int):
+        """Stop watching a folder.
+
+        Args:
+            wd: Watch descriptor
+        """
+        self._libc.inotify_rm_watch(self.fd, wd)
+
+    def read_events(self) -> tp.List[tp.Tuple[int, int, int, str]]:
+        """Read the pending events.
+
+        Returns:
+            The (watch descriptor, mask, cookie, name) of the events
+        """
+        events = []
+        while True:
+            try:
+                data = os.read(self.fd, 64 * 1024)
+            except BlockingIOError:
+                return events
+            offset = 0
+            while offset < len(data):
+                wd, mask, cookie, length = _EVENT_HEADER.unpack_from(data, offset)
+                offset += _EVENT_HEADER.size
+                name = os.fsdecode(data[offset : offset + length].rstrip(b"\0"))
+                offset += length
+                events.append((wd, mask, cookie, name))
+
+    def close(self):
+        """Release the inotify instance."""
+        os.close(self.fd)
+
+
+class TemplateWatcher:
+    """Keep the index of a templates folder current.
+
+    The folder is scanned once, then the notebooks added, modified, removed
+    or renamed are updated one by one in the index from the inotify events
+    (on Linux), so the templates listings are served from memory. The events
+    are coalesced during a short delay. If events are lost (queue overflow) or
+    the templates folder itself is removed or moved, the watches are created
+    again and the folder is scanned again. Without inotify (or if the folders
+    cannot be watched), the folder is scanned periodically.
+
+    Args:
+        template_dir: Templates folder
+        index: Templates index
+        poll_interval: Period in seconds of the folder scan without inotify
+        delay: Delay in seconds coalescing the events
+        log: Logger
+    """
+
+    def __init__(
+        self,
+        template_dir: tp.Union[str, Path],
+        index: TemplateIndex,
+        poll_interval: float = 5.0,
+        delay: float = 0.1,
+        log: tp.Optional[logging.Logger] = None,
+    ):
+        self.template_dir = Path(template_dir).resolve()
+        self.index = index
+        self.poll_interval = poll_interval
+        self.delay = delay
+        self.log = log or app_log
+        self._inotify = None  # type: tp.Optional[Inotify]
+        # {watch descriptor: folder relative to the templates folder}
+        self._folders = {}  # type: tp.Dict[int, str]
+        # Paths changed since the last index update
+        self._changed = set()  # type: tp.Set[str]
+        self._rescan = False
+        # Whether the initial scan is done
+        self._ready = False
+        self._update = None  # type: tp.Optional[asyncio.Future]
+        self._poll = None  # type: tp.Optional[asyncio.Future]
+
+    @property
+    def polling(self) -> bool:
+        """bool: Whether the folder is scanned periodically instead of using inotify."""
+        return self._poll is not None
+
+    async def start(self):
+        """Scan the folder and start watching it."""
+        self._start_inotify()
+        # The events received during the scan are applied afterwards
+        await self.index.list_templates(self.template_dir, rescan=True)
+        self.index.watch(self.template_dir)
+        self._ready = True
+        if self._inotify is None:
+            self._poll = asyncio.ensure_future(self._poll_folder())
+        else:
+            self._schedule_update()
+
+    def stop(self):
+        """Stop watching the folder."""
+        self.index.watch(self.template_dir, False)
+        self._close_inotify()
+        for task in (self._poll, self._update):
+            if task is not None:
+                task.cancel()
+        self._poll = None
+        self._update = None
+        self._ready = False
+
+    def _start_inotify(self):
+        """Watch the folder tree with a new inotify instance.
+
+        On failure, the folder is left unwatched so it is scanned periodically.
+        """
+        try:
+            if not self.template_dir.is_dir():
+                raise OSError(errno.ENOENT, "No such folder", str(self.template_dir))
+            self._inotify = Inotify()
+            self._watch_tree(".")
+        except OSError as error:
+            self.log.warning(
+                f"Unable to watch the templates folder '{self.template_dir!s}' with inotify"
+                f" ({error!s}); it will be scanned every {self.poll_interval}s."
+            )
+            self._close_inotify()
+        else:
+            asyncio.get_event_loop().add_reader(self._inotify.fd, self._read_events)
+
+    def _close_inotify(self):
+        if self._inotify is not None:
+            try:
+                asyncio.get_event_loop().remove_reader(self._inotify.fd)
+            finally:
+                self._inotify.close()
+            self._inotify = None
+        self._folders = {}
+
+    def _watch_tree(self, folder: str):
+        """Watch a folder and its subfolders.
+
+        Args:
+            folder: Folder relative to the templates folder
+        """
+        for root, _, _ in os.walk(str(self.template_dir / folder)):
+            wd = self._inotify.add_watch(root)
+            self._folders[wd] = os.path.relpath(root, str(self.template_dir))
+
+    def _unwatch_tree(self, folder: str):
+        """Stop watching a folder and its subfolders moved elsewhere.
+
+        Args:
+            folder: Folder relative to the templates folder
+        """
+        for wd, path in list(self._folders.items()):
+            if path == folder or path.startswith(folder + os.sep):
+                self._inotify.remove_watch(wd)
+                del self._folders[wd]
+
+    def _read_events(self):
+        """Record the paths of the pending inotify events."""
+        for wd, mask, _, name in self._inotify.read_events():
+            if mask & IN_Q_OVERFLOW:
+                self._rescan = True
+                continue
+            folder = self._folders.get(wd)
+            if folder is None:
+                continue
+            if mask & IN_IGNORED:
+                del self._folders[wd]
+                continue
+            if mask & (IN_DELETE_SELF | IN_MOVE_SELF):
+                if folder == ".":  # The templates folder itself
+                    self._rescan = True
+                continue
+
+            path = os.path.normpath(os.path.join(folder, name))
+            if mask & IN_ISDIR:
+                if mask & (IN_CREATE | IN_MOVED_TO):
+                    try:
+                        self._watch_tree(path)
+                    except OSError:
+                        self.log.warning(
+                            f"Unable to watch the templates folder '{path}'.", exc_info=True
+                        )
+                        self._rescan = True
+                elif mask & IN_MOVED_FROM:
+                    self._unwatch_tree(path)
+                self._changed.add(path)
+            elif name.endswith(".ipynb"):
+                self._changed.add(path)
+
+        self._schedule_update()
+
+    def _schedule_update(self):
+        if self._ready and (self._changed or self._rescan) and self._update is None:
+            self._update = asyncio.ensure_future(self._update_index())
+
+    async def _update_index(self):
+        """Apply the changes to the index once the events are coalesced."""
+        try:
+            while self._changed or self._rescan:
+                await asyncio.sleep(self.delay)
+                changed, self._changed = self._changed, set()
+                rescan, self._rescan = self._rescan, False
+                try:
+                    if rescan:
+                        # Events were lost or the watches of the templates folder are gone
+                        self._close_inotify()
+                        self._changed.clear()
+                        self._start_inotify()
+                        if self._inotify is None:
+                            self._poll = asyncio.ensure_future(self._poll_folder())
+                        await self.index.list_templates(self.template_dir, rescan=True)
+                    else:
+                        await self.index.update_templates(self.template_dir, changed)
+                except asyncio.CancelledError:
+                    raise
+                except Exception:
+                    self.log.warning(
+                        f"Unable to update the index of the templates folder"
+                        f" '{self.template_dir!s}'.",
+                        exc_info=True,
+                    )
+        finally:
+            self._update = None
+
+    async def _poll_folder(self):
+        """Scan the folder periodically."""
+        while True:
+            await asyncio.sleep(self.poll_interval)
+            try:
+                await self.index.list_templates(self.template_dir, rescan=True)
+            except asyncio.CancelledError:
+                raise
+            except Exception:
+                self.log.warning(
+                    f"Unable to scan the templates folder '{self.template_dir!s}'.",
+                    exc_info=True,
+                )
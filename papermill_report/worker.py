@@ -0,0 +1,217 @@
+"""Long-lived worker executing the templates and converting them to HTML.
+
+The worker is started with::
+
+    python -m papermill_report.worker <socket>
+
+It writes a JSON status line on its standard output once ready and exits when
+its standard input is closed. A request is a JSON line ``{"template": "<path>",
+"parameters": {...}, "output": "<notebook path>"}`` sent on the unix socket.
+Each request is executed in its own thread with papermill Python API and the
+executed notebook is converted with a cached HTML exporter in a ``.html`` file
+next to the executed notebook. The reply is a JSON line ``{"status": "ok",
+"report": "<report path>"}`` or ``{"status": "error", "stage": "execute" or
+"convert", "error": {...}}``; both have the ``phases``
+``{"execution": [start timestamp, duration], "conversion": [...]}`` run. Closing the connection
+before the reply cancels the request by killing its kernel.
+"""
+import argparse
+import json
+import logging
+import socketserver
+import sys
+import threading
+import time
+import traceback
+import typing as tp
+from pathlib import Path
+
+import papermill as pm
+from papermill.exceptions import PapermillExecutionError
+from papermill.iorw import load_notebook_node
+from papermill.utils import nb_kernel_name
+
+from .kernels import UserKernelManager, kill_kernel
+from .utils import LocalServer, convert_to_html, write_message
+
+
+def serialize_error(error: BaseException) -> tp.Dict:
+    """Serialize an execution error in JSON.
+
+    Args:
+        error: Error to serialize
+
+    Returns:
+        The error description; papermill execution errors keep all their attributes
+    """
+    if isinstance(error, PapermillExecutionError):
+        return {
+            "cell_index": error.cell_index,
+            "exec_count": error.exec_count,
+            "source": error.source,
+            "ename": error.ename,
+            "evalue": error.evalue,
+            "traceback": error.traceback,
+        }
+    return {
+        "ename": type(error).__name__,
+        "evalue": str(error),
+        "traceback": traceback.format_exception(type(error), error, error.__traceback__),
+    }
+
+
+def load_error(description: tp.Dict) -> Exception:
+    """Rebuild a serialized execution error.
+
+    Args:
+        description: Error serialized with `serialize_error`
+
+    Returns:
+        A papermill execution error or a runtime error
+    """
+    if "cell_index" in description:
+        return PapermillExecutionError(**description)
+    return RuntimeError(f"{description['ename']}: {description['evalue']}")
+
+
+def execute_request(request: tp.Dict, manager: tp.Optional[UserKernelManager] = None) -> tp.Dict:
+    """Execute a template and convert it to HTML.
+
+    Args:
+        request: Request with the template path, the parameters and the output notebook path
+        manager: Kernel manager starting the template kernel; papermill creates one if None
+
+    Returns:
+        The reply with the HTML report path or the error
+    """
+    reply = {"status": "ok", "phases": {}}  # type: tp.Dict[str, tp.Any]
+    start = time.time()
+    try:
+        if manager is not None:
+            manager.kernel_name = nb_kernel_name(load_notebook_node(request["template"]))
+        notebook = pm.execute_notebook(
+            request["template"],
+            request["output"],
+            parameters=request["parameters"],
+            progress_bar=False,
+            request_save_on_cell_execute=True,
+            km=manager,
+        )
+    except Exception as error:
+        reply.update(status="error", stage="execute", error=serialize_error(error))
+        return reply
+    finally:
+        reply["phases"]["execution"] = [start, time.time() - start]
+
+    start = time.time()
+    try:
+        report = Path(request["output"]).with_suffix(".html")
+        report.write_text(convert_to_html(notebook), encoding="utf-8")
+        reply["report"] = str(report)
+    except Exception as error:
+        reply.update(status="error", stage="convert", error=serialize_error(error))
+    finally:
+        reply["phases"]["conversion"] = [start, time.time() - start]
+    return reply
+
+
+class _RequestHandler(socketserver.StreamRequestHandler):
+    def handle(self):
+        request = json.loads(self.rfile.readline())
+        manager = UserKernelManager()
+        done = threading.Event()
+
+        def watch_client():
+            # The client closes the connection to cancel the request
+            try:
+                while self.connection.recv(1024):
+                    pass
+            except OSError:
+                pass
+            if not done.is_set():
+                kill_kernel(manager)
+
+        threading.Thread(target=watch_client, daemon=True).start()
+        try:
+            reply = execute_request(request, manager)
+        finally:
+            done.set()
+            if manager.has_kernel:
+                manager.shutdown_kernel(now=True)
+        try:
+            self.wfile.write((json.dumps(reply) + "\n").encode("utf-8"))
+        except OSError:
+            pass  # Cancelled by the client
+
+
+class _Server(socketserver.ThreadingMixIn, socketserver.UnixStreamServer):
+    daemon_threads = True
+
+
+def main(argv: tp.Optional[tp.List[str]] = None):
+    """Start a worker."""
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("socket", help="Unix socket path to listen on")
+    args = parser.parse_args(argv)
+
+    logging.basicConfig(level=logging.WARNING)
+    with _Server(args.socket, _RequestHandler) as server:
+
+        def watch_stdin():
+            sys.stdin.read()
+            server.shutdown()
+
+        threading.Thread(target=watch_stdin, daemon=True).start()
+        write_message(sys.stdout, {"status": "ready"})
+        server.serve_forever()
+
+
+class Worker(LocalServer):
+    """Handle of a worker process.
+
+    Args:
+        username: User running the worker if impersonated, None otherwise
+        log: Logger
+    """
+
+    def __init__(self, username: tp.Optional[str] = None, log: tp.Optional[logging.Logger] = None):
+        super().__init__("papermill_report.worker", [], username, log)
+
+    async def start(self):
+        """Start the worker.
+
+        Raises:
+            RuntimeError: If the worker fails to start
+        """
+        status = await super().start()
+        if status["status"] != "ready":
+            raise RuntimeError(f"Fail to start the report worker: {status}")
+        self.log.debug(f"Report worker started for user '{self.username}'.")
+
+    async def execute(self, template: Path, parameters: tp.Dict[str, tp.Any], output: Path) -> tp.Dict:
+        """Execute a template and convert it to HTML.
+
+        If the execution is cancelled, the connection is closed so the worker
+        kills the template kernel.
+
+        Args:
+            template: Template path
+            parameters: Template parameters
+            output: Executed notebook path
+
+        Returns:
+            The worker reply
+        """
+        request = {"template": str(template), "parameters": parameters, "output": str(output)}
+        replies = [reply async for reply in self.request(request)]
+        if replies:
+            return replies[0]
+        return {
+            "status": "error",
+            "stage": "execute",
+            "error": {"ename": "RuntimeError", "evalue": "The report worker died."},
+        }
+
+
+if __name__ == "__main__":
+    main()